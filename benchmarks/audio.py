@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import namedtuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+import numpy as np  # noqa: E402
+from fakes import LATENCY  # noqa: E402
+
+# The audio-only streams YouTube usually offers
+Stream = namedtuple("Stream", "itag abr subtype codec")
+STREAMS = (
+    Stream(139, "48kbps", "mp4", ["-c:a", "aac", "-b:a", "48k"]),
+    Stream(140, "128kbps", "mp4", ["-c:a", "aac", "-b:a", "128k"]),
+    Stream(249, "50kbps", "webm", ["-c:a", "libopus", "-b:a", "50k"]),
+    Stream(251, "160kbps", "webm", ["-c:a", "libopus", "-b:a", "160k"]),
+)
+EXTENSIONS = {"mp4": "m4a", "webm": "webm"}
+# (quality, Whisper audio format, windowed, silence trimmed); the first two
+# are the previous behaviour without and with windows
+MODES = (
+    ("best", "source", False, False),
+    ("best", "flac", True, False),
+    ("low", "auto", False, False),
+    ("low", "opus", False, False),
+    ("low", "auto", True, False),
+    ("low", "auto", True, True),
+)
+
+
+class StreamQuery:
+    # The subset of pytubefix's StreamQuery that stream selection uses
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def filter(self, only_audio=False):
+        return list(self.streams)
+
+
+def speech_like(seconds, rate=44100, seed=0):
+    # Voiced bursts of a few seconds separated by pauses, with silent intros
+    # and outros as many videos have; stereo like the source uploads
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * rate), dtype=np.float32)
+    position = rate * 5
+    while position < len(audio) - rate * 5:
+        burst = int(rate * rng.uniform(1.0, 6.0))
+        t = np.arange(burst) / rate
+        pitch = rng.uniform(90, 220)
+        voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 8))
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(2, 6) * t)
+        noise = rng.normal(0, 0.005, burst)
+        end = min(len(audio), position + burst)
+        audio[position:end] = (0.2 * voice * envelope + noise)[: end - position]
+        position = end + int(rate * rng.choice([0.2, 0.4, 0.8, 2.5]))
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2")
+    return np.repeat(pcm[:, None], 2, axis=1).tobytes()
+
+
+def encode(encoder, input_args, output_path, options, data=None):
+    subprocess.run(
+        [encoder, "-v", "error", "-y", *input_args, "-vn", *options, output_path],
+        input=data,
+        check=True,
+        capture_output=True,
+    )
+
+
+def duration_of(encoder, path):
+    # Decoded length in seconds; ffprobe is not always around
+    result = subprocess.run(
+        [encoder, "-v", "error", "-i", path, "-ac", "1", "-ar", "16000", "-f", "s16le", "-"],
+        capture_output=True,
+        check=True,
+    )
+    return len(result.stdout) / 32000
+
+
+def make_corpus(encoder, directory, minutes, sources):
+    # {name: (duration, {itag: path})}: every source encoded as each stream
+    corpus = {}
+    inputs = [(os.path.basename(path), ["-i", path], None) for path in sources]
+    for m in minutes if not sources else ():
+        data = speech_like(m * 60, seed=m)
+        inputs.append((f"{m}min", ["-f", "s16le", "-ar", "44100", "-ac", "2", "-i", "-"], data))
+    for name, input_args, data in inputs:
+        paths = {}
+        for stream in STREAMS:
+            path = os.path.join(directory, f"{name}_{stream.itag}.{EXTENSIONS[stream.subtype]}")
+            encode(encoder, input_args, path, stream.codec, data)
+            paths[stream.itag] = path
+        corpus[name] = (duration_of(encoder, paths[STREAMS[1].itag]), paths)
+    return corpus
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download bytes, Whisper upload bytes and transcription time per audio mode"
+    )
+    parser.add_argument("corpus", nargs="*", help="Audio files to use instead of the synthetic corpus")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[1, 10, 30])
+    parser.add_argument("--window", type=int, default=300, help="Window seconds of the windowed modes")
+    parser.add_argument(
+        "--upload-mbps", type=float, default=20.0, help="Bandwidth to the Whisper server, in Mbit/s"
+    )
+    args = parser.parse_args(argv)
+
+    from pydub.utils import get_encoder_name
+    from telemetry import AUDIO_BYTES
+    from whisper_module import WindowedTranscription, transcribe_audio
+    from yt_audiophile import select_audio_stream
+
+    encoder = get_encoder_name()
+    if not shutil.which(encoder):
+        print("ffmpeg is required on the PATH", file=sys.stderr)
+        return 1
+    tmpdir = tempfile.mkdtemp(prefix="youlama_audio_")
+    corpus = make_corpus(encoder, tmpdir, args.minutes, args.corpus)
+    upload_bandwidth = args.upload_mbps * 1e6 / 8
+    transcribed = []
+    bookkeeping = []
+
+    def fake_whisper(path):
+        # Records the audio the server would get; its time is modelled below,
+        # and decoding the file to measure it is not counted as transcoding
+        started = time.perf_counter()
+        transcribed.append(duration_of(encoder, path))
+        bookkeeping.append(time.perf_counter() - started)
+        return [{"start": 0.0, "duration": 0.0, "text": ""}]
+
+    def whisper_bytes():
+        return AUDIO_BYTES.values.get(("whisper",), 0)
+
+    # Download at the benchmark's YouTube bandwidth, upload at --upload-mbps,
+    # Whisper at its real-time factor; transcoding is measured
+    print(
+        f"{'audio':<10} {'mode':<24} {'itag':>4} {'download KB':>11} {'upload KB':>9}"
+        f" {'whisper s':>9} {'transcode s':>11} {'total s':>8}"
+    )
+    for name, (duration, paths) in corpus.items():
+        for quality, audio_format, windowed, trim in MODES:
+            stream = select_audio_stream(StreamQuery(STREAMS), quality=quality)
+            path = paths[stream.itag]
+            download = os.path.getsize(path)
+            before = whisper_bytes()
+            transcribed.clear()
+            bookkeeping.clear()
+            started = time.perf_counter()
+            if windowed:
+                windows = WindowedTranscription(
+                    fake_whisper, window=args.window, audio_format=audio_format, trim=trim
+                )
+                windows.feed(path, download, download, duration)
+                windows.finish(path)
+            else:
+                transcribe_audio(path, fake_whisper, audio_format)
+            transcode = time.perf_counter() - started - sum(bookkeeping)
+            upload = whisper_bytes() - before
+            whisper = sum(transcribed) * LATENCY["whisper_rtf"] + LATENCY["whisper_overhead"]
+            total = download / LATENCY["download_bandwidth"] + transcode + upload / upload_bandwidth + whisper
+            mode = f"{quality}/{audio_format}" + (" windows" if windowed else "") + ("+trim" if trim else "")
+            print(
+                f"{name:<10} {mode:<24} {stream.itag:>4} {download / 1024:>11.0f} {upload / 1024:>9.0f}"
+                f" {whisper:>9.1f} {transcode:>11.2f} {total:>8.1f}"
+            )
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import CORPUS_MINUTES, video_id  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="YouTube Data API calls to list a channel and look up its videos' metadata"
+    )
+    parser.add_argument("--videos", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--time-scale", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="youlama_channel_")
+    os.environ.update(
+        {
+            "LLM_CACHE_PATH": os.path.join(tmpdir, "llm_cache.sqlite3"),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    from fakes import FakeYouTubeClient
+    import video_info
+
+    video_info.get_youtube_client = lambda: FakeYouTubeClient(args.time_scale)
+
+    def per_video(ids):
+        # One videos.list call per video, as before batching
+        for vid in ids:
+            video_info.fetch_videos_info([vid])
+
+    def batched(ids):
+        # A list of plain video URLs: prefetched 50 ids per call
+        video_info.prefetch_video_info(ids)
+        for vid in ids:
+            video_info.get_video_info(vid)
+
+    def channel(ids):
+        # A channel URL: the uploads listing carries the metadata too
+        expanded = video_info.expand_url("https://www.youtube.com/@benchmark")
+        for vid in expanded:
+            video_info.get_video_info(vid)
+
+    methods = {"per video": per_video, "batched": batched, "channel url": channel}
+    print(f"{'videos':>6} {'method':<12} {'calls':>6} {'ms':>9}")
+    for count in args.videos:
+        ids = [video_id(CORPUS_MINUTES[i % len(CORPUS_MINUTES)], i) for i in range(count)]
+        FakeYouTubeClient.uploads = ids
+        for name, fn in methods.items():
+            video_info._info_cache.invalidate()
+            FakeYouTubeClient.calls.clear()
+            started = time.perf_counter()
+            fn(ids)
+            elapsed = time.perf_counter() - started
+            calls = sum(FakeYouTubeClient.calls.values())
+            print(f"{count:>6} {name:<12} {calls:>6} {elapsed * 1000:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
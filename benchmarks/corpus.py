@@ -0,0 +1,63 @@
+import random
+from functools import lru_cache
+
+# Video lengths in minutes, from a short clip to a long podcast or stream
+CORPUS_MINUTES = (1, 10, 30, 60, 120, 180, 300)
+
+# Auto-generated captions average about 150 words per minute, in segments
+# of a few seconds
+WORDS_PER_MINUTE = 150
+SEGMENT_SECONDS = 3.0
+# Bytes per second of the audio-only stream picked by AUDIO_QUALITY: best is
+# itag 140 (AAC 128 kbit/s), low itag 139 (AAC 48 kbit/s)
+AUDIO_STREAMS = {"best": (140, 16000), "low": (139, 6000)}
+
+WORDS = (
+    "the of and to a in is you that it for on was with as i this be at have but not are "
+    "they what all we so from one can there about out if up this just like people know "
+    "think going really time video right now thing things because actually very get "
+    "model data system performance memory network cache latency request server queue "
+    "python library version update code function test build release feature user design "
+    "question answer problem solution example result point idea reason part kind lot way"
+).split()
+
+
+@lru_cache(maxsize=None)
+def make_segments(minutes, seed=0):
+    # Deterministic for a given length and seed, so runs are comparable;
+    # cached so generating the corpus is not part of any measurement.
+    # Callers must not modify the returned segments
+    rng = random.Random(f"{minutes}:{seed}")
+    words_per_segment = WORDS_PER_MINUTE * SEGMENT_SECONDS / 60
+    segments = []
+    start = 0.0
+    end = minutes * 60.0
+    while start < end:
+        count = max(1, int(rng.gauss(words_per_segment, 2)))
+        segments.append(
+            {
+                "start": round(start, 2),
+                "duration": SEGMENT_SECONDS,
+                "text": " ".join(rng.choice(WORDS) for _ in range(count)),
+            }
+        )
+        start += SEGMENT_SECONDS
+    return segments
+
+
+@lru_cache(maxsize=None)
+def make_transcript(minutes, seed=0):
+    return " ".join(segment["text"] for segment in make_segments(minutes, seed))
+
+
+def video_id(minutes, index):
+    # 11 characters like real video ids; the length is recoverable from it
+    return f"m{minutes:04d}i{index:05d}"
+
+
+def minutes_of(video_id):
+    return int(video_id[1:5])
+
+
+def index_of(video_id):
+    return int(video_id[6:])
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import types
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from run import percentile  # noqa: E402
+
+downloads = Counter()
+downloads_lock = threading.Lock()
+
+
+class Stream:
+    # An audio stream whose download takes a while and writes the video ID,
+    # so a job that reads another video's file is caught
+    itag = 140
+    abr = "128kbps"
+    subtype = "mp4"
+
+    def __init__(self, video_id, seconds, on_progress):
+        self.video_id = video_id
+        self.seconds = seconds
+        self.on_progress = on_progress
+        self.filesize = len(video_id) * 1024
+
+    def download(self, output_dir, filename, skip_existing=True):
+        with downloads_lock:
+            downloads[self.video_id] += 1
+        data = self.video_id.encode() * 1024
+        with open(os.path.join(output_dir, filename), "wb") as f:
+            for i in range(4):
+                time.sleep(self.seconds / 4)
+                part = data[i * len(data) // 4 : (i + 1) * len(data) // 4]
+                f.write(part)
+                self.on_progress(self, part, self.filesize - f.tell())
+
+
+class StreamQuery:
+    def __init__(self, streams):
+        self.streams = streams
+
+    def filter(self, only_audio=False):
+        return list(self.streams)
+
+
+def fake_pytubefix(seconds):
+    # Stands in for pytubefix, which yt_audiophile imports when it downloads
+    class YouTube:
+        def __init__(self, url, on_progress_callback=None, **kwargs):
+            self.video_id = url.split("v=")[-1]
+            self.length = 60
+            self.streams = StreamQuery([Stream(self.video_id, seconds, on_progress_callback)])
+
+    module = types.ModuleType("pytubefix")
+    module.YouTube = YouTube
+    cli = types.ModuleType("pytubefix.cli")
+    cli.on_progress = lambda stream, chunk, bytes_remaining: None
+    module.cli = cli
+    sys.modules["pytubefix"] = module
+    sys.modules["pytubefix.cli"] = cli
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Concurrent audio downloads of a few videos through the shared audio cache"
+    )
+    parser.add_argument("--jobs", type=int, default=64, help="Jobs per round")
+    parser.add_argument("--videos", type=int, default=7, help="Distinct videos per round")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds, each with new videos")
+    parser.add_argument("--workers", type=int, default=16, help="Jobs running at once")
+    parser.add_argument("--download-seconds", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    os.environ["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "ERROR")
+    fake_pytubefix(args.download_seconds)
+    import yt_audiophile
+
+    output_dir = tempfile.mkdtemp(prefix="youlama_downloads_")
+    failures = 0
+    print(f"{'round':>5} {'jobs':>5} {'videos':>6} {'downloads':>9} {'wrong':>5} {'p50 ms':>8} {'wall ms':>8} {'locks':>5} {'in use':>6}")
+    for round in range(args.rounds):
+        video_ids = [f"r{round}v{i}" for i in range(args.videos)]
+
+        def job(i):
+            video_id = video_ids[i % len(video_ids)]
+            started = time.perf_counter()
+            path = yt_audiophile.acquire_audio(
+                f"https://www.youtube.com/watch?v={video_id}", output_dir=output_dir
+            )
+            try:
+                with open(path, "rb") as f:
+                    wrong = f.read() != video_id.encode() * 1024
+            finally:
+                yt_audiophile.release_audio(path)
+            return time.perf_counter() - started, wrong
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(job, range(args.jobs)))
+        wall = time.perf_counter() - started
+        fetched = sum(downloads[video_id] for video_id in video_ids)
+        wrong = sum(result[1] for result in results)
+        # Once every job is done no lock or reference should be left behind
+        locks = len(yt_audiophile._path_locks)
+        in_use = len(yt_audiophile._in_use)
+        print(
+            f"{round + 1:>5} {args.jobs:>5} {args.videos:>6} {fetched:>9} {wrong:>5}"
+            f" {percentile([result[0] for result in results], 50) * 1000:>8.1f} {wall * 1000:>8.1f}"
+            f" {locks:>5} {in_use:>6}"
+        )
+        if fetched != args.videos or wrong or locks or in_use:
+            failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
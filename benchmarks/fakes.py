@@ -0,0 +1,470 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import threading
+import contextlib
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from corpus import (  # noqa: E402
+    AUDIO_STREAMS,
+    make_segments,
+    make_transcript,
+    minutes_of,
+)
+import prompts  # noqa: E402
+
+# Latencies of the real services at time scale 1; every sleep is multiplied
+# by the time scale so a full run stays short while keeping the proportions
+LATENCY = {
+    # YouTube transcript API: list_transcripts() and fetch() round trips
+    "captions_list": 0.25,
+    "captions_fetch": 0.15,
+    # YouTube Data API videos.list
+    "video_info": 0.12,
+    # Audio download bandwidth, bytes per second
+    "download_bandwidth": 5 * 1024 * 1024,
+    # Whisper real-time factor (remote GPU server)
+    "whisper_rtf": 0.1,
+    "whisper_overhead": 0.5,
+    # Ollama on a single consumer GPU with an 8B model
+    "ollama_first_token": 0.05,
+    # Loading the weights when the model is not resident or num_ctx changed
+    "ollama_load": 4.0,
+    "ollama_prompt_tps": 1500.0,
+    "ollama_generate_tps": 40.0,
+    # Embedding model (nomic-embed-text class) on the same GPU
+    "ollama_embed_tps": 4000.0,
+}
+
+CHARS_PER_TOKEN = 4
+# Generated tokens per prompt kind; None means as long as the input text
+OUTPUT_TOKENS = {
+    "summary": 500,
+    "chunk_summary": 250,
+    "reduce_summary": 500,
+    "read": None,
+    "rephrase": None,
+    "qa": 200,
+}
+# Fake embeddings are hashed bags of words, so texts sharing words are similar
+EMBED_DIM = 256
+
+
+def _prompt_markers():
+    # The longest literal piece of each template identifies it, wherever
+    # the text is placed in the prompt
+    markers = []
+    for prompt in vars(prompts).values():
+        if isinstance(prompt, prompts.Prompt):
+            pieces = re.split(r"\{\w+\}", prompt.template)
+            markers.append((max(pieces, key=len).strip()[:60], prompt.name))
+    return markers
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "FakeOllama"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _dead(self):
+        # A crashed server: kept-alive connections are dropped unanswered
+        if self.server.dead:
+            self.close_connection = True
+        return self.server.dead
+
+    def do_GET(self):
+        if self._dead():
+            return
+        path = urlsplit(self.path)
+        if path.path == "/youtube/v3/videos":
+            # YouTube Data API, used by the async video info client
+            self.server.count(path.path)
+            ids = parse_qs(path.query)["id"][0]
+            time.sleep(self.server.scale * LATENCY["video_info"])
+            self._json(_FakeRequest(ids, 0).execute())
+        elif self.path == "/api/tags":
+            self._json({"models": [{"name": name} for name in self.server.models]})
+        elif self.path == "/api/ps":
+            self._json({"models": [{"name": name} for name in self.server.running()]})
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self._dead():
+            return
+        body = self._body()
+        self.server.count(self.path)
+        if self.path == "/api/show":
+            self._json({"model_info": {"llama.context_length": self.server.context_length}})
+        elif self.path == "/api/generate":
+            with self.server.parallel:
+                self._generate(body)
+        elif self.path == "/api/embed":
+            with self.server.parallel:
+                self._embed(body)
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def _generate(self, body):
+        prompt = body.get("prompt", "")
+        scale = self.server.scale
+        load = self.server.load(
+            body.get("model"),
+            body.get("options", {}).get("num_ctx"),
+            _seconds(body.get("keep_alive", "5m")),
+        )
+        if not prompt:
+            # An empty prompt only loads the model
+            time.sleep(scale * load)
+            self._json({"response": "", "done": True, "load_duration": int(load * 1e9)})
+            return
+        prompt_tokens = max(1, len(prompt) // CHARS_PER_TOKEN)
+        self.server.record_prompt(prompt_tokens)
+        kind = next((name for marker, name in self.server.markers if marker in prompt), "summary")
+        tokens = OUTPUT_TOKENS.get(kind)
+        if tokens is None:
+            tokens = prompt_tokens
+        # Like Ollama, only the part of the prompt after the longest prefix
+        # still in a slot's KV cache is evaluated
+        cached = self.server.reuse_prefix(body.get("model"), prompt)
+        evaluated = max(1, (len(prompt) - cached) // CHARS_PER_TOKEN)
+        prompt_eval = evaluated / LATENCY["ollama_prompt_tps"]
+        time.sleep(scale * (load + LATENCY["ollama_first_token"] + prompt_eval))
+        stats = {
+            "done": True,
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(prompt_eval * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(tokens / LATENCY["ollama_generate_tps"] * 1e9),
+        }
+        words = _words(tokens)
+        if not body.get("stream"):
+            time.sleep(scale * tokens / LATENCY["ollama_generate_tps"])
+            self._json({"response": " ".join(words), **stats})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # Tokens are flushed in batches of about 20 ms of real time
+        per_token = scale / LATENCY["ollama_generate_tps"]
+        batch = max(1, int(0.02 / per_token)) if per_token else len(words) or 1
+        for i in range(0, len(words), batch):
+            part = words[i : i + batch]
+            time.sleep(per_token * len(part))
+            self._chunk({"response": " ".join(part) + " ", "done": False})
+        self._chunk({"response": "", **stats})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _embed(self, body):
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        tokens = sum(max(1, len(text) // CHARS_PER_TOKEN) for text in texts)
+        time.sleep(
+            self.server.scale
+            * (LATENCY["ollama_first_token"] + tokens / LATENCY["ollama_embed_tps"])
+        )
+        self._json({"model": body.get("model"), "embeddings": [_embedding(text) for text in texts]})
+
+    def _chunk(self, payload):
+        line = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+
+
+def _seconds(keep_alive):
+    # Ollama keep_alive: seconds, or a duration such as "30m"; negative
+    # keeps the model loaded for ever
+    if isinstance(keep_alive, (int, float)):
+        seconds = float(keep_alive)
+    else:
+        units = {"s": 1, "m": 60, "h": 3600}
+        seconds = float(keep_alive[:-1]) * units[keep_alive[-1]]
+    return float("inf") if seconds < 0 else seconds
+
+
+def _common_prefix(a, b):
+    # Length of the common prefix, by bisecting on slice equality
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _embedding(text):
+    vector = [0.0] * EMBED_DIM
+    for word in text.lower().split():
+        vector[zlib.crc32(word.encode("utf-8")) % EMBED_DIM] += 1.0
+    return vector
+
+
+def _words(tokens):
+    # Roughly one word per 1.3 tokens
+    return ["lorem"] * max(0, int(tokens / 1.3))
+
+
+class FakeOllama(ThreadingHTTPServer):
+    # Also serves the YouTube Data API videos endpoint for the httpx clients
+    daemon_threads = True
+    request_queue_size = 1024
+
+    # Ollama's default OLLAMA_NUM_PARALLEL, one KV cache per slot
+    slots = 4
+
+    def __init__(self, scale, context_length=8192, models=("llama3.1:8b",), parallel=None):
+        super().__init__(("127.0.0.1", 0), FakeOllamaHandler)
+        self.scale = scale
+        self.context_length = context_length
+        self.models = list(models)
+        # Like OLLAMA_NUM_PARALLEL, requests beyond it wait for a free slot;
+        # unlimited by default
+        self.parallel = threading.BoundedSemaphore(parallel) if parallel else contextlib.nullcontext()
+        # model -> (num_ctx, unload time) and model -> cached prompts
+        self.loaded = {}
+        self.prompts = {}
+        self.loads = 0
+        # Largest prompt received and the sum of all of them, in tokens
+        self.max_prompt_tokens = 0
+        self.prompt_tokens = 0
+        self.dead = False
+        self.markers = _prompt_markers()
+        self.calls = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def kill(self):
+        # New connections are refused and open ones dropped
+        self.dead = True
+        self.shutdown()
+        self.server_close()
+
+    def count(self, path):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def record_prompt(self, tokens):
+        with self.lock:
+            self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+            self.prompt_tokens += tokens
+
+    def load(self, model, num_ctx, keep_alive):
+        # Seconds spent loading the model for this request. keep_alive is
+        # scaled like every other duration
+        now = time.monotonic()
+        with self.lock:
+            current = self.loaded.get(model)
+            reload = current is None or current[1] < now or (num_ctx and current[0] != num_ctx)
+            if reload:
+                self.prompts.pop(model, None)
+                num_ctx = num_ctx or 2048
+            else:
+                num_ctx = current[0] if not num_ctx else num_ctx
+            self.loaded[model] = (num_ctx, now + keep_alive * self.scale)
+            self.loads += reload
+        return LATENCY["ollama_load"] if reload else 0.0
+
+    def running(self):
+        now = time.monotonic()
+        with self.lock:
+            return [model for model, (_, until) in self.loaded.items() if until >= now]
+
+    def reuse_prefix(self, model, prompt):
+        # Characters of the prompt already in a slot's KV cache; the prompt
+        # then replaces that slot, or the least recently used one
+        with self.lock:
+            slots = self.prompts.setdefault(model, [])
+            best, cached = None, 0
+            for i, previous in enumerate(slots):
+                length = _common_prefix(previous, prompt)
+                if length > cached:
+                    best, cached = i, length
+            if best is not None:
+                slots.pop(best)
+            elif len(slots) >= self.slots:
+                slots.pop(0)
+            slots.append(prompt)
+        return cached
+
+
+class FakeTranscript:
+    def __init__(self, video_id, scale):
+        self.video_id = video_id
+        self.scale = scale
+        self.language_code = "en"
+
+    def fetch(self):
+        segments = make_segments(minutes_of(self.video_id))
+        # Transfer time grows with the size of the caption track
+        size = sum(len(segment["text"]) + 40 for segment in segments)
+        time.sleep(self.scale * (LATENCY["captions_fetch"] + size / (2 * 1024 * 1024)))
+        return segments
+
+
+class FakeTranscriptList:
+    def __init__(self, video_id, scale):
+        self.video_id = video_id
+        self.scale = scale
+
+    def find_transcript(self, languages):
+        return FakeTranscript(self.video_id, self.scale)
+
+
+class FakeTranscriptApi:
+    # Videos whose id is listed in no_captions have no caption track, which
+    # sends them down the Whisper path
+    scale = 1.0
+    no_captions = set()
+
+    @classmethod
+    def list_transcripts(cls, video_id):
+        time.sleep(cls.scale * LATENCY["captions_list"])
+        if video_id in cls.no_captions:
+            raise Exception(f"No transcripts were found for video {video_id}")
+        return FakeTranscriptList(video_id, cls.scale)
+
+
+class _FakeRequest:
+    def __init__(self, ids, scale):
+        self.ids = ids.split(",")
+        self.scale = scale
+
+    def execute(self, num_retries=0):
+        time.sleep(self.scale * LATENCY["video_info"])
+        return {
+            "items": [
+                {
+                    "id": video_id,
+                    "snippet": {
+                        "title": f"Synthetic video {video_id}",
+                        "channelTitle": "Benchmark channel",
+                        "description": "x" * 2000,
+                    },
+                    "contentDetails": {"duration": f"PT{minutes_of(video_id)}M"},
+                }
+                for video_id in self.ids
+            ]
+        }
+
+
+class _FakeResult:
+    def __init__(self, payload, scale):
+        self.payload = payload
+        self.scale = scale
+
+    def execute(self, num_retries=0):
+        time.sleep(self.scale * LATENCY["video_info"])
+        return self.payload
+
+
+class FakeYouTubeClient:
+    # Calls per endpoint, to count quota units; the uploads of the one
+    # synthetic channel are set by the benchmark
+    calls = Counter()
+    uploads = []
+
+    def __init__(self, scale, endpoint=None):
+        self.scale = scale
+        self.endpoint = endpoint
+
+    def videos(self):
+        return FakeYouTubeClient(self.scale, "videos")
+
+    def channels(self):
+        return FakeYouTubeClient(self.scale, "channels")
+
+    def playlistItems(self):
+        return FakeYouTubeClient(self.scale, "playlistItems")
+
+    def list(self, part=None, id=None, **kwargs):
+        FakeYouTubeClient.calls[self.endpoint] += 1
+        if self.endpoint == "videos":
+            return _FakeRequest(id, self.scale)
+        if self.endpoint == "channels":
+            return _FakeResult(
+                {"items": [{"contentDetails": {"relatedPlaylists": {"uploads": "UUbenchmark"}}}]},
+                self.scale,
+            )
+        start = int(kwargs.get("pageToken") or 0)
+        page = self.uploads[start : start + kwargs.get("maxResults", 5)]
+        payload = {
+            "items": [
+                {
+                    "snippet": {
+                        "title": f"Synthetic video {video_id}",
+                        "videoOwnerChannelTitle": "Benchmark channel",
+                        "resourceId": {"kind": "youtube#video", "videoId": video_id},
+                    }
+                }
+                for video_id in page
+            ]
+        }
+        if start + len(page) < len(self.uploads):
+            payload["nextPageToken"] = str(start + len(page))
+        return _FakeResult(payload, self.scale)
+
+
+_audio_durations = {}
+
+
+def fake_acquire_audio(url, use_po_token=None, output_dir=None, progress=None, scale=1.0):
+    # A sparse file of the real size, "downloaded" at the configured bandwidth
+    from yt_audiophile import audio_quality
+
+    itag, bytes_per_second = AUDIO_STREAMS.get(audio_quality, AUDIO_STREAMS["best"])
+    video_id = url.split("v=")[-1]
+    duration = minutes_of(video_id) * 60
+    size = duration * bytes_per_second
+    path = os.path.join(output_dir, f"{video_id}_{itag}.m4a")
+    time.sleep(scale * size / LATENCY["download_bandwidth"])
+    with open(path, "wb") as f:
+        f.truncate(size)
+    _audio_durations[path] = duration
+    return path
+
+
+def fake_release_audio(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class FakeWhisperBackend:
+    def __init__(self, scale=1.0):
+        self.scale = scale
+
+    def transcribe(self, file_path):
+        duration = _audio_durations.get(file_path, 60)
+        time.sleep(self.scale * (LATENCY["whisper_overhead"] + duration * LATENCY["whisper_rtf"]))
+        return make_transcript(max(1, duration // 60))
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import make_transcript  # noqa: E402
+from run import percentile  # noqa: E402
+
+MODEL = "llama3.1:8b"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summary throughput over 1 to n fake Ollama hosts behind the router"
+    )
+    parser.add_argument("--hosts", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=48, help="Summaries per run")
+    parser.add_argument("--parallel", type=int, default=2, help="Requests each host runs at once")
+    parser.add_argument("--minutes", type=int, default=10, help="Transcript length of each summary")
+    parser.add_argument("--time-scale", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="youlama_hosts_")
+    os.environ.update(
+        {
+            "LLM_CACHE_PATH": os.path.join(tmpdir, "llm_cache.sqlite3"),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+        }
+    )
+    from fakes import FakeOllama
+    from ollama_client import OllamaClient
+    from prompts import SUMMARY_PROMPT
+
+    # Distinct transcripts, so no prompt prefix is shared between requests
+    prompts = [
+        SUMMARY_PROMPT.format(text=make_transcript(args.minutes, seed=i))
+        for i in range(args.requests)
+    ]
+
+    def run(count, fail_after=None):
+        hosts = [FakeOllama(args.time_scale, context_length=131072, parallel=args.parallel) for _ in range(count)]
+        client = OllamaClient(",".join(host.url for host in hosts), MODEL)
+        errors = []
+
+        def summarize(i):
+            if i == fail_after:
+                # The first host goes away halfway through
+                hosts[0].kill()
+            started = time.perf_counter()
+            try:
+                client.generate(prompts[i])
+            except Exception as e:
+                errors.append(str(e))
+            return time.perf_counter() - started
+
+        # Enough clients to keep every slot of every host busy
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=count * args.parallel * 2) as executor:
+            latencies = list(executor.map(summarize, range(args.requests)))
+        wall = time.perf_counter() - started
+        served = [host.calls.get("/api/generate", 0) for host in hosts]
+        loads = sum(host.loads for host in hosts)
+        for host in hosts[1 if fail_after is not None else 0 :]:
+            host.shutdown()
+            host.server_close()
+        return (args.requests - len(errors)) / wall, latencies, served, loads, errors
+
+    print(f"{'hosts':>5} {'':<9} {'req/s':>7} {'speedup':>7} {'p50 ms':>8} {'loads':>5} {'errors':>6}  requests per host")
+    single = None
+
+    def report(count, name, result):
+        throughput, latencies, served, loads, errors = result
+        speedup = throughput / single if single else 1.0
+        print(
+            f"{count:>5} {name:<9} {throughput:>7.2f} {speedup:>6.2f}x {percentile(latencies, 50) * 1000:>8.1f}"
+            f" {loads:>5} {len(errors):>6}  {' '.join(str(n) for n in served)}"
+        )
+
+    for count in args.hosts:
+        result = run(count)
+        if single is None:
+            single = result[0] / count
+        report(count, "", result)
+    if max(args.hosts) > 1:
+        report(max(args.hosts), "one dies", run(max(args.hosts), fail_after=args.requests // 2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
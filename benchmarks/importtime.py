@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.abspath(os.path.join(HERE, "..", "src"))
+
+# The Streamlit script, the batch and prefetch CLIs and the Whisper CLI
+ENTRY_POINTS = ("main", "batch", "prefetch", "whisper_module")
+PROJECT = {name[:-3] for name in os.listdir(SRC) if name.endswith(".py")}
+
+# Streamlit executes the script again on every interaction, with the modules
+# it imported still loaded; this times the module level of such a rerun
+RERUN = """
+import sys, time, runpy
+runpy.run_path(sys.argv[1], run_name="__rerun__")
+started = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name="__rerun__")
+print(time.perf_counter() - started)
+"""
+
+
+def _env():
+    # Settings that would start servers or threads at import stay off
+    return dict(os.environ, PYTHONPATH=SRC, METRICS_PORT="0", PREFETCH_SOURCES="")
+
+
+def profile(module):
+    # [(self µs, cumulative µs, depth, name)] of one cold import, in the
+    # order -X importtime reports them
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC,
+        env=_env(),
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        print(process.stderr, file=sys.stderr)
+        raise Exception(f"Importing {module} failed")
+    rows = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(own), int(cumulative), depth, name.strip()))
+    return rows
+
+
+def rerun(module):
+    process = subprocess.run(
+        [sys.executable, "-c", RERUN, os.path.join(SRC, f"{module}.py")],
+        cwd=SRC,
+        env=_env(),
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        print(process.stderr, file=sys.stderr)
+        raise Exception(f"Rerunning {module} failed")
+    return float(process.stdout.split()[-1])
+
+
+def subtree(rows, module):
+    # The rows imported on behalf of module: -X importtime lists children
+    # before their parent, so they are the ones since the previous top-level
+    # row, which the interpreter's own startup imports end with
+    start = 0
+    for i, (_, _, depth, name) in enumerate(rows):
+        if depth == 0:
+            if name == module:
+                return rows[start : i + 1]
+            start = i + 1
+    raise Exception(f"{module} is not in the profile")
+
+
+def breakdown(rows):
+    # Self time per top-level package: our modules, the standard library and
+    # each third-party distribution
+    packages = Counter()
+    for own, _, _, name in rows:
+        root = name.split(".")[0]
+        if root in PROJECT:
+            root = "(project)"
+        elif root in sys.stdlib_module_names or root.startswith("_"):
+            root = "(stdlib)"
+        packages[root] += own
+    return packages
+
+
+def measure(module, runs, rerun_too):
+    totals = []
+    for _ in range(runs):
+        rows = subtree(profile(module), module)
+        totals.append(rows[-1][1])
+    packages = breakdown(rows)
+    result = {
+        "cold": statistics.median(totals) / 1e6,
+        "modules": len(rows),
+        "packages": {name: us / 1e6 for name, us in packages.most_common()},
+    }
+    if rerun_too:
+        result["rerun"] = statistics.median(rerun(module) for _ in range(runs))
+    return result
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for entry, current in results["entries"].items():
+        previous = baseline.get("entries", {}).get(entry)
+        if not previous:
+            continue
+        for metric in ("cold", "rerun"):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append(f"{entry} {metric}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({change:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Cold import time and rerun cost of the entry points, from -X importtime"
+    )
+    parser.add_argument("entries", nargs="*", default=list(ENTRY_POINTS), help="Modules to import")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per entry; the median is kept")
+    parser.add_argument("--top", type=int, default=4, help="Heaviest third-party packages listed per entry")
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    results = {"config": {"python": sys.version.split()[0], "runs": args.runs}, "entries": {}}
+    print(f"{'entry':<16} {'cold ms':>8} {'rerun ms':>8} {'project':>8} {'stdlib':>8}  heaviest third-party (ms)")
+    for entry in args.entries:
+        r = measure(entry, args.runs, entry == "main")
+        results["entries"][entry] = r
+        packages = r["packages"]
+        third_party = [(name, s) for name, s in packages.items() if not name.startswith("(") and s >= 0.0005]
+        third_party = third_party[: args.top]
+        rerun_ms = f"{r['rerun'] * 1000:>8.1f}" if "rerun" in r else f"{'-':>8}"
+        print(
+            f"{entry:<16} {r['cold'] * 1000:>8.1f} {rerun_ms}"
+            f" {packages.get('(project)', 0) * 1000:>8.1f} {packages.get('(stdlib)', 0) * 1000:>8.1f}  "
+            + ", ".join(f"{name} {s * 1000:.0f}" for name, s in third_party)
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("The baseline was recorded with a different configuration", file=sys.stderr)
+            return 2
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
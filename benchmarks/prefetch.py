@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import video_id  # noqa: E402
+from run import percentile  # noqa: E402
+
+MODEL = "llama3.1:8b"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Interactive cache hit rate and latency on a watched channel, without and with prefetching"
+    )
+    parser.add_argument("--videos", type=int, default=30, help="Videos of the channel, each requested once")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--time-scale", type=float, default=0.01)
+    parser.add_argument(
+        "--no-captions-every", type=int, default=5, help="Every n-th video has no captions (0 for none)"
+    )
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="youlama_prefetch_")
+    from fakes import (
+        FakeOllama,
+        FakeTranscriptApi,
+        FakeWhisperBackend,
+        FakeYouTubeClient,
+        fake_acquire_audio,
+        fake_release_audio,
+    )
+
+    ollama = FakeOllama(args.time_scale, context_length=131072)
+    os.environ.update(
+        {
+            "TRANSCRIPT_STORE_PATH": os.path.join(tmpdir, "transcripts.sqlite3"),
+            "LLM_CACHE_PATH": os.path.join(tmpdir, "llm_cache.sqlite3"),
+            "WHISPER_WINDOW_SECONDS": "0",
+            "OLLAMA_URL": ollama.url,
+            "OLLAMA_MODEL": MODEL,
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    import batch
+    import pipeline
+    import video_info
+    import whisper_module
+    from prefetch import Prefetcher
+    from telemetry import CACHE_REQUESTS
+
+    scale = args.time_scale
+    FakeTranscriptApi.scale = scale
+    pipeline.YouTubeTranscriptApi = FakeTranscriptApi
+    video_info.get_youtube_client = lambda: FakeYouTubeClient(scale)
+    pipeline.acquire_audio = functools.partial(fake_acquire_audio, output_dir=tmpdir, scale=scale)
+    pipeline.release_audio = fake_release_audio
+    whisper_module.BACKENDS["fake"] = lambda: FakeWhisperBackend(scale)
+    whisper_module.whisper_backend = "fake"
+    batch_args = argparse.Namespace(
+        mode="summarize",
+        model=MODEL,
+        ollama_url=ollama.url,
+        no_whisper=False,
+        force_whisper=False,
+        use_po_token=False,
+    )
+
+    def channel(offset):
+        # Distinct lengths, so no two videos share a transcript or a summary
+        ids = [video_id(2 + offset + i, offset + i) for i in range(args.videos)]
+        if args.no_captions_every:
+            FakeTranscriptApi.no_captions.update(ids[:: args.no_captions_every])
+        return ids
+
+    def hits(cache):
+        return CACHE_REQUESTS.values.get((cache, "hit"), 0), CACHE_REQUESTS.values.get((cache, "miss"), 0)
+
+    def interactive(ids):
+        # Each video requested once by a user, as from the UI
+        transcript, llm = hits("transcript"), hits("llm")
+
+        def request(vid):
+            started = time.perf_counter()
+            record = batch.process(f"https://www.youtube.com/watch?v={vid}", batch_args)
+            if record["status"] != "ok":
+                raise Exception(record["error"])
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            latencies = list(executor.map(request, ids))
+
+        def rate(before, after):
+            requests = (after[0] - before[0]) + (after[1] - before[1])
+            return (after[0] - before[0]) / requests if requests else 0.0
+
+        return rate(transcript, hits("transcript")), rate(llm, hits("llm")), latencies
+
+    print(f"{'':<18} {'transcript hit':>14} {'summary hit':>11} {'p50 ms':>9} {'p95 ms':>9} {'prefetch s':>10}")
+
+    def report(name, result, prefetch_seconds=None):
+        transcript_rate, llm_rate, latencies = result
+        prefetch = f"{prefetch_seconds:>10.1f}" if prefetch_seconds is not None else f"{'-':>10}"
+        print(
+            f"{name:<18} {transcript_rate:>14.0%} {llm_rate:>11.0%}"
+            f" {percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 95) * 1000:>9.1f} {prefetch}"
+        )
+
+    # Without prefetching, every first viewer pays for the whole pipeline
+    FakeYouTubeClient.uploads = channel(0)
+    report("on demand", interactive(FakeYouTubeClient.uploads))
+
+    # A second channel is watched; the prefetcher runs in an idle window
+    FakeYouTubeClient.uploads = channel(args.videos)
+    prefetcher = Prefetcher(
+        sources=["https://www.youtube.com/@benchmark"],
+        videos=args.videos,
+        idle_hours="",
+        # No rate limits, to measure how long a full pass takes
+        rates={"captions": 1e9, "whisper": 1e9, "summary": 1e9},
+        ollama_url=ollama.url,
+        model=MODEL,
+    )
+    started = time.perf_counter()
+    prefetcher.run_once()
+    prefetch_seconds = time.perf_counter() - started
+    report("prefetched", interactive(FakeYouTubeClient.uploads), prefetch_seconds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
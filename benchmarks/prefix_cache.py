@@ -0,0 +1,128 @@
+import os
+import sys
+import argparse
+import tempfile
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import make_segments  # noqa: E402
+
+MODEL = "llama3.1:8b"
+OPERATIONS = ("summary", "read", "rephrase")
+
+# The version 1 templates, which put different instructions before the
+# transcript
+LEGACY = {
+    "summary": "Summarize the following YouTube video transcript in a concise yet detailed manner:\n\n```{text}```\n\nSummary with introduction and conclusion formatted in markdown:",
+    "rephrase": "Rephrase the following transcript to make it more readable and well-formatted, keeping the main content intact:\n\n{text}",
+    "read": """Fix the grammar and punctuation of the following transcript, maintaining the exact same content and meaning.
+Only correct grammatical errors, add proper punctuation, and fix sentence structure where needed.
+Do not rephrase or change the content. Reply with the corrected text only:\n\n{text}""",
+}
+
+# (name, version 1 templates, num_ctx pinned per video); the last one is the
+# app as it is
+MODES = (
+    ("instructions first", True, False),
+    ("transcript first", False, False),
+    ("pinned num_ctx", False, True),
+)
+
+
+@contextlib.contextmanager
+def patched(module, **values):
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prompt evaluation time and model loads of summarizing, reading and rephrasing one video in a row"
+    )
+    parser.add_argument("--minutes", type=int, nargs="+", default=[1, 10, 30, 60, 120])
+    parser.add_argument("--time-scale", type=float, default=0.001)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="youlama_prefix_")
+    os.environ.update(
+        {
+            "LLM_CACHE_PATH": os.path.join(tmpdir, "llm_cache.sqlite3"),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    import chunking
+    import llm_cache
+    import pipeline
+    from fakes import FakeOllama
+    from llm_cache import cached_generate_stream
+    from ollama_client import get_client
+    from pipeline import enhance, pin_context, summary_stream
+    from prompts import READ_PROMPT, REPHRASE_PROMPT, SUMMARY_PROMPT, Prompt
+    from telemetry import OLLAMA_LOAD_SECONDS, OLLAMA_PROMPT_EVAL_SECONDS
+    from transcript import Transcript
+
+    legacy = {
+        "summary": Prompt("summary", 1, LEGACY["summary"]),
+        "read": Prompt("read", 1, LEGACY["read"], rewrites=True),
+        "rephrase": Prompt("rephrase", 1, LEGACY["rephrase"], rewrites=True),
+    }
+    current = {"summary": SUMMARY_PROMPT, "read": READ_PROMPT, "rephrase": REPHRASE_PROMPT}
+
+    def seconds(histogram):
+        entry = histogram.values.get((MODEL,))
+        return entry[1] if entry else 0.0
+
+    header = f"{'mode':<19} {'minutes':>7}" + "".join(
+        f" {operation + ' ms':>12}" for operation in OPERATIONS
+    ) + f" {'loads':>5} {'load ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for mode, old_templates, pin in MODES:
+        templates = legacy if old_templates else current
+        # A fresh server and LLM cache per mode, so nothing carries over
+        ollama = FakeOllama(args.time_scale, context_length=131072)
+        llm_cache._cache = llm_cache.LLMCache(os.path.join(tmpdir, f"{mode}.sqlite3"))
+        base = get_client(ollama.url, MODEL)
+        base.warm_up()
+        with patched(pipeline, SUMMARY_PROMPT=templates["summary"], READ_PROMPT=templates["read"]), patched(
+            chunking, READ_PROMPT=templates["read"]
+        ):
+            for minutes in args.minutes:
+                transcript = Transcript.from_segments(make_segments(minutes))
+                client = pin_context(base, transcript) if pin else base
+                run = {
+                    "summary": lambda: "".join(summary_stream(client, transcript)),
+                    "read": lambda: enhance(client, transcript),
+                    "rephrase": lambda: "".join(
+                        cached_generate_stream(client, templates["rephrase"], str(transcript))
+                    ),
+                }
+                evals = []
+                load = seconds(OLLAMA_LOAD_SECONDS)
+                loads = ollama.loads
+                for operation in OPERATIONS:
+                    before = seconds(OLLAMA_PROMPT_EVAL_SECONDS)
+                    run[operation]()
+                    evals.append(seconds(OLLAMA_PROMPT_EVAL_SECONDS) - before)
+                load = seconds(OLLAMA_LOAD_SECONDS) - load
+                print(
+                    f"{mode:<19} {minutes:>7}"
+                    + "".join(f" {value * 1000:>12.1f}" for value in evals)
+                    + f" {ollama.loads - loads:>5} {load * 1000:>8.1f}"
+                )
+        ollama.shutdown()
+        ollama.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import CORPUS_MINUTES, WORDS, make_segments  # noqa: E402
+
+MODEL = "llama3.1:8b"
+
+
+def questions(count):
+    # Distinct questions, so no answer is served from the LLM cache
+    topics = WORDS[60:]
+    return [
+        f"What does the video say about {topics[i % len(topics)]} and {topics[(i * 7 + 3) % len(topics)]}? ({i})"
+        for i in range(count)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Latency and prompt tokens per question: retrieval against full-transcript prompts"
+    )
+    parser.add_argument("--minutes", type=int, nargs="+", default=list(CORPUS_MINUTES))
+    parser.add_argument("--questions", type=int, default=5, help="Questions per video")
+    parser.add_argument("--time-scale", type=float, default=0.01)
+    parser.add_argument("--context-length", type=int, default=131072)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="youlama_qa_")
+    os.environ.update(
+        {
+            "TRANSCRIPT_STORE_PATH": os.path.join(tmpdir, "transcripts.sqlite3"),
+            "LLM_CACHE_PATH": os.path.join(tmpdir, "llm_cache.sqlite3"),
+            "EMBEDDING_INDEX_PATH": os.path.join(tmpdir, "embeddings.sqlite3"),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    from fakes import FakeOllama
+    from llm_cache import cached_generate_stream
+    from ollama_client import get_client
+    from prompts import QA_PROMPT
+    from retrieval import answer_stream, get_index
+    from telemetry import OLLAMA_PROMPT_TOKENS
+    from transcript import Transcript
+
+    ollama = FakeOllama(args.time_scale, context_length=args.context_length)
+    client = get_client(ollama.url, MODEL)
+
+    def prefilled():
+        # Prompt tokens Ollama evaluated, which leaves out those served from
+        # its KV cache of earlier prompts
+        return OLLAMA_PROMPT_TOKENS.values.get((MODEL,), 0)
+
+    def ask(fn):
+        # Mean latency, prompt tokens sent and prompt tokens evaluated of one
+        # question
+        sent, evaluated = ollama.prompt_tokens, prefilled()
+        started = time.perf_counter()
+        for question in asked:
+            "".join(fn(question))
+        elapsed = time.perf_counter() - started
+        return (
+            elapsed / len(asked),
+            (ollama.prompt_tokens - sent) / len(asked),
+            (prefilled() - evaluated) / len(asked),
+        )
+
+    print(
+        f"{'minutes':>7} {'index ms':>9} {'rag ms':>8} {'full ms':>8} {'rag sent':>9} {'full sent':>9}"
+        f" {'rag eval':>9} {'full eval':>9}"
+    )
+    for minutes in args.minutes:
+        video_id = f"qa{minutes:05d}"
+        transcript = Transcript.from_segments(make_segments(minutes))
+        started = time.perf_counter()
+        get_index(video_id, transcript, ollama.url)
+        index_seconds = time.perf_counter() - started
+        asked = questions(args.questions)
+        rag_seconds, rag_sent, rag_evaluated = ask(
+            lambda question: answer_stream(client, video_id, transcript, question)
+        )
+        asked = [f"{question} (full)" for question in asked]
+        full_seconds, full_sent, full_evaluated = ask(
+            lambda question: cached_generate_stream(
+                client, QA_PROMPT, str(transcript), question=question, history=""
+            )
+        )
+        print(
+            f"{minutes:>7} {index_seconds * 1000:>9.1f} {rag_seconds * 1000:>8.1f} {full_seconds * 1000:>8.1f}"
+            f" {rag_sent:>9.0f} {full_sent:>9.0f} {rag_evaluated:>9.0f} {full_evaluated:>9.0f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import functools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import CORPUS_MINUTES, index_of, make_segments, make_transcript, minutes_of, video_id  # noqa: E402
+
+STAGES = ("transcript", "video_info", "whisper", "summarize", "read", "end_to_end", "end_to_end_async")
+MODEL = "llama3.1:8b"
+
+
+def percentile(values, p):
+    # Nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def workload(requests):
+    # Cycle through the corpus lengths; unique ids keep every cache cold
+    return [video_id(CORPUS_MINUTES[i % len(CORPUS_MINUTES)], i) for i in range(requests)]
+
+
+def run_worker(args):
+    # Runs one stage in this process, with every external service faked, and
+    # prints its raw measurements as JSON
+    tmpdir = tempfile.mkdtemp(prefix="youlama_bench_")
+    os.environ.update(
+        {
+            "TRANSCRIPT_STORE_PATH": os.path.join(tmpdir, "transcripts.sqlite3"),
+            "LLM_CACHE_PATH": os.path.join(tmpdir, "llm_cache.sqlite3"),
+            "JOB_STORE_PATH": os.path.join(tmpdir, "jobs.sqlite3"),
+            "WHISPER_WINDOW_SECONDS": "0",
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+            "OLLAMA_URL": args.ollama_url,
+            "YOUTUBE_API_URL": f"{args.ollama_url}/youtube/v3",
+        }
+    )
+    from fakes import (
+        FakeTranscriptApi,
+        FakeWhisperBackend,
+        FakeYouTubeClient,
+        fake_acquire_audio,
+        fake_release_audio,
+    )
+    import batch
+    import pipeline
+    import video_info
+    import whisper_module
+    from ollama_client import get_client
+
+    scale = args.time_scale
+    FakeTranscriptApi.scale = scale
+    pipeline.YouTubeTranscriptApi = FakeTranscriptApi
+    video_info.get_youtube_client = lambda: FakeYouTubeClient(scale)
+    pipeline.acquire_audio = functools.partial(fake_acquire_audio, output_dir=tmpdir, scale=scale)
+    pipeline.release_audio = fake_release_audio
+    whisper_module.BACKENDS["fake"] = lambda: FakeWhisperBackend(scale)
+    whisper_module.whisper_backend = "fake"
+
+    ids = workload(args.requests)
+    for vid in ids:
+        make_segments(minutes_of(vid))
+        make_transcript(minutes_of(vid))
+        make_transcript(minutes_of(vid), seed=index_of(vid))
+    client = get_client(args.ollama_url, MODEL)
+    batch_args = argparse.Namespace(
+        mode="summarize",
+        model=MODEL,
+        ollama_url=args.ollama_url,
+        no_whisper=False,
+        force_whisper=False,
+        use_po_token=False,
+    )
+    if args.no_captions_every:
+        FakeTranscriptApi.no_captions = set(ids[:: args.no_captions_every])
+
+    def url(vid):
+        return f"https://www.youtube.com/watch?v={vid}"
+
+    def end_to_end(vid):
+        record = batch.process(url(vid), batch_args)
+        if record["status"] != "ok":
+            raise Exception(record["error"])
+
+    stages = {
+        "transcript": lambda vid: pipeline.get_transcript(vid),
+        "video_info": lambda vid: video_info.get_video_info(vid),
+        "whisper": lambda vid: pipeline.resolve_transcript(
+            url(vid), vid, force_whisper=True, notify=lambda level, message: None
+        ),
+        # A transcript of its own per request, or the LLM cache would serve
+        # every request after the first of each length
+        "summarize": lambda vid: pipeline.summarize(client, make_transcript(minutes_of(vid), seed=index_of(vid))),
+        "read": lambda vid: pipeline.enhance(client, make_transcript(minutes_of(vid), seed=index_of(vid))),
+        "end_to_end": end_to_end,
+    }
+    if args.worker == "end_to_end_async":
+        return run_async_worker(args, ids, url, batch, batch_args)
+    fn = stages[args.worker]
+
+    def measure(vid):
+        started = time.perf_counter()
+        try:
+            fn(vid)
+            error = None
+        except Exception as e:
+            error = str(e)
+        return minutes_of(vid), time.perf_counter() - started, error
+
+    rss_start = peak_rss_bytes()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(measure, ids))
+    wall = time.perf_counter() - started
+    _dump(results, wall, rss_start)
+    return 0
+
+
+def run_async_worker(args, ids, url, batch, batch_args):
+    async def measure(vid, jobs):
+        async with jobs:
+            started = time.perf_counter()
+            record = await batch.aprocess(url(vid), batch_args)
+            error = None if record["status"] == "ok" else record["error"]
+            return minutes_of(vid), time.perf_counter() - started, error
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=sum(batch.stage_limits.values()) + 4)
+        )
+        jobs = asyncio.Semaphore(args.concurrency)
+        try:
+            return await asyncio.gather(*(measure(vid, jobs) for vid in ids))
+        finally:
+            await batch.aclose_services()
+
+    rss_start = peak_rss_bytes()
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    wall = time.perf_counter() - started
+    _dump(results, wall, rss_start)
+    return 0
+
+
+def _dump(results, wall, rss_start):
+    from fakes import FakeYouTubeClient
+
+    json.dump(
+        {
+            "wall": wall,
+            "latencies": [latency for _, latency, error in results if error is None],
+            "by_minutes": [[minutes, latency] for minutes, latency, error in results if error is None],
+            "errors": [error for _, _, error in results if error is not None],
+            "rss_start": rss_start,
+            "rss_peak": peak_rss_bytes(),
+            "youtube_calls": dict(FakeYouTubeClient.calls),
+        },
+        sys.stdout,
+    )
+
+
+def summarize_stage(raw):
+    # Latencies are as measured: our own CPU time is not scaled, so results
+    # are only comparable between runs with the same configuration
+    latencies = raw["latencies"]
+    return {
+        "requests": len(latencies) + len(raw["errors"]),
+        "errors": len(raw["errors"]),
+        "throughput": len(latencies) / raw["wall"] if raw["wall"] else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "peak_rss_mb": raw["rss_peak"] / 2**20,
+        "rss_growth_mb": (raw["rss_peak"] - raw["rss_start"]) / 2**20,
+        "p50_by_minutes": {
+            minutes: percentile([l for m, l in raw["by_minutes"] if m == minutes], 50)
+            for minutes in sorted({m for m, _ in raw["by_minutes"]})
+        },
+        "ollama_calls": raw.get("ollama_calls", {}),
+        "max_prompt_tokens": raw.get("max_prompt_tokens"),
+        "youtube_calls": raw.get("youtube_calls", {}),
+        "sample_errors": raw["errors"][:3],
+    }
+
+
+def compare(results, baseline, threshold):
+    # Higher latency, lower throughput or higher peak memory than the
+    # baseline by more than the threshold count as regressions
+    regressions = []
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            continue
+        for metric, worse_if_higher in (
+            ("p50", True),
+            ("p95", True),
+            ("throughput", False),
+            ("peak_rss_mb", True),
+            ("max_prompt_tokens", True),
+        ):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change > threshold) if worse_if_higher else (change < -threshold):
+                regressions.append(f"{stage} {metric}: {old:.3f} -> {new:.3f} ({change:+.1%})")
+    return regressions
+
+
+def print_table(results):
+    def ms(value):
+        return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+    header = (
+        f"{'stage':<16} {'req':>4} {'err':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        f" {'peak MB':>8} {'max prompt':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for stage, r in results["stages"].items():
+        throughput = f"{r['throughput']:8.2f}" if r["throughput"] is not None else f"{'-':>8}"
+        prompt = r.get("max_prompt_tokens") or "-"
+        print(
+            f"{stage:<16} {r['requests']:>4} {r['errors']:>4} {throughput}"
+            f" {ms(r['p50'])} {ms(r['p95'])} {ms(r['p99'])} {r['peak_rss_mb']:>8.1f} {prompt:>10}"
+        )
+
+    # Latency by transcript length, as long videos are chunked and reduced
+    minutes = results["config"]["corpus_minutes"]
+    print()
+    header = f"{'p50 ms by minutes':<18}" + "".join(f" {m:>9}" for m in minutes)
+    print(header)
+    print("-" * len(header))
+    for stage, r in results["stages"].items():
+        by_minutes = {int(m): latency for m, latency in r["p50_by_minutes"].items()}
+        print(f"{stage:<18}" + "".join(f" {ms(by_minutes.get(m))}" for m in minutes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline against local fakes of YouTube, Whisper and Ollama"
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--requests", type=int, default=24, help="Requests per stage")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.01,
+        help="Multiplier applied to every simulated latency (1 = realistic)",
+    )
+    parser.add_argument("--context-length", type=int, default=8192, help="Context size the fake model reports")
+    parser.add_argument(
+        "--no-captions-every",
+        type=int,
+        default=5,
+        help="Every n-th end-to-end video has no captions and goes through Whisper (0 for none)",
+    )
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument("--worker", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--ollama-url", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(args)
+
+    from fakes import FakeOllama
+
+    ollama = FakeOllama(args.time_scale, context_length=args.context_length)
+    results = {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "time_scale": args.time_scale,
+            "context_length": args.context_length,
+            "no_captions_every": args.no_captions_every,
+            "corpus_minutes": list(CORPUS_MINUTES),
+        },
+        "stages": {},
+    }
+    for stage in args.stages:
+        # A fresh process per stage, so peak RSS and caches are per stage
+        calls_before = dict(ollama.calls)
+        ollama.max_prompt_tokens = 0
+        process = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--worker", stage,
+                "--ollama-url", ollama.url,
+                "--requests", str(args.requests),
+                "--concurrency", str(args.concurrency),
+                "--time-scale", str(args.time_scale),
+                "--no-captions-every", str(args.no_captions_every),
+            ],
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            print(process.stderr, file=sys.stderr)
+            raise Exception(f"Stage {stage} failed")
+        raw = json.loads(process.stdout)
+        raw["ollama_calls"] = {
+            path: count - calls_before.get(path, 0)
+            for path, count in ollama.calls.items()
+            if count != calls_before.get(path, 0)
+        }
+        raw["max_prompt_tokens"] = ollama.max_prompt_tokens
+        results["stages"][stage] = summarize_stage(raw)
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("The baseline was recorded with a different configuration", file=sys.stderr)
+            return 2
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import zlib
+import argparse
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import CORPUS_MINUTES, make_segments  # noqa: E402
+from transcript import Transcript  # noqa: E402
+
+
+def as_dicts(text, index):
+    # How transcripts were held before: one dict, float pair and string per
+    # segment, rebuilt from the same stored blobs
+    transcript = Transcript.unpack(text, index)
+    return [dict(segment) for segment in transcript]
+
+
+def allocated(fn, *args):
+    # Bytes still allocated by the result of fn
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn(*args)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+def scan(segments, start, end):
+    return [s for s in segments if s["start"] + s["duration"] > start and s["start"] < end]
+
+
+def per_call(fn, *args, repeat=200):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - started) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Memory and lookup cost of list-of-dicts transcripts against Transcript"
+    )
+    parser.add_argument("--minutes", type=int, nargs="+", default=list(CORPUS_MINUTES))
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'minutes':>7} {'segments':>8} {'dicts KB':>9} {'array KB':>9} {'KB/h dicts':>10}"
+        f" {'KB/h array':>10} {'scan us':>8} {'bisect us':>9}"
+    )
+    for minutes in args.minutes:
+        text, index = Transcript.from_segments(make_segments(minutes)).pack()
+        text = zlib.decompress(text).decode("utf-8")
+        dicts, dicts_bytes = allocated(as_dicts, text, index)
+        transcript, array_bytes = allocated(Transcript.unpack, text, index)
+        # The Transcript keeps the decompressed text as its buffer, while the
+        # dicts hold a copy of every segment's text instead
+        array_bytes += sys.getsizeof(text)
+        middle = minutes * 30
+        scan_seconds = per_call(scan, dicts, middle, middle + 60)
+        bisect_seconds = per_call(transcript.between, middle, middle + 60)
+        hours = minutes / 60
+        print(
+            f"{minutes:>7} {len(transcript):>8} {dicts_bytes / 1024:>9.1f} {array_bytes / 1024:>9.1f}"
+            f" {dicts_bytes / 1024 / hours:>10.1f} {array_bytes / 1024 / hours:>10.1f}"
+            f" {scan_seconds * 1e6:>8.1f} {bisect_seconds * 1e6:>9.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
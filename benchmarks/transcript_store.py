@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from corpus import make_segments  # noqa: E402
+from run import percentile  # noqa: E402
+
+
+class JsonFiles:
+    # The cache the store replaced: one JSON file per video. It only kept the
+    # text; with segments=True it keeps the segments too, so both sides
+    # return the same data
+    def __init__(self, directory, segments=True):
+        self.directory = directory
+        self.segments = segments
+
+    def put(self, video_id, segments):
+        data = {"transcript": " ".join(s["text"] for s in segments)}
+        if self.segments:
+            data["segments"] = segments
+        with open(os.path.join(self.directory, f"{video_id}.json"), "w") as f:
+            json.dump(data, f)
+
+    def get(self, video_id, with_segments=False):
+        with open(os.path.join(self.directory, f"{video_id}.json"), "r") as f:
+            data = json.load(f)
+        if not with_segments:
+            return data["transcript"]
+        return data.get("segments") or [{"start": 0.0, "duration": 0.0, "text": data["transcript"]}]
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory))
+
+
+class Store:
+    def __init__(self, directory):
+        from transcript_store import TranscriptStore
+
+        self.path = os.path.join(directory, "transcripts.sqlite3")
+        self.store = TranscriptStore(self.path)
+
+    def put(self, video_id, segments):
+        self.store.put(video_id, segments)
+
+    def get(self, video_id, with_segments=False):
+        record = self.store.get(video_id, with_segments=with_segments)
+        return record["segments"] if with_segments else record["text"]
+
+    def size(self):
+        self.store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix))
+
+
+def timed_calls(fn, items):
+    latencies = []
+    for item in items:
+        started = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Insert and lookup cost of the transcript store against one JSON file per video"
+    )
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--minutes", type=int, default=75, help="Transcript length; 75 minutes is 1500 segments")
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    os.environ["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "ERROR")
+    # Distinct transcripts, so compression sees realistic data
+    corpus = [make_segments(args.minutes, seed=i % 20) for i in range(args.entries)]
+    ids = [f"v{i:010d}" for i in range(args.entries)]
+    probes = [ids[(i * 7919) % args.entries] for i in range(args.lookups)]
+
+    print(
+        f"{'backend':<10} {'segments':>8} {'insert ms':>9} {'text ms':>8} {'p95':>6}"
+        f" {'segments ms':>11} {'p95':>6} {'KiB/entry':>9}"
+    )
+    backends = (
+        ("json text", lambda directory: JsonFiles(directory, segments=False)),
+        ("json", JsonFiles),
+        ("sqlite", Store),
+    )
+    for name, backend in backends:
+        directory = tempfile.mkdtemp(prefix="youlama_store_")
+        try:
+            store = backend(directory)
+            inserts = timed_calls(lambda i: store.put(ids[i], corpus[i]), range(args.entries))
+            texts = timed_calls(lambda vid: store.get(vid), probes)
+            segments = timed_calls(lambda vid: store.get(vid, with_segments=True), probes)
+            print(
+                f"{name:<10} {len(corpus[0]):>8} {sum(inserts) / len(inserts) * 1000:>9.3f}"
+                f" {percentile(texts, 50) * 1000:>8.3f} {percentile(texts, 95) * 1000:>6.3f}"
+                f" {percentile(segments, 50) * 1000:>11.3f} {percentile(segments, 95) * 1000:>6.3f}"
+                f" {store.size() / 1024 / args.entries:>9.1f}"
+            )
+        finally:
+            shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
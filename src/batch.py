@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import load_env
+from http_client import aclose_services
+from ollama_client import get_client, warm_up
+from pipeline import (
+    aenhance,
+    aresolve_transcript,
+    asummarize,
+    configure_limits,
+    enhance,
+    extract_video_id,
+    resolve_transcript,
+    stage_limits,
+    summarize,
+)
+from telemetry import serve_metrics
+from video_info import aget_video_info, expand_url, prefetch_video_info, request_video_info
+from yt_audiophile import get_po_token_setting
+
+load_env()
+
+
+def read_urls(path):
+    source = sys.stdin if path == "-" else open(path, "r")
+    try:
+        urls = []
+        for line in source:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                urls.append(line)
+        return urls
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def load_done(path, mode, model):
+    # Lines already written for this mode and model are skipped on rerun
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if (
+                record.get("status") == "ok"
+                and record.get("mode") == mode
+                and record.get("model") == model
+            ):
+                done.add(record["video_id"])
+    return done
+
+
+def process(url, args):
+    record = {"url": url, "mode": args.mode, "model": args.model}
+    try:
+        video_id = extract_video_id(url)
+        record["video_id"] = video_id
+        # Looked up while the transcript is fetched
+        info = request_video_info(video_id)
+        transcript = resolve_transcript(
+            url,
+            video_id,
+            fallback_to_whisper=not args.no_whisper,
+            force_whisper=args.force_whisper,
+            use_po_token=args.use_po_token,
+            notify=lambda level, message: print(f"[{video_id}] {message}", file=sys.stderr),
+        )
+        client = get_client(args.ollama_url, args.model)
+        if args.mode == "summarize":
+            record["summary"] = summarize(client, transcript)
+        else:
+            record["enhanced"] = enhance(client, transcript)
+        record.update(info.result())
+        record["transcript"] = str(transcript)
+        record["status"] = "ok"
+    except Exception as e:
+        print(f"[{url}] Failed: {e}", file=sys.stderr)
+        record["status"] = "error"
+        record["error"] = str(e)
+    return record
+
+
+async def aprocess(url, args):
+    record = {"url": url, "mode": args.mode, "model": args.model}
+    try:
+        video_id = extract_video_id(url)
+        record["video_id"] = video_id
+        # Looked up while the transcript is fetched
+        info = asyncio.ensure_future(aget_video_info(video_id))
+        try:
+            transcript = await aresolve_transcript(
+                url,
+                video_id,
+                fallback_to_whisper=not args.no_whisper,
+                force_whisper=args.force_whisper,
+                use_po_token=args.use_po_token,
+                notify=lambda level, message: print(f"[{video_id}] {message}", file=sys.stderr),
+            )
+            client = get_client(args.ollama_url, args.model)
+            if args.mode == "summarize":
+                record["summary"] = await asummarize(client, transcript)
+            else:
+                record["enhanced"] = await aenhance(client, transcript)
+            record.update(await info)
+        finally:
+            info.cancel()
+        record["transcript"] = str(transcript)
+        record["status"] = "ok"
+    except Exception as e:
+        print(f"[{url}] Failed: {e}", file=sys.stderr)
+        record["status"] = "error"
+        record["error"] = str(e)
+    return record
+
+
+def run_threads(urls, args, output):
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        # Write each result as soon as it is done so an interrupted run can resume
+        futures = [executor.submit(process, url, args) for url in urls]
+        for future in as_completed(futures):
+            record = future.result()
+            failed += record["status"] != "ok"
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+    return failed
+
+
+async def run_async(urls, args, output):
+    # One event loop keeps every job in flight; threads are only used for the
+    # sync-only stages, each bounded by its stage limit
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=sum(stage_limits.values()) + 4))
+    jobs = asyncio.Semaphore(args.jobs)
+
+    async def run(url):
+        async with jobs:
+            return await aprocess(url, args)
+
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed([run(url) for url in urls]):
+            record = await next_done
+            failed += record["status"] != "ok"
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        await aclose_services()
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize or enhance many YouTube videos without the UI"
+    )
+    parser.add_argument(
+        "input", nargs="?", default="-", help="File with one URL per line, - for stdin"
+    )
+    parser.add_argument("-o", "--output", default="results.jsonl")
+    parser.add_argument("--mode", choices=("summarize", "read"), default="summarize")
+    parser.add_argument("--model", default=os.getenv("OLLAMA_MODEL") or "llama3.1:8b")
+    parser.add_argument("--ollama-url", default=os.getenv("OLLAMA_URL"))
+    parser.add_argument("--no-whisper", action="store_true", help="Disable the Whisper fallback")
+    parser.add_argument("--force-whisper", action="store_true")
+    parser.add_argument("--use-po-token", action=argparse.BooleanOptionalAction, default=get_po_token_setting())
+    parser.add_argument("--jobs", type=int, default=8, help="Videos processed at once")
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Videos taken from each playlist or channel URL"
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Run the jobs on one event loop instead of a thread each (for hundreds of --jobs)",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=None, help="Serve /metrics on this port while running"
+    )
+    for stage in stage_limits:
+        parser.add_argument(
+            f"--{stage}-workers",
+            type=int,
+            help=f"Concurrent {stage} calls (default {stage_limits[stage]})",
+        )
+    args = parser.parse_args(argv)
+
+    serve_metrics(args.metrics_port)
+    configure_limits(**{stage: getattr(args, f"{stage}_workers") for stage in stage_limits})
+
+    done = load_done(args.output, args.mode, args.model)
+    urls = []
+    video_ids = []
+    for url in read_urls(args.input):
+        try:
+            # Playlist and channel URLs stand for all of their videos
+            expanded = expand_url(url, limit=args.limit)
+            if expanded is None:
+                entries = [(extract_video_id(url), url)]
+            else:
+                print(f"{url}: {len(expanded)} videos", file=sys.stderr)
+                entries = [(video_id, f"https://www.youtube.com/watch?v={video_id}") for video_id in expanded]
+        except Exception as e:
+            print(f"Skipping {url}: {e}", file=sys.stderr)
+            continue
+        for video_id, video_url in entries:
+            if video_id not in done:
+                done.add(video_id)
+                urls.append(video_url)
+                video_ids.append(video_id)
+    print(f"Processing {len(urls)} videos ({args.jobs} at once)", file=sys.stderr)
+    if urls:
+        # The first transcripts take a while to fetch, the model loads meanwhile
+        warm_up(args.ollama_url, args.model)
+        # Titles and channels come in videos.list calls of 50 videos
+        prefetch_video_info(video_ids)
+
+    with open(args.output, "a") as output:
+        if args.use_async:
+            failed = asyncio.run(run_async(urls, args, output))
+        else:
+            failed = run_threads(urls, args, output)
+    print(f"Done: {len(urls) - failed} ok, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
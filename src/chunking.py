@@ -0,0 +1,312 @@
+import os
+import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import load_env
+from llm_cache import acached_generate, cached_generate
+from prompts import CHUNK_PROMPT, READ_PROMPT, REDUCE_PROMPT
+from telemetry import get_logger
+from transcript import Transcript
+
+load_env()
+
+# Rough average for English text with llama-style tokenizers
+CHARS_PER_TOKEN = 4
+# Room left in the context window for the instructions and the generated answer
+RESPONSE_RESERVE_TOKENS = 1024
+
+chunk_tokens = int(os.getenv("CHUNK_TOKENS", "3000"))
+chunk_overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "150"))
+fan_out = int(os.getenv("OLLAMA_FAN_OUT", "4"))
+# The rewritten text is about as long as its input, so read segments stay small
+read_chunk_tokens = int(os.getenv("READ_CHUNK_TOKENS", "1000"))
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+log = get_logger("chunking")
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def split_sentences(text, max_tokens):
+    # Auto-generated captions often have no punctuation at all, so sentences
+    # that are too long on their own are split on word boundaries
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    sentences = []
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+            continue
+        words = []
+        size = 0
+        for word in sentence.split():
+            if words and size + len(word) > max_chars:
+                sentences.append(" ".join(words))
+                words = []
+                size = 0
+            words.append(word)
+            size += len(word) + 1
+        if words:
+            sentences.append(" ".join(words))
+    return sentences
+
+
+def chunk_text(text, max_tokens=None, overlap_tokens=None):
+    max_tokens = max_tokens or chunk_tokens
+    overlap_tokens = chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = min(overlap_tokens, max_tokens // 2) * CHARS_PER_TOKEN
+
+    chunks = []
+    current = []
+    size = 0
+    for sentence in split_sentences(text, max_tokens):
+        if current and size + len(sentence) > max_chars:
+            chunks.append(" ".join(current))
+            # Carry the tail of the previous chunk over so no chunk starts cold
+            carried = []
+            carried_size = 0
+            for previous in reversed(current):
+                if carried_size + len(previous) + 1 > overlap_chars:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            current = carried
+            size = carried_size
+        current.append(sentence)
+        size += len(sentence) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def chunk_transcript(transcript, max_tokens=None, overlap_tokens=None):
+    # Chunks of a Transcript end on segment boundaries, found by bisecting the
+    # segment offsets instead of re-splitting the whole text; only a segment
+    # that does not fit a chunk on its own is split like plain text
+    max_tokens = max_tokens or chunk_tokens
+    overlap_tokens = chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = min(overlap_tokens, max_tokens // 2) * CHARS_PER_TOKEN
+    chunks = []
+    for view in transcript.chunks(max_chars, overlap_chars):
+        text = view.text
+        if len(text) > max_chars:
+            chunks.extend(chunk_text(text, max_tokens, overlap_tokens))
+        elif text.strip():
+            chunks.append(text)
+    return chunks
+
+
+def _chunk(transcript, max_tokens, overlap_tokens):
+    if isinstance(transcript, Transcript):
+        return chunk_transcript(transcript, max_tokens, overlap_tokens)
+    return chunk_text(transcript, max_tokens, overlap_tokens)
+
+
+def chunk_budget(client):
+    return max(256, min(chunk_tokens, client.context_size - RESPONSE_RESERVE_TOKENS))
+
+
+def fits_in_context(client, prompt):
+    return estimate_tokens(prompt) <= client.context_size - RESPONSE_RESERVE_TOKENS
+
+
+def _limited(fn, slot):
+    # slot() is entered around each Ollama call, such as the pipeline's
+    # per-stage limit; the fan-out only bounds the calls of one request
+    if slot is None:
+        return fn
+
+    def call(*args, **kwargs):
+        with slot():
+            return fn(*args, **kwargs)
+
+    return call
+
+
+def _alimited(fn, slot):
+    if slot is None:
+        return fn
+
+    async def call(*args, **kwargs):
+        async with slot():
+            return await fn(*args, **kwargs)
+
+    return call
+
+
+def _map(fn, items, workers):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(fn, items))
+
+
+def summarize_chunks(
+    client, transcript, max_tokens=None, overlap_tokens=None, workers=None, on_progress=None, slot=None
+):
+    workers = workers or fan_out
+    generate = _limited(cached_generate, slot)
+    max_tokens = max_tokens or chunk_budget(client)
+    chunks = _chunk(transcript, max_tokens, overlap_tokens)
+    if on_progress:
+        on_progress(f"Summarizing {len(chunks)} transcript chunks ({workers} in parallel)...")
+    partials = _map(
+        lambda item: generate(
+            client, CHUNK_PROMPT, item[1], index=item[0] + 1, total=len(chunks)
+        ),
+        list(enumerate(chunks)),
+        workers,
+    )
+
+    # Collapse the partial summaries until they fit into a single reduce prompt
+    while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > max_tokens:
+        groups = _reduce_groups(client, partials, max_tokens)
+        if on_progress:
+            on_progress(f"Merging {len(partials)} partial summaries...")
+        partials = _map(
+            lambda group: generate(client, REDUCE_PROMPT, join_partials(group)),
+            groups,
+            workers,
+        )
+    _check_reduce(client, partials)
+    return partials
+
+
+def _reduce_groups(client, partials, max_tokens):
+    groups = _group_partials(partials, max_tokens)
+    if len(groups) == len(partials):
+        # Every partial is already about half the budget or more: merge them
+        # pairwise, which still halves their number each round
+        groups = [partials[i : i + 2] for i in range(0, len(partials), 2)]
+    for group in groups:
+        _check_reduce(client, group)
+    return groups
+
+
+def _check_reduce(client, partials):
+    # Ollama silently drops whatever does not fit in num_ctx, so a reduce
+    # prompt that cannot fit is an error rather than a truncated summary
+    if not fits_in_context(client, REDUCE_PROMPT.format(text=join_partials(partials))):
+        raise Exception(
+            f"{len(partials)} partial summaries do not fit in the context of {client.model}; "
+            "lower CHUNK_TOKENS or use a model with a larger context"
+        )
+
+
+def _group_partials(partials, max_tokens):
+    groups = []
+    group = []
+    size = 0
+    for partial in partials:
+        partial_tokens = estimate_tokens(partial)
+        if group and size + partial_tokens > max_tokens:
+            groups.append(group)
+            group = []
+            size = 0
+        group.append(partial)
+        size += partial_tokens
+    groups.append(group)
+    return groups
+
+
+async def _amap(fn, items, workers):
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def run(item):
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+async def asummarize_chunks(
+    client, transcript, max_tokens=None, overlap_tokens=None, workers=None, on_progress=None, slot=None
+):
+    workers = workers or fan_out
+    generate = _alimited(acached_generate, slot)
+    max_tokens = max_tokens or chunk_budget(client)
+    chunks = _chunk(transcript, max_tokens, overlap_tokens)
+    if on_progress:
+        on_progress(f"Summarizing {len(chunks)} transcript chunks ({workers} in parallel)...")
+    partials = await _amap(
+        lambda item: generate(
+            client, CHUNK_PROMPT, item[1], index=item[0] + 1, total=len(chunks)
+        ),
+        list(enumerate(chunks)),
+        workers,
+    )
+    while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > max_tokens:
+        groups = _reduce_groups(client, partials, max_tokens)
+        if on_progress:
+            on_progress(f"Merging {len(partials)} partial summaries...")
+        partials = await _amap(
+            lambda group: generate(client, REDUCE_PROMPT, join_partials(group)),
+            groups,
+            workers,
+        )
+    _check_reduce(client, partials)
+    return partials
+
+
+def join_partials(partials):
+    return "\n\n".join(
+        f"Part {i + 1}:\n{partial}" for i, partial in enumerate(partials)
+    )
+
+
+def split_for_read(client, transcript):
+    # A segment and its rewrite both have to fit in the context
+    room = (client.context_size - RESPONSE_RESERVE_TOKENS) // 2
+    max_tokens = max(256, min(read_chunk_tokens, chunk_budget(client), room))
+    return _chunk(transcript, max_tokens, overlap_tokens=0)
+
+
+def fix_segments(client, segments, workers=None, slot=None):
+    # Yields (index, text) as each segment finishes; finished segments land in the
+    # LLM cache so retrying after a failure only re-runs the segments that failed
+    workers = workers or fan_out
+    generate = _limited(cached_generate, slot)
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(generate, client, READ_PROMPT, segment): index
+            for index, segment in enumerate(segments)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result().strip()
+            except Exception as e:
+                log.warning("segment_failed", segment=index + 1, error=str(e))
+                failures.append(index)
+    if failures:
+        raise Exception(
+            f"{len(failures)} of {len(segments)} segments failed, retry to re-run only those"
+        )
+
+
+async def afix_segments(client, segments, workers=None, slot=None):
+    # Returns the enhanced segments in order; like fix_segments, raises once
+    # every segment has been tried if any of them failed
+    semaphore = asyncio.Semaphore(max(1, workers or fan_out))
+    generate = _alimited(acached_generate, slot)
+
+    async def fix(index, segment):
+        async with semaphore:
+            try:
+                return (await generate(client, READ_PROMPT, segment)).strip()
+            except Exception as e:
+                log.warning("segment_failed", segment=index + 1, error=str(e))
+                return None
+
+    results = await asyncio.gather(*(fix(i, segment) for i, segment in enumerate(segments)))
+    failures = sum(result is None for result in results)
+    if failures:
+        raise Exception(
+            f"{failures} of {len(segments)} segments failed, retry to re-run only those"
+        )
+    return results
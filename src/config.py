@@ -0,0 +1,12 @@
+from dotenv import load_dotenv
+
+_loaded = False
+
+
+def load_env():
+    # Every module reads its settings from the environment at import; the
+    # .env file is parsed for the first of them only
+    global _loaded
+    if not _loaded:
+        load_dotenv()
+        _loaded = True
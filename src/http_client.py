@@ -0,0 +1,262 @@
+import os
+import time
+import random
+import asyncio
+import weakref
+import threading
+import contextlib
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from config import load_env
+
+load_env()
+
+http_retries = int(os.getenv("HTTP_RETRIES", "3"))
+http_backoff = float(os.getenv("HTTP_BACKOFF_SECONDS", "0.5"))
+http_pool_size = int(os.getenv("HTTP_POOL_SIZE", "16"))
+circuit_failures = int(os.getenv("CIRCUIT_FAILURES", "5"))
+circuit_reset = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# (connect, read) timeouts per service; generation reads can legitimately take minutes
+SERVICE_TIMEOUTS = {
+    "ollama": (
+        float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5")),
+        float(os.getenv("OLLAMA_READ_TIMEOUT", "900")),
+    ),
+    "pastebin": (5.0, float(os.getenv("PASTEBIN_TIMEOUT", "30"))),
+    "youtube": (5.0, float(os.getenv("YOUTUBE_TIMEOUT", "15"))),
+}
+DEFAULT_TIMEOUT = (5.0, 60.0)
+
+# Statuses worth retrying: the server is overloaded or restarting
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # After too many consecutive failures calls fail fast for a while; once the
+    # reset time has passed a single trial call is let through
+    def __init__(self, name, failures=circuit_failures, reset=circuit_reset):
+        self.name = name
+        self.max_failures = failures
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.reset and not self.trial:
+                self.trial = True
+                return
+            raise CircuitOpenError(
+                f"{self.name} is unavailable after {self.failures} consecutive failures"
+            )
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+    def abandon(self):
+        # A call cancelled before it got an answer says nothing about the
+        # host; a trial call lets the next one through instead
+        with self.lock:
+            self.trial = False
+
+
+class HttpService:
+    def __init__(self, name, timeout=None, retries=http_retries, backoff=http_backoff):
+        self.name = name
+        self.timeout = timeout or SERVICE_TIMEOUTS.get(name, DEFAULT_TIMEOUT)
+        self.retries = retries
+        self.backoff = backoff
+        self.breakers = {}
+        self.breakers_lock = threading.Lock()
+        # Keep-alive connections are pooled per host and reused across threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def breaker(self, url):
+        # One breaker per host so a dead server does not block healthy ones
+        host = urlsplit(url).netloc
+        with self.breakers_lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(f"{self.name} ({host})")
+            return self.breakers[host]
+
+    def request(self, method, url, retries=None, **kwargs):
+        # retries overrides the service's, for callers with somewhere else to
+        # send the request
+        retries = self.retries if retries is None else retries
+        kwargs.setdefault("timeout", self.timeout)
+        breaker = self.breaker(url)
+        attempt = 0
+        while True:
+            breaker.allow()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError:
+                # Only connection failures are retried: a read timeout on a long
+                # generation is not worth repeating
+                breaker.failure()
+                if attempt >= retries:
+                    raise
+            except Exception:
+                # Read timeouts and the like count against the host too, or a
+                # failed trial call would leave the circuit open for good
+                breaker.failure()
+                raise
+            except BaseException:
+                breaker.abandon()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES and response.status_code < 500:
+                    breaker.success()
+                    return response
+                breaker.failure()
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return response
+                response.close()
+            # Full jitter so clients that failed together do not retry together
+            time.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+_services = {}
+_services_lock = threading.RLock()
+
+
+def get_service(name):
+    with _services_lock:
+        if name not in _services:
+            _services[name] = HttpService(name)
+        return _services[name]
+
+
+def _async_timeout(timeout):
+    # Same (connect, read) pairs as the sync services; waiting for a pooled
+    # connection is unbounded because the stage semaphores cap concurrency
+    import httpx
+
+    connect, read = timeout
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=None)
+
+
+class AsyncHttpService:
+    # httpx counterpart of HttpService with the same timeouts, retries and
+    # circuit breakers; the breakers are shared with the sync service. httpx
+    # is imported on first use, as only the async batch mode needs it
+    def __init__(self, name, timeout=None, retries=http_retries, backoff=http_backoff):
+        import httpx
+
+        self.name = name
+        self.timeout = timeout or SERVICE_TIMEOUTS.get(name, DEFAULT_TIMEOUT)
+        self.retries = retries
+        self.backoff = backoff
+        self.sync = get_service(name)
+        self.client = httpx.AsyncClient(
+            timeout=_async_timeout(self.timeout),
+            limits=httpx.Limits(
+                max_connections=http_pool_size, max_keepalive_connections=http_pool_size
+            ),
+        )
+
+    async def _send(self, method, url, stream=False, retries=None, **kwargs):
+        import httpx
+
+        retries = self.retries if retries is None else retries
+        if "timeout" in kwargs:
+            kwargs["timeout"] = _async_timeout(kwargs["timeout"])
+        breaker = self.sync.breaker(url)
+        attempt = 0
+        while True:
+            breaker.allow()
+            try:
+                request = self.client.build_request(method, url, **kwargs)
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                breaker.failure()
+                if attempt >= retries:
+                    raise
+            except Exception:
+                breaker.failure()
+                raise
+            except BaseException:
+                # Cancelled, as when a batch job is abandoned
+                breaker.abandon()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES and response.status_code < 500:
+                    breaker.success()
+                    return response
+                breaker.failure()
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+    async def request(self, method, url, **kwargs):
+        return await self._send(method, url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self._send("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self._send("POST", url, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, **kwargs):
+        response = await self._send(method, url, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# httpx clients are bound to the event loop they were first used on
+_async_services = weakref.WeakKeyDictionary()
+
+
+def get_async_service(name):
+    loop = asyncio.get_running_loop()
+    with _services_lock:
+        services = _async_services.setdefault(loop, {})
+        if name not in services:
+            services[name] = AsyncHttpService(name)
+        return services[name]
+
+
+async def aclose_services():
+    loop = asyncio.get_running_loop()
+    with _services_lock:
+        services = list(_async_services.pop(loop, {}).values())
+    for service in services:
+        await service.aclose()
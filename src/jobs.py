@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import load_env
+from chunking import split_for_read
+from llm_cache import cached_generate_stream, text_hash
+from ollama_client import get_client
+from pipeline import (
+    enhance_segments,
+    extract_video_id,
+    get_transcript,
+    limit,
+    pin_context,
+    read_stream,
+    resolve_transcript,
+    summary_stream,
+)
+from prompts import REPHRASE_PROMPT
+from retrieval import answer_stream
+from telemetry import counter, get_logger, timed
+from video_info import request_video_info
+
+load_env()
+
+job_store_path = os.getenv("JOB_STORE_PATH", "transcript_cache/jobs.sqlite3")
+job_workers = int(os.getenv("JOB_WORKERS", "2"))
+job_max_age = float(os.getenv("JOB_MAX_AGE_DAYS", "7")) * 86400
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+JOBS = counter("youlama_jobs_total", "Jobs submitted, deduplicated and finished", ("kind", "event"))
+log = get_logger("jobs")
+
+
+def make_job_id(kind, params):
+    # Identical requests map to the same job, so they are only run once
+    return text_hash(json.dumps({"kind": kind, "params": params}, sort_keys=True))[:32]
+
+
+class Job:
+    # Live state of a queued or running job; the output is kept in memory and
+    # only the final result is written to the job table
+    def __init__(self, job_id, kind, params):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.status = QUEUED
+        self.level = "info"
+        self.message = None
+        self.progress = None
+        self.chunks = []
+        self.lock = threading.Lock()
+
+    def notify(self, level, message):
+        with self.lock:
+            self.level = level
+            self.message = message
+
+    def write(self, chunk):
+        with self.lock:
+            self.chunks.append(chunk)
+
+    def replace(self, text, progress=None):
+        with self.lock:
+            self.chunks = [text]
+            self.progress = progress
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "level": self.level,
+                "message": self.message,
+                "progress": self.progress,
+                "output": "".join(self.chunks),
+                "result": None,
+                "error": None,
+            }
+
+
+def run_summarize(job, video_url, model, ollama_url, fallback_to_whisper, force_whisper, use_po_token):
+    video_id = extract_video_id(video_url)
+    # Looked up while the transcript is fetched
+    video_info = request_video_info(video_id)
+    transcript = resolve_transcript(
+        video_url,
+        video_id,
+        fallback_to_whisper=fallback_to_whisper,
+        force_whisper=force_whisper,
+        use_po_token=use_po_token,
+        notify=job.notify,
+    )
+    client = pin_context(get_client(ollama_url, model), transcript)
+    job.notify("warning", "Starting summary generation, this might take a while...")
+    for chunk in summary_stream(client, transcript, notify=job.notify):
+        job.write(chunk)
+    job.notify("info", "Summary generated successfully (scroll down to see the summary)!")
+    video_info = video_info.result()
+    return {
+        "video_id": video_id,
+        "title": video_info["title"],
+        "channel": video_info["channel"],
+        "transcript": str(transcript),
+        "summary": job.snapshot()["output"],
+    }
+
+
+def run_read(job, video_url, model, ollama_url, fallback_to_whisper, force_whisper, use_po_token):
+    video_id = extract_video_id(video_url)
+    # Looked up while the transcript is fetched
+    video_info = request_video_info(video_id)
+    transcript = resolve_transcript(
+        video_url,
+        video_id,
+        fallback_to_whisper=fallback_to_whisper,
+        force_whisper=force_whisper,
+        use_po_token=use_po_token,
+        notify=job.notify,
+    )
+    client = pin_context(get_client(ollama_url, model), transcript)
+    job.notify("warning", "Starting transcript enhancement...")
+    segments = split_for_read(client, transcript)
+    if len(segments) == 1:
+        for chunk in read_stream(client, transcript):
+            job.write(chunk)
+        enhanced = job.snapshot()["output"]
+        job.notify("info", "Transcript enhanced successfully (scroll down to see the enhanced transcript)!")
+    else:
+        # Segments finish out of order; show them stitched back in order. If
+        # any segment fails the job fails rather than being stored as done, so
+        # resubmitting re-runs it and the LLM cache serves the segments that
+        # succeeded
+        fixed = {}
+        for index, text in enhance_segments(client, segments):
+            fixed[index] = text
+            job.replace(
+                "\n\n".join(fixed.get(i, "*...*") for i in range(max(fixed) + 1)),
+                progress=len(fixed) / len(segments),
+            )
+        job.notify("info", "Transcript enhanced successfully (scroll down to see the enhanced transcript)!")
+        enhanced = "\n\n".join(fixed[i] for i in range(len(segments)))
+    video_info = video_info.result()
+    return {
+        "video_id": video_id,
+        "title": video_info["title"],
+        "channel": video_info["channel"],
+        "transcript": str(transcript),
+        "enhanced": enhanced,
+    }
+
+
+def run_rephrase(job, transcript, model, ollama_url):
+    client = pin_context(get_client(ollama_url, model), transcript)
+    with limit("ollama"):
+        for chunk in cached_generate_stream(client, REPHRASE_PROMPT, transcript):
+            job.write(chunk)
+    return {"rephrased": job.snapshot()["output"]}
+
+
+def run_ask(job, video_id, question, history, model, ollama_url):
+    # The transcript was stored when the video was summarized or read
+    transcript = get_transcript(video_id)
+    if not transcript:
+        raise Exception("No transcript available for this video")
+    client = pin_context(get_client(ollama_url, model), transcript)
+    for chunk in answer_stream(client, video_id, transcript, question, history, notify=job.notify):
+        job.write(chunk)
+    job.notify("info", "Question answered!")
+    return {"answer": job.snapshot()["output"]}
+
+
+HANDLERS = {
+    "summarize": run_summarize,
+    "read": run_read,
+    "rephrase": run_rephrase,
+    "ask": run_ask,
+}
+
+
+class JobQueue:
+    def __init__(self, path=job_store_path, workers=job_workers, max_age=job_max_age):
+        self.path = path
+        self.max_age = max_age
+        self.live = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                level TEXT,
+                message TEXT,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )"""
+        )
+        self.conn.commit()
+
+    def submit(self, kind, params):
+        if kind not in HANDLERS:
+            raise Exception(f"Unknown job kind {kind}")
+        job_id = make_job_id(kind, params)
+        with self.lock:
+            if job_id in self.live:
+                JOBS.inc(kind=kind, event="joined")
+                return job_id
+            row = self.conn.execute(
+                "SELECT status FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row and row[0] == DONE:
+                JOBS.inc(kind=kind, event="reused")
+                return job_id
+            JOBS.inc(kind=kind, event="submitted")
+            self._enqueue(Job(job_id, kind, params))
+        return job_id
+
+    def resume(self):
+        # Jobs left queued or running by a previous process are started again;
+        # finished LLM calls are served from the LLM cache
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, kind, params FROM jobs WHERE status IN (?, ?)",
+                (QUEUED, RUNNING),
+            ).fetchall()
+            for job_id, kind, params in rows:
+                if job_id not in self.live and kind in HANDLERS:
+                    self._enqueue(Job(job_id, kind, json.loads(params)))
+        return len(rows)
+
+    def _enqueue(self, job):
+        now = time.time()
+        self.live[job.id] = job
+        self.conn.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL, NULL, NULL, NULL, ?, ?)",
+            (job.id, job.kind, json.dumps(job.params, sort_keys=True), QUEUED, now, now),
+        )
+        self.conn.commit()
+        self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        with job.lock:
+            job.status = RUNNING
+        with self.lock:
+            self._update(job.id, status=RUNNING)
+        try:
+            with timed(f"{job.kind}_job", job=job.id):
+                result = HANDLERS[job.kind](job, **job.params)
+        except Exception as e:
+            log.error("job_failed", job=job.id, kind=job.kind, error=str(e))
+            self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, DONE, result=json.dumps(result, ensure_ascii=False))
+
+    def _finish(self, job, status, result=None, error=None):
+        with self.lock:
+            self._update(
+                job.id,
+                status=status,
+                level=job.level,
+                message=job.message,
+                result=result,
+                error=error,
+            )
+            with job.lock:
+                job.status = status
+            del self.live[job.id]
+        JOBS.inc(kind=job.kind, event=status)
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.conn.execute(
+            f"UPDATE jobs SET {assignments}, updated = ? WHERE id = ?",
+            (*fields.values(), time.time(), job_id),
+        )
+        self.conn.commit()
+
+    def busy(self):
+        # True while any job is queued or running
+        with self.lock:
+            return bool(self.live)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.live.get(job_id)
+            if job is not None:
+                return job.snapshot()
+            row = self.conn.execute(
+                "SELECT kind, status, level, message, result, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        result = json.loads(row[4]) if row[4] else None
+        return {
+            "id": job_id,
+            "kind": row[0],
+            "status": row[1],
+            "level": row[2] or "info",
+            "message": row[3],
+            "progress": None,
+            "output": "",
+            "result": result,
+            "error": row[5],
+        }
+
+    def evict(self, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        if not max_age:
+            return 0
+        with self.lock:
+            evicted = self.conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, time.time() - max_age),
+            ).rowcount
+            self.conn.commit()
+        return evicted
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+            _queue.evict()
+            _queue.resume()
+        return _queue
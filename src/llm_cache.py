@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from config import load_env
+from singleflight import AsyncSingleFlight, SingleFlight
+from telemetry import cache_result
+
+load_env()
+
+cache_path = os.getenv("LLM_CACHE_PATH", "transcript_cache/llm_cache.sqlite3")
+cache_max_bytes = int(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024
+cache_max_age = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30")) * 86400
+
+# Eviction scans the whole table, so only run it every so many writes
+EVICT_EVERY = 50
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_key(model, prompt, options, text, **fields):
+    key = {
+        "model": model,
+        "prompt": prompt.name,
+        "version": prompt.version,
+        "options": options,
+        "text": text_hash(text),
+        "fields": fields,
+    }
+    return text_hash(json.dumps(key, sort_keys=True))
+
+
+class LLMCache:
+    def __init__(self, path=cache_path, max_bytes=cache_max_bytes, max_age=cache_max_age):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                cache_result("llm", False)
+                return None
+            self.conn.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+            self.hits += 1
+            cache_result("llm", True)
+            return row[0]
+
+    def put(self, key, model, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, value, len(value.encode("utf-8")), now, now),
+            )
+            self.conn.commit()
+            self.writes += 1
+            if self.writes % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def evict(self):
+        with self.lock:
+            self._evict(time.time())
+
+    def _evict(self, now):
+        self.conn.execute(
+            "DELETE FROM results WHERE created < ?", (now - self.max_age,)
+        )
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used entries until we are back under the limit
+            rows = self.conn.execute(
+                "SELECT key, size FROM results ORDER BY accessed"
+            ).fetchall()
+            stale = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                stale.append((key,))
+                total -= size
+            self.conn.executemany("DELETE FROM results WHERE key = ?", stale)
+        self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+# Identical generations running at the same time share one Ollama call
+_flights = SingleFlight()
+_async_flights = AsyncSingleFlight()
+
+
+def _rewrites(prompt, text):
+    return text if prompt.rewrites else None
+
+
+def cached_generate(client, prompt, text, **fields):
+    cache = get_cache()
+    key = make_key(client.model, prompt, client.options(), text, **fields)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    def generate():
+        # The previous flight may have finished between the lookup and joining
+        result = cache.get(key)
+        if result is None:
+            result = client.generate(
+                prompt.format(text=text, **fields), rewrites=_rewrites(prompt, text)
+            )
+            if isinstance(result, str):
+                cache.put(key, client.model, result)
+        return result
+
+    return _flights.do(key, generate)
+
+
+def cached_generate_stream(client, prompt, text, **fields):
+    # Cache hits come back as a single chunk; misses stream through and are
+    # only stored once the generation completed
+    cache = get_cache()
+    key = make_key(client.model, prompt, client.options(), text, **fields)
+    result = cache.get(key)
+    if result is not None:
+        yield result
+        return
+
+    def generate():
+        result = cache.get(key)
+        if result is not None:
+            yield result
+            return
+        chunks = []
+        for chunk in client.generate_stream(
+            prompt.format(text=text, **fields), rewrites=_rewrites(prompt, text)
+        ):
+            chunks.append(chunk)
+            yield chunk
+        cache.put(key, client.model, "".join(chunks))
+
+    yield from _flights.stream(key, generate)
+
+
+async def acached_generate(client, prompt, text, **fields):
+    # SQLite lookups take well under a millisecond, so they run inline
+    cache = get_cache()
+    key = make_key(client.model, prompt, client.options(), text, **fields)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    async def generate():
+        result = cache.get(key)
+        if result is None:
+            result = await client.agenerate(
+                prompt.format(text=text, **fields), rewrites=_rewrites(prompt, text)
+            )
+            cache.put(key, client.model, result)
+        return result
+
+    return await _async_flights.do(key, generate)
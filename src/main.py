@@ -1,17 +1,17 @@
 import os
-import json
+import time
 import streamlit as st
-from dotenv import load_dotenv
-from youtube_transcript_api import YouTubeTranscriptApi
-from ollama_client import OllamaClient
-from video_info import get_video_info
-from yt_audiophile import download_audio, get_po_token_setting
-from whisper_module import transcribe
+from config import load_env
+from ollama_client import get_client, warm_up
+from jobs import FINISHED, get_queue
+from prefetch import start_prefetch
+from telemetry import get_logger, histogram, serve_metrics
+from yt_audiophile import get_po_token_setting
 from pastebin_client import create_paste
 from pathlib import Path
 
 # Load environment variables
-load_dotenv()
+load_env()
 
 # Set page config first, before any other st commands
 st.set_page_config(
@@ -28,9 +28,89 @@ def load_css():
 
 
 def get_ollama_models(ollama_url):
-    ollama_client = OllamaClient(ollama_url, "")
-    models = ollama_client.get_models()
-    return models
+    # Cached per URL for OLLAMA_MODEL_LIST_TTL seconds, so reruns stay local
+    return list(get_client(ollama_url, "").get_models())
+
+
+RERUN_SECONDS = histogram("youlama_rerun_seconds", "Duration of Streamlit script reruns")
+log = get_logger("ui")
+
+# Exposes /metrics on METRICS_PORT, once per process
+serve_metrics()
+
+
+def record_rerun(elapsed):
+    RERUN_SECONDS.observe(elapsed)
+    log.debug("rerun", seconds=round(elapsed, 3))
+    st.session_state.last_rerun_ms = elapsed * 1000
+
+
+def follow_job(job_id, placeholder, title, notify, refresh_interval=0.25):
+    # Jobs run in background threads, so a rerun or a closed tab only stops
+    # this polling loop; the next rerun picks the job up again
+    last_message = None
+    while True:
+        job = get_queue().get(job_id)
+        if job is None:
+            return None
+        if job["message"] and job["message"] != last_message:
+            notify(job["level"], job["message"])
+            last_message = job["message"]
+        if job["status"] in FINISHED:
+            placeholder.empty()
+            return job
+        with placeholder.container():
+            if title:
+                st.subheader(title)
+            if job["status"] == "queued":
+                st.caption("Waiting for a free worker...")
+            if job["progress"] is not None:
+                st.progress(job["progress"])
+            if job["output"]:
+                st.markdown(job["output"] + "▌")
+        time.sleep(refresh_interval)
+
+
+def show_chat(video_id, model, ollama_url, notify):
+    # Questions are answered from the transcript chunks most relevant to
+    # them, so follow-ups do not resend the whole transcript
+    st.subheader("💬 Ask about this video")
+    question = st.chat_input("Ask a question about the video")
+    if question:
+        messages = st.session_state.messages
+        history = [
+            [messages[i]["content"], messages[i + 1]["content"]]
+            for i in range(0, len(messages) - 1, 2)
+            if not messages[i + 1].get("error")
+        ]
+        messages.append({"role": "user", "content": question})
+        st.session_state.ask_job_id = get_queue().submit(
+            "ask",
+            {
+                "video_id": video_id,
+                "question": question,
+                "history": history,
+                "model": model,
+                "ollama_url": ollama_url,
+            },
+        )
+
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    if st.session_state.ask_job_id:
+        with st.chat_message("assistant"):
+            job = follow_job(st.session_state.ask_job_id, st.empty(), None, notify)
+            st.session_state.ask_job_id = None
+            if job is None:
+                return
+            failed = job["status"] == "failed"
+            answer = f"🚫 {job['error']}" if failed else job["result"]["answer"]
+            st.markdown(answer)
+        st.session_state.messages.append(
+            {"role": "assistant", "content": answer, "error": failed}
+        )
 
 
 def main():
@@ -46,7 +126,7 @@ def main():
     ollama_url = st.text_input(
         "Ollama URL",
         value=default_ollama_url,
-        placeholder="Enter Ollama URL",
+        placeholder="Enter Ollama URL, or several separated by commas",
     )
     if not ollama_url:
         ollama_url = default_ollama_url
@@ -65,6 +145,10 @@ def main():
             else 0
         ),
     )
+    # Load the model while the user is still pasting a URL
+    warm_up(ollama_url, selected_model)
+    # Watched channels are prefetched in the background, after user jobs
+    start_prefetch(busy=get_queue().busy)
 
     # Video URL and buttons section
     video_url = st.text_input(
@@ -98,14 +182,20 @@ def main():
                 value=get_po_token_setting(),
                 help="Use PO token for YouTube authentication (helps bypass restrictions)",
             )
+        if "last_rerun_ms" in st.session_state:
+            st.caption(f"Previous rerun took {st.session_state.last_rerun_ms:.0f} ms")
 
-    # Initialize session state for messages if not exists
+    # Questions and answers about the current video
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "ask_job_id" not in st.session_state:
+        st.session_state.ask_job_id = None
 
-    # Initialize session state for rephrased transcript if not exists
-    if "rephrased_transcript" not in st.session_state:
-        st.session_state.rephrased_transcript = None
+    # The current job survives reruns, and a browser refresh through the URL
+    if "job_id" not in st.session_state:
+        st.session_state.job_id = st.query_params.get("job")
+    if "rephrase_job_id" not in st.session_state:
+        st.session_state.rephrase_job_id = None
 
     # Create a single header container
     header = st.container()
@@ -166,283 +256,151 @@ def main():
     # Add spacing after the fixed header
     # st.markdown("<div style='margin-top: 120px;'></div>", unsafe_allow_html=True)
 
-    def get_transcript(video_id):
-        cache_dir = "transcript_cache"
-        cache_file = os.path.join(cache_dir, f"{video_id}.json")
-
-        # Create cache directory if it doesn't exist
-        os.makedirs(cache_dir, exist_ok=True)
-
-        # Check if transcript is cached
-        if os.path.exists(cache_file):
-            with open(cache_file, "r") as f:
-                return json.load(f)["transcript"]
-
-        try:
-            transcript = YouTubeTranscriptApi.get_transcript(video_id)
-            full_transcript = " ".join([entry["text"] for entry in transcript])
-
-            # Cache the transcript
-            with open(cache_file, "w") as f:
-                json.dump({"transcript": full_transcript}, f)
-
-            return full_transcript
-        except Exception as e:
-            print(f"Error fetching transcript: {e}")
-            return None
-
-    def summarize_video(
-        video_url,
-        model,
-        ollama_url,
-        fallback_to_whisper=True,
-        force_whisper=False,
-        use_po_token=None,
-    ):
-        video_id = None
-        # Get the video id from the url if it's a valid youtube or invidious or any other url that contains a video id
-        if "v=" in video_url:
-            video_id = video_url.split("v=")[-1]
-        # Support short urls as well
-        elif "youtu.be/" in video_url:
-            video_id = video_url.split("youtu.be/")[-1]
-        # Also cut out any part of the url after the video id
-        video_id = video_id.split("&")[0]
-        st.write(f"Video ID: {video_id}")
-
-        with st.spinner("Fetching transcript..."):
-            transcript = get_transcript(video_id)
-        show_info("Summarizer fetched successfully!")
-
-        # Forcing whisper if specified
-        if force_whisper:
-            show_warning("Forcing whisper...")
-            fallback_to_whisper = True
-            transcript = None
-
-        if not transcript:
-            print("No transcript found, trying to download audio...")
-            if not fallback_to_whisper:
-                print("Fallback to whisper is disabled")
-                return (
-                    "Unable to fetch transcript (and fallback to whisper is disabled)"
-                )
-            if not force_whisper:
-                show_warning("Unable to fetch transcript. Trying to download audio...")
-            try:
-                print("Downloading audio...")
-                download_audio(video_url, use_po_token=use_po_token)
-                show_info("Audio downloaded successfully!")
-                show_warning("Starting transcription...it might take a while...")
-                transcript = transcribe("downloads/output.m4a")
-                show_info("Transcription completed successfully!")
-                os.remove("downloads/output.m4a")
-            except Exception as e:
-                print(f"Error downloading audio or transcribing: {e}")
-                show_error(f"Error downloading audio or transcribing: {e}")
-                if os.path.exists("downloads/output.m4a"):
-                    os.remove("downloads/output.m4a")
-                return "Unable to fetch transcript."
-        print(f"Transcript: {transcript}")
-        ollama_client = OllamaClient(ollama_url, model)
-        show_info(f"Ollama client created with model: {model}")
-
-        show_warning("Starting summary generation, this might take a while...")
-        with st.spinner("Generating summary..."):
-            prompt = f"Summarize the following YouTube video transcript in a concise yet detailed manner:\n\n```{transcript}```\n\nSummary with introduction and conclusion formatted in markdown:"
-            summary = ollama_client.generate(prompt)
-        print(summary)
-        show_info("Summary generated successfully (scroll down to see the summary)!")
-
-        with st.spinner("Fetching video info..."):
-            video_info = get_video_info(video_id)
-        st.success("Video info fetched successfully!")
-
-        return {
-            "title": video_info["title"],
-            "channel": video_info["channel"],
-            "transcript": transcript,
-            "summary": summary,
-        }
-
-    def fix_transcript(
-        video_url,
-        model,
-        ollama_url,
-        fallback_to_whisper=True,
-        force_whisper=False,
-        use_po_token=None,
-    ):
-        video_id = None
-        # Get the video id from the url if it's a valid youtube or invidious or any other url that contains a video id
-        if "v=" in video_url:
-            video_id = video_url.split("v=")[-1]
-        # Support short urls as well
-        elif "youtu.be/" in video_url:
-            video_id = video_url.split("youtu.be/")[-1]
-        # Also cut out any part of the url after the video id
-        video_id = video_id.split("&")[0]
-        st.write(f"Video ID: {video_id}")
-
-        with st.spinner("Fetching transcript..."):
-            transcript = get_transcript(video_id)
-        show_info("Transcript fetched successfully!")
-
-        # Forcing whisper if specified
-        if force_whisper:
-            show_warning("Forcing whisper...")
-            fallback_to_whisper = True
-            transcript = None
-
-        if not transcript:
-            print("No transcript found, trying to download audio...")
-            if not fallback_to_whisper:
-                print("Fallback to whisper is disabled")
-                return (
-                    "Unable to fetch transcript (and fallback to whisper is disabled)"
-                )
-            if not force_whisper:
-                show_warning("Unable to fetch transcript. Trying to download audio...")
-            try:
-                print("Downloading audio...")
-                download_audio(video_url, use_po_token=use_po_token)
-                show_info("Audio downloaded successfully!")
-                show_warning("Starting transcription...it might take a while...")
-                transcript = transcribe("downloads/output.m4a")
-                show_info("Transcription completed successfully!")
-                os.remove("downloads/output.m4a")
-            except Exception as e:
-                print(f"Error downloading audio or transcribing: {e}")
-                show_error(f"Error downloading audio or transcribing: {e}")
-                if os.path.exists("downloads/output.m4a"):
-                    os.remove("downloads/output.m4a")
-                return "Unable to fetch transcript."
-
-        ollama_client = OllamaClient(ollama_url, model)
-        show_info(f"Ollama client created with model: {model}")
-
-        show_warning("Starting transcript enhancement...")
-        with st.spinner("Enhancing transcript..."):
-            prompt = f"""Fix the grammar and punctuation of the following transcript, maintaining the exact same content and meaning. 
-            Only correct grammatical errors, add proper punctuation, and fix sentence structure where needed. 
-            Do not rephrase or change the content:\n\n{transcript}"""
-            enhanced = ollama_client.generate(prompt)
-        show_info(
-            "Transcript enhanced successfully (scroll down to see the enhanced transcript)!"
+    def notify(level, message):
+        {"info": show_info, "warning": show_warning, "error": show_error}[level](
+            message
         )
 
-        with st.spinner("Fetching video info..."):
-            video_info = get_video_info(video_id)
-        st.success("Video info fetched successfully!")
-
-        return {
-            "title": video_info["title"],
-            "channel": video_info["channel"],
-            "transcript": transcript,
-            "enhanced": enhanced,
-        }
-
     if (summarize_button or read_button) and video_url:
-        if read_button:
-            # Enhance transcript (now called read)
-            result = fix_transcript(
-                video_url,
-                selected_model,
-                ollama_url,
-                fallback_to_whisper=fallback_to_whisper,
-                force_whisper=force_whisper,
-                use_po_token=use_po_token,
+        params = {
+            "video_url": video_url,
+            "model": selected_model,
+            "ollama_url": ollama_url,
+            "fallback_to_whisper": fallback_to_whisper,
+            "force_whisper": force_whisper,
+            "use_po_token": use_po_token,
+        }
+        # Identical requests already queued or running are joined, not repeated
+        st.session_state.job_id = get_queue().submit(
+            "read" if read_button else "summarize", params
+        )
+        st.session_state.rephrase_job_id = None
+        st.session_state.messages = []
+        st.session_state.ask_job_id = None
+        st.query_params["job"] = st.session_state.job_id
+
+    if not st.session_state.job_id:
+        return
+
+    job = get_queue().get(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        return
+    title = "📝 Enhanced Transcript" if job["kind"] == "read" else "📊 AI Summary"
+    job = follow_job(job["id"], st.empty(), title, notify)
+    if job is None:
+        # Evicted, or dropped by a restart, while it was being followed
+        st.session_state.job_id = None
+        return
+    if job["status"] == "failed":
+        show_error(job["error"])
+        return
+    result = job["result"]
+    st.write(f"Video ID: {result['video_id']}")
+
+    if job["kind"] == "read":
+        # Display results
+        st.subheader("📺 Video Information")
+        info_col1, info_col2 = st.columns(2)
+        with info_col1:
+            st.write(f"**Title:** {result['title']}")
+        with info_col2:
+            st.write(f"**Channel:** {result['channel']}")
+
+        st.subheader("📝 Enhanced Transcript")
+        st.markdown(result["enhanced"])
+
+        # Original transcript in expander
+        with st.expander("📝 Original Transcript", expanded=False):
+            st.text_area(
+                "Raw Transcript",
+                result["transcript"],
+                height=200,
+                disabled=True,
             )
-
-            # Display results
-            st.subheader("📺 Video Information")
-            info_col1, info_col2 = st.columns(2)
-            with info_col1:
-                st.write(f"**Title:** {result['title']}")
-            with info_col2:
-                st.write(f"**Channel:** {result['channel']}")
-
-            st.subheader("📝 Enhanced Transcript")
-            st.markdown(result["enhanced"])
-
-            # Original transcript in expander
-            with st.expander("📝 Original Transcript", expanded=False):
-                st.text_area(
-                    "Raw Transcript",
-                    result["transcript"],
-                    height=200,
-                    disabled=True,
-                )
-
-        elif summarize_button:
-            # Continue with existing summarize functionality
-            summary = summarize_video(
-                video_url,
-                selected_model,
-                ollama_url,
-                fallback_to_whisper=fallback_to_whisper,
-                force_whisper=force_whisper,
-                use_po_token=use_po_token,
+        show_chat(result["video_id"], selected_model, ollama_url, notify)
+        return
+
+    summary = result
+
+    # Video Information
+    st.subheader("📺 Video Information")
+    info_col1, info_col2 = st.columns(2)
+    with info_col1:
+        st.write(f"**Title:** {summary['title']}")
+    with info_col2:
+        st.write(f"**Channel:** {summary['channel']}")
+
+    # Transcript Section
+    with st.expander("📝 Original Transcript", expanded=False):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.text_area(
+                "Raw Transcript",
+                summary["transcript"],
+                height=200,
+                disabled=True,
             )
+        with col2:
+            if st.button("🔄 Rephrase"):
+                st.session_state.rephrase_job_id = get_queue().submit(
+                    "rephrase",
+                    {
+                        "transcript": summary["transcript"],
+                        "model": selected_model,
+                        "ollama_url": ollama_url,
+                    },
+                )
 
-            # Video Information
-            st.subheader("📺 Video Information")
-            info_col1, info_col2 = st.columns(2)
-            with info_col1:
-                st.write(f"**Title:** {summary['title']}")
-            with info_col2:
-                st.write(f"**Channel:** {summary['channel']}")
-
-            # Transcript Section
-            with st.expander("📝 Original Transcript", expanded=False):
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.text_area(
-                        "Raw Transcript",
-                        summary["transcript"],
-                        height=200,
-                        disabled=True,
-                    )
-                with col2:
-                    if st.button("🔄 Rephrase"):
-                        with st.spinner("Rephrasing transcript..."):
-                            ollama_client = OllamaClient(ollama_url, selected_model)
-                            prompt = f"Rephrase the following transcript to make it more readable and well-formatted, keeping the main content intact:\n\n{summary['transcript']}"
-                            st.session_state.rephrased_transcript = (
-                                ollama_client.generate(prompt)
-                            )
-
-                    if st.button("📋 Share"):
-                        try:
-                            content = f"""Video Title: {summary['title']}
+            if st.button("📋 Share"):
+                try:
+                    content = f"""Video Title: {summary['title']}
 Channel: {summary['channel']}
 URL: {video_url}
 
 --- Transcript ---
 
 {summary['transcript']}"""
-                            paste_url = create_paste(
-                                f"Transcript: {summary['title']}", content
-                            )
-                            st.success(
-                                f"Transcript shared successfully! [View here]({paste_url})"
-                            )
-                        except Exception as e:
-                            if "PASTEBIN_API_KEY" not in os.environ:
-                                st.warning(
-                                    "PASTEBIN_API_KEY not found in environment variables"
-                                )
-                            else:
-                                st.error(f"Error sharing transcript: {str(e)}")
-
-            # Summary Section
-            st.subheader("📊 AI Summary")
-            st.markdown(summary["summary"])
-
-            # After the rephrase button, add:
-            if st.session_state.rephrased_transcript:
-                st.markdown(st.session_state.rephrased_transcript)
+                    paste_url = create_paste(
+                        f"Transcript: {summary['title']}", content
+                    )
+                    st.success(
+                        f"Transcript shared successfully! [View here]({paste_url})"
+                    )
+                except Exception as e:
+                    if "PASTEBIN_API_KEY" not in os.environ:
+                        st.warning(
+                            "PASTEBIN_API_KEY not found in environment variables"
+                        )
+                    else:
+                        st.error(f"Error sharing transcript: {str(e)}")
+
+    # Summary Section
+    st.subheader("📊 AI Summary")
+    st.markdown(summary["summary"])
+
+    # Rephrased transcript streams in below the summary
+    if st.session_state.rephrase_job_id:
+        rephrase = follow_job(
+            st.session_state.rephrase_job_id,
+            st.empty(),
+            "🔄 Rephrased Transcript",
+            notify,
+        )
+        if rephrase is None:
+            st.session_state.rephrase_job_id = None
+        elif rephrase["status"] == "failed":
+            show_error(rephrase["error"])
+        else:
+            st.subheader("🔄 Rephrased Transcript")
+            st.markdown(rephrase["result"]["rephrased"])
+
+    show_chat(summary["video_id"], selected_model, ollama_url, notify)
 
 
 if __name__ == "__main__":
-    main()
+    started = time.perf_counter()
+    try:
+        main()
+    finally:
+        record_rerun(time.perf_counter() - started)
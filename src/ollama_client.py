@@ -1,54 +1,567 @@
-import requests
+import copy
+import json
+import asyncio
 import os
-from dotenv import load_dotenv
+import time
+import threading
+import contextlib
+import requests
+from config import load_env
+from chunking import chunk_tokens, estimate_tokens
+from http_client import CircuitOpenError, get_async_service, get_service
+from telemetry import counter, get_logger, record_ollama, timed
+from ttl_cache import TTLCache
 
-load_dotenv()
+load_env()
 
 ollama_model = os.getenv("OLLAMA_MODEL") or "llama3.1:8b"
+model_list_ttl = float(os.getenv("OLLAMA_MODEL_LIST_TTL", "60"))
+model_info_ttl = float(os.getenv("OLLAMA_MODEL_INFO_TTL", "3600"))
+# How long a guessed context size is used before /api/show is asked again
+model_info_retry = float(os.getenv("OLLAMA_MODEL_INFO_RETRY", "30"))
+# Room left in num_ctx for the generated answer
+response_tokens = int(os.getenv("OLLAMA_RESPONSE_TOKENS", "1024"))
+# Texts sent per /api/embed request
+embed_batch = int(os.getenv("OLLAMA_EMBED_BATCH", "32"))
+# How long Ollama keeps a model, and the KV cache of its last prompts, loaded
+# after a request: a duration such as "30m", seconds, or -1 for ever
+keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+warm_up_enabled = os.getenv("OLLAMA_WARM_UP", "true").lower() == "true"
+# With several hosts in OLLAMA_URL: seconds between health checks of each,
+# and how many more outstanding requests a host with the model loaded may
+# have before one that would have to load it is picked instead
+health_interval = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+swap_penalty = float(os.getenv("OLLAMA_SWAP_PENALTY", "2"))
+MIN_CONTEXT = 2048
+
+# Used when /api/show is unavailable (older Ollama versions); matched on the
+# model name without its tag
+CONTEXT_SIZE_TABLE = {
+    "llama3.1": 128000,
+    "mistral-nemo": 128000,
+    "mistral_small_obliterated_22b": 128000,
+}
+
+# /api/tags and /api/show responses shared by every client and session
+_tags_cache = TTLCache(model_list_ttl)
+_context_cache = TTLCache(model_info_ttl)
+
+OLLAMA_REQUESTS = counter(
+    "youlama_ollama_requests_total", "Ollama requests by host and outcome", ("host", "outcome")
+)
+log = get_logger("ollama")
+
+
+def _keep_alive_value(value):
+    # Ollama parses strings as durations, which need a unit; plain numbers are
+    # seconds and have to be sent as numbers
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() else number
+
+
+KEEP_ALIVE = _keep_alive_value(keep_alive)
+
+
+def split_hosts(base_url):
+    # OLLAMA_URL and the URL box take one host or several, comma separated
+    return [url.strip().rstrip("/") for url in (base_url or "").split(",") if url.strip()]
+
+
+class OllamaHost:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.sent = 0
+        self.healthy = True
+        # Installed models, None until the first health check, and models
+        # currently loaded
+        self.models = None
+        self.loaded = set()
+
+
+class OllamaRouter:
+    # Spreads requests over the hosts of a comma-separated OLLAMA_URL: the
+    # host with the fewest outstanding requests wins, counting a model swap
+    # as OLLAMA_SWAP_PENALTY extra requests. Hosts that fail are skipped until
+    # a health check of /api/tags finds them up again, and a request that
+    # fails to connect or gets a server error is sent to the next host
+    def __init__(self, urls, interval=health_interval, penalty=swap_penalty):
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.interval = interval
+        self.penalty = penalty
+        self.http = get_service("ollama")
+        self.lock = threading.Lock()
+        self.checker = None
+
+    def pick(self, model, exclude=()):
+        if not self.hosts:
+            raise Exception("No Ollama URL configured")
+        with self.lock:
+            if self.checker is None and len(self.hosts) > 1 and self.interval > 0:
+                self.checker = threading.Thread(target=self._check_loop, name="ollama-health", daemon=True)
+                self.checker.start()
+            hosts = [host for host in self.hosts if host not in exclude]
+            # Hosts without the model, then failed hosts, are last resorts
+            candidates = (
+                [h for h in hosts if h.healthy and (h.models is None or model in h.models)]
+                or [h for h in hosts if h.healthy]
+                or hosts
+            )
+            host = min(
+                candidates,
+                key=lambda h: (h.outstanding + (0 if model in h.loaded else self.penalty), h.sent),
+            )
+            host.outstanding += 1
+            host.sent += 1
+            return host
+
+    def release(self, host, model, ok=None, loads=True):
+        # ok is None when the request was cancelled; loads is whether the
+        # request made the host load the model, as generation and embedding do
+        with self.lock:
+            host.outstanding -= 1
+            if ok is None:
+                return
+            host.healthy = ok
+            if ok and loads and model:
+                host.loaded.add(model)
+        OLLAMA_REQUESTS.inc(host=host.url, outcome="ok" if ok else "failed")
+
+    def _retry(self, host, tried, model, **fields):
+        # Whether to send the request again to another host
+        tried.append(host)
+        if len(tried) >= len(self.hosts):
+            return False
+        log.warning("ollama_failover", host=host.url, model=model, **fields)
+        return True
+
+    def _retries(self, tried):
+        # No retries on the same host while another one is left to try
+        return 0 if len(tried) + 1 < len(self.hosts) else None
+
+    def send(self, model, request):
+        # request(host_url, retries) -> response. Returns (host, response)
+        # with the request still outstanding on host until release
+        tried = []
+        while True:
+            host = self.pick(model, tried)
+            try:
+                response = request(host.url, self._retries(tried))
+            except (requests.exceptions.ConnectionError, CircuitOpenError) as e:
+                self.release(host, model, ok=False)
+                if self._retry(host, tried, model, error=str(e)):
+                    continue
+                raise
+            except Exception:
+                self.release(host, model, ok=False)
+                raise
+            # A 404 is a host without the model
+            status = response.status_code
+            if (status >= 500 or status == 404) and len(tried) + 1 < len(self.hosts):
+                response.close()
+                self.release(host, model, ok=status < 500, loads=False)
+                if status == 404 and host.models:
+                    with self.lock:
+                        host.models.discard(model)
+                self._retry(host, tried, model, status=status)
+                continue
+            return host, response
+
+    async def asend(self, model, request):
+        import httpx
+
+        tried = []
+        while True:
+            host = self.pick(model, tried)
+            try:
+                response = await request(host.url, self._retries(tried))
+            except (
+                httpx.ConnectError,
+                httpx.ConnectTimeout,
+                httpx.RemoteProtocolError,
+                CircuitOpenError,
+            ) as e:
+                self.release(host, model, ok=False)
+                if self._retry(host, tried, model, error=str(e)):
+                    continue
+                raise
+            except asyncio.CancelledError:
+                self.release(host, model)
+                raise
+            except Exception:
+                self.release(host, model, ok=False)
+                raise
+            status = response.status_code
+            if (status >= 500 or status == 404) and len(tried) + 1 < len(self.hosts):
+                await response.aclose()
+                self.release(host, model, ok=status < 500, loads=False)
+                if status == 404 and host.models:
+                    with self.lock:
+                        host.models.discard(model)
+                self._retry(host, tried, model, status=status)
+                continue
+            return host, response
+
+    def check(self, host):
+        # Installed models from /api/tags, loaded ones from /api/ps
+        try:
+            response = self.http.get(f"{host.url}/api/tags", timeout=(2, 5), retries=0)
+            tags = response.json()["models"]
+            response = self.http.get(f"{host.url}/api/ps", timeout=(2, 5), retries=0)
+            running = response.json().get("models", []) if response.status_code == 200 else None
+        except Exception as e:
+            with self.lock:
+                was_healthy, host.healthy = host.healthy, False
+            if was_healthy:
+                log.warning("ollama_host_down", host=host.url, error=str(e))
+            return
+        with self.lock:
+            if not host.healthy:
+                log.info("ollama_host_up", host=host.url)
+            host.healthy = True
+            host.models = {model["name"] for model in tags}
+            if running is not None:
+                host.loaded = {model["name"] for model in running}
+
+    def _check_loop(self):
+        while True:
+            for host in self.hosts:
+                self.check(host)
+            time.sleep(self.interval)
+
+    def tags(self):
+        # Models of every reachable host, in host order without duplicates
+        if not self.hosts:
+            raise Exception("No Ollama URL configured")
+        models = {}
+        error = None
+        retries = 0 if len(self.hosts) > 1 else None
+        for host in self.hosts:
+            try:
+                response = self.http.get(f"{host.url}/api/tags", timeout=(5, 30), retries=retries)
+                tags = response.json()["models"]
+            except Exception as e:
+                error = e
+                continue
+            for model in tags:
+                models.setdefault(model["name"], model)
+        if not models and error is not None:
+            raise error
+        return list(models.values())
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(base_url):
+    with _routers_lock:
+        if base_url not in _routers:
+            _routers[base_url] = OllamaRouter(split_hosts(base_url))
+        return _routers[base_url]
 
 
 class OllamaClient:
     def __init__(self, base_url, model):
         self.base_url = base_url
         self.model = model
-        self.context_size_table = {
-            "llama3.1": 128000,
-            "mistral-nemo": 128000,
-            "mistral_small_obliterated_22b": 128000,
-        }
-        self.context_size = 2048
-        if self.model not in self.context_size_table:
-            print(
-                f"Model {self.model} not found in context size table: using default {self.context_size}"
+        self.http = get_service("ollama")
+        self.router = get_router(base_url)
+        # See pinned()
+        self.min_num_ctx = MIN_CONTEXT
+
+    def pinned(self, num_ctx):
+        # A copy of the client whose requests use at least num_ctx. Ollama
+        # reloads the model, and drops the KV cache of the prompts it has
+        # seen, whenever num_ctx changes; the operations on one video pin the
+        # size of their largest one so they can share the transcript prefix
+        client = copy.copy(self)
+        client.min_num_ctx = num_ctx
+        return client
+
+    def _send(self, path, **kwargs):
+        # POSTs to the host the router picks; returns (host, response)
+        def request(url, retries):
+            return self.http.post(f"{url}{path}", retries=retries, **kwargs)
+
+        return self.router.send(self.model, request)
+
+    def _post(self, path, loads=True, **kwargs):
+        host, response = self._send(path, **kwargs)
+        self.router.release(host, self.model, ok=response.status_code < 500, loads=loads)
+        return response
+
+    @contextlib.contextmanager
+    def _stream(self, path, **kwargs):
+        # The request stays outstanding on its host until the stream is read
+        host, response = self._send(path, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+            self.router.release(host, self.model, ok=response.status_code < 500)
+
+    async def _asend(self, path, **kwargs):
+        service = get_async_service("ollama")
+
+        async def request(url, retries):
+            return await service.request("POST", f"{url}{path}", retries=retries, **kwargs)
+
+        return await self.router.asend(self.model, request)
+
+    async def _apost(self, path, **kwargs):
+        host, response = await self._asend(path, **kwargs)
+        self.router.release(host, self.model, ok=response.status_code < 500)
+        return response
+
+    @contextlib.asynccontextmanager
+    async def _astream(self, path, **kwargs):
+        host, response = await self._asend(path, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+            self.router.release(host, self.model, ok=response.status_code < 500)
+
+    @property
+    def context_size(self):
+        # Maximum context of the model, read from its metadata. A guess made
+        # because /api/show failed is only kept for a short while: the host
+        # may just be restarting, and the guess can be far too small
+        return _context_cache.get_or_load(
+            (self.base_url, self.model),
+            self._discover_context_size,
+            ttl=lambda entry: None if entry[1] else model_info_retry,
+        )[0]
+
+    def _discover_context_size(self):
+        # Returns (context size, whether /api/show answered)
+        answered = False
+        try:
+            response = self._post(
+                "/api/show", loads=False, json={"model": self.model}, timeout=(5, 30)
             )
-        else:
-            self.context_size = self.context_size_table[self.model]
-            print(f"Using context size {self.context_size} for model {self.model}")
+            if response.status_code == 200:
+                answered = True
+                for key, value in response.json().get("model_info", {}).items():
+                    if key.endswith(".context_length"):
+                        log.info("context_size", model=self.model, context_size=value)
+                        return int(value), answered
+            else:
+                log.warning("model_metadata_failed", model=self.model, status=response.status_code)
+        except Exception as e:
+            log.warning("model_metadata_failed", model=self.model, error=str(e))
+        context_size = CONTEXT_SIZE_TABLE.get(self.model.split(":")[0], MIN_CONTEXT)
+        log.warning("context_size_unknown", model=self.model, context_size=context_size)
+        return context_size, answered
+
+    def num_ctx_for(self, prompt, rewrites=None):
+        # Allocate only as much KV cache as the prompt needs. Ollama reloads the
+        # model whenever num_ctx changes, so sizes are rounded up to powers of
+        # two to keep the number of distinct values small. rewrites is the text
+        # a read or rephrase answers with a new version of: the answer is about
+        # as long, and Ollama drops the start of the prompt once it outgrows
+        # the room left for it
+        answer_tokens = response_tokens
+        if rewrites is not None:
+            answer_tokens = max(answer_tokens, estimate_tokens(rewrites))
+        return self._num_ctx(estimate_tokens(prompt), answer_tokens)
+
+    def _num_ctx(self, prompt_tokens, answer_tokens=response_tokens):
+        needed = prompt_tokens + answer_tokens
+        num_ctx = self.min_num_ctx
+        while num_ctx < needed:
+            num_ctx *= 2
+        return min(num_ctx, self.context_size)
+
+    async def acontext_size(self):
+        if _context_cache.get((self.base_url, self.model)) is None:
+            # Discovered once per model and TTL, not worth an async copy
+            await asyncio.to_thread(lambda: self.context_size)
+        return self.context_size
+
+    async def anum_ctx_for(self, prompt, rewrites=None):
+        await self.acontext_size()
+        return self.num_ctx_for(prompt, rewrites)
+
+    def options(self):
+        # Options that change the generated text; num_ctx is sized per request
+        return {}
+
+    def _tags(self):
+        return _tags_cache.get_or_load(self.base_url, self.router.tags)
 
     def get_models(self):
-        url = f"{self.base_url}/api/tags"
-        response = requests.get(url)
         models = []
-        response_json = response.json()
-        all_models = response_json["models"]
-        for model in all_models:
+        for model in self._tags():
             models.append(model["name"])
         return models
 
-    def generate(self, prompt):
-        url = f"{self.base_url}/api/generate"
+    def get_model_details(self, model=None):
+        model = model or self.model
+        for entry in self._tags():
+            if entry["name"] == model:
+                return entry
+        return None
+
+    def warm_up(self):
+        # An empty prompt makes Ollama load the model without generating. It
+        # is loaded with the num_ctx of a CHUNK_TOKENS prompt, the bucket of
+        # chunk summaries and of most whole-transcript ones, since a request
+        # with another num_ctx would load it again
+        data = {
+            "model": self.model,
+            "prompt": "",
+            "keep_alive": KEEP_ALIVE,
+            "options": {**self.options(), "num_ctx": self._num_ctx(chunk_tokens)},
+        }
+        with timed("ollama_warm_up", model=self.model):
+            response = self._post("/api/generate", json=data)
+        if response.status_code != 200:
+            raise Exception(f"Error loading model: {response.text}")
+        body = response.json()
+        log.info(
+            "model_loaded",
+            model=self.model,
+            load_seconds=round(body.get("load_duration", 0) / 1e9, 3),
+        )
+
+    def generate(self, prompt, rewrites=None):
         data = {
             "model": self.model,
             "prompt": prompt,
             "stream": False,
-            "num_ctx": self.context_size,
+            "keep_alive": KEEP_ALIVE,
+            "options": {**self.options(), "num_ctx": self.num_ctx_for(prompt, rewrites)},
         }
-        response = requests.post(url, json=data)
+        with timed("ollama", model=self.model, num_ctx=data["options"]["num_ctx"]):
+            response = self._post("/api/generate", json=data)
         if response.status_code == 200:
             try:
-                return response.json()["response"]
+                body = response.json()
+                record_ollama(self.model, body)
+                return body["response"]
             except Exception as e:
-                print(response)
+                log.error("ollama_bad_response", model=self.model, error=str(e))
                 return response
         else:
             raise Exception(f"Error generating text: {response.text}")
+
+    def generate_stream(self, prompt, rewrites=None):
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": KEEP_ALIVE,
+            "options": {**self.options(), "num_ctx": self.num_ctx_for(prompt, rewrites)},
+        }
+        # Ollama streams one JSON object per line until a chunk with done=true
+        with timed("ollama", model=self.model, num_ctx=data["options"]["num_ctx"]):
+            with self._stream("/api/generate", json=data) as response:
+                if response.status_code != 200:
+                    raise Exception(f"Error generating text: {response.text}")
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        raise Exception(f"Error generating text: {chunk['error']}")
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        record_ollama(self.model, chunk)
+                        break
+
+    def embed(self, texts):
+        # One embedding per text, in batches of OLLAMA_EMBED_BATCH
+        vectors = []
+        for start in range(0, len(texts), embed_batch):
+            batch = texts[start : start + embed_batch]
+            with timed("ollama_embed", model=self.model, inputs=len(batch)):
+                response = self._post(
+                    "/api/embed", json={"model": self.model, "input": batch, "keep_alive": KEEP_ALIVE}
+                )
+            if response.status_code != 200:
+                raise Exception(f"Error embedding text: {response.text}")
+            vectors.extend(response.json()["embeddings"])
+        return vectors
+
+    async def agenerate(self, prompt, rewrites=None):
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": KEEP_ALIVE,
+            "options": {**self.options(), "num_ctx": await self.anum_ctx_for(prompt, rewrites)},
+        }
+        with timed("ollama", model=self.model, num_ctx=data["options"]["num_ctx"]):
+            response = await self._apost("/api/generate", json=data)
+        if response.status_code != 200:
+            raise Exception(f"Error generating text: {response.text}")
+        body = response.json()
+        record_ollama(self.model, body)
+        return body["response"]
+
+    async def agenerate_stream(self, prompt, rewrites=None):
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": KEEP_ALIVE,
+            "options": {**self.options(), "num_ctx": await self.anum_ctx_for(prompt, rewrites)},
+        }
+        with timed("ollama", model=self.model, num_ctx=data["options"]["num_ctx"]):
+            async with self._astream("/api/generate", json=data) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise Exception(f"Error generating text: {response.text}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        raise Exception(f"Error generating text: {chunk['error']}")
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        record_ollama(self.model, chunk)
+                        break
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, model):
+    # Clients are stateless apart from their configuration, so one per
+    # (url, model) is shared across Streamlit reruns, sessions and threads
+    key = (base_url, model)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OllamaClient(base_url, model)
+        return _clients[key]
+
+
+_warmed = set()
+
+
+def warm_up(base_url, model):
+    # Loads the model in the background, once per process and model, so the
+    # first request does not wait for it; keep_alive then keeps it loaded
+    key = (base_url, model)
+    with _clients_lock:
+        if not warm_up_enabled or not model or key in _warmed:
+            return
+        _warmed.add(key)
+    client = get_client(base_url, model)
+
+    def run():
+        try:
+            client.warm_up()
+        except Exception as e:
+            log.warning("warm_up_failed", model=model, error=str(e))
+
+    threading.Thread(target=run, daemon=True).start()
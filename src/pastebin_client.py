@@ -1,10 +1,10 @@
-import requests
 import os
-from dotenv import load_dotenv
+from config import load_env
+from http_client import get_async_service, get_service
 
-load_dotenv()
+load_env()
 
-def create_paste(title, content):
+def _paste_request(title, content):
     api_key = os.getenv("PASTEBIN_API_KEY")
     if not api_key:
         raise Exception("PASTEBIN_API_KEY not found in environment variables")
@@ -18,9 +18,21 @@ def create_paste(title, content):
         'api_paste_name': title,
         'api_paste_expire_date': '1W'  # Expires in 1 week
     }
+    return url, data
+
 
-    response = requests.post(url, data=data)
+def _paste_result(response):
     if response.status_code == 200 and not response.text.startswith('Bad API request'):
         return response.text
     else:
-        raise Exception(f"Error creating paste: {response.text}")
\ No newline at end of file
+        raise Exception(f"Error creating paste: {response.text}")
+
+
+def create_paste(title, content):
+    url, data = _paste_request(title, content)
+    return _paste_result(get_service("pastebin").post(url, data=data))
+
+
+async def acreate_paste(title, content):
+    url, data = _paste_request(title, content)
+    return _paste_result(await get_async_service("pastebin").post(url, data=data))
@@ -0,0 +1,381 @@
+import os
+import asyncio
+import weakref
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from config import load_env
+from chunking import (
+    afix_segments,
+    asummarize_chunks,
+    fits_in_context,
+    fix_segments,
+    join_partials,
+    split_for_read,
+    summarize_chunks,
+)
+from llm_cache import acached_generate, cached_generate_stream
+from ollama_client import split_hosts
+from prompts import READ_PROMPT, REDUCE_PROMPT, REPHRASE_PROMPT, SUMMARY_PROMPT
+from singleflight import AsyncSingleFlight, SingleFlight
+from telemetry import cache_result, get_logger, timed
+from transcript import Transcript
+from transcript_store import get_store as get_transcript_store
+from yt_audiophile import acquire_audio, release_audio
+from whisper_module import WindowedTranscription, transcribe_audio, transcribe_segments, window_seconds
+
+load_env()
+
+# Each stage hits a different backend, so each gets its own concurrency limit
+stage_limits = {
+    "transcript": int(os.getenv("TRANSCRIPT_WORKERS", "8")),
+    "download": int(os.getenv("DOWNLOAD_WORKERS", "2")),
+    "whisper": int(os.getenv("WHISPER_WORKERS", "2")),
+    # Per Ollama host, as the router spreads requests over them
+    "ollama": int(os.getenv("OLLAMA_WORKERS", "2")) * max(1, len(split_hosts(os.getenv("OLLAMA_URL")))),
+}
+_stage_semaphores = {
+    stage: threading.BoundedSemaphore(limit) for stage, limit in stage_limits.items()
+}
+
+# Requests for the same video arriving together share one caption fetch and
+# one Whisper transcription
+_flights = SingleFlight()
+_async_flights = AsyncSingleFlight()
+
+log = get_logger("pipeline")
+
+# Imported on the first caption fetch; benchmarks replace it beforehand
+YouTubeTranscriptApi = None
+
+
+def _transcript_api():
+    global YouTubeTranscriptApi
+    if YouTubeTranscriptApi is None:
+        from youtube_transcript_api import YouTubeTranscriptApi
+    return YouTubeTranscriptApi
+
+
+def configure_limits(**limits):
+    for stage, value in limits.items():
+        if value:
+            stage_limits[stage] = value
+            _stage_semaphores[stage] = threading.BoundedSemaphore(value)
+
+
+@contextmanager
+def limit(stage):
+    with _stage_semaphores[stage]:
+        yield
+
+
+# asyncio counterparts of the stage semaphores, one set per event loop
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+@asynccontextmanager
+async def alimit(stage):
+    semaphores = _async_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if stage not in semaphores:
+        semaphores[stage] = asyncio.Semaphore(stage_limits[stage])
+    async with semaphores[stage]:
+        yield
+
+
+def _notify(notify, level, message):
+    if notify:
+        notify(level, message)
+    else:
+        log.info("progress", level=level, message=message)
+
+
+def extract_video_id(video_url):
+    video_id = None
+    # Get the video id from the url if it's a valid youtube or invidious or any other url that contains a video id
+    if "v=" in video_url:
+        video_id = video_url.split("v=")[-1]
+    # Support short urls as well
+    elif "youtu.be/" in video_url:
+        video_id = video_url.split("youtu.be/")[-1]
+    # And shorts, embedded players and live streams
+    else:
+        for marker in ("/shorts/", "/embed/", "/live/"):
+            if marker in video_url:
+                video_id = video_url.split(marker)[-1]
+                break
+    if not video_id:
+        raise Exception(f"Unable to find a video id in {video_url}")
+    # Also cut out any part of the url after the video id
+    for separator in ("&", "?", "#", "/"):
+        video_id = video_id.split(separator)[0]
+    if not video_id:
+        raise Exception(f"Unable to find a video id in {video_url}")
+    return video_id
+
+
+def get_transcript(video_id, source=None):
+    # Returns a Transcript, which keeps the segment timings; str() of it is
+    # the plain text
+    store = get_transcript_store()
+
+    # Check if transcript is cached
+    record = store.get(video_id, source, with_segments=True)
+    cache_result("transcript", record is not None)
+    if record:
+        return record["segments"]
+    if source == "whisper":
+        return None
+    return _flights.do(("captions", video_id), lambda: _fetch_captions(video_id))
+
+
+def _fetch_captions(video_id):
+    store = get_transcript_store()
+    # The previous fetch may have finished between the lookup and joining
+    record = store.get(video_id, with_segments=True)
+    if record:
+        return record["segments"]
+
+    try:
+        with limit("transcript"), timed("transcript", video_id=video_id):
+            transcript = _transcript_api().list_transcripts(
+                video_id
+            ).find_transcript(["en"])
+            segments = Transcript.from_segments(transcript.fetch())
+
+        # Cache the transcript along with its timestamps
+        store.put(
+            video_id,
+            segments,
+            source="captions",
+            language=transcript.language_code,
+        )
+
+        return segments
+    except Exception as e:
+        log.warning("captions_unavailable", video_id=video_id, error=str(e))
+        return None
+
+
+def _transcribe_limited(path):
+    with limit("whisper"):
+        return transcribe_segments(path)
+
+
+def transcribe_with_whisper(video_url, video_id, use_po_token=None, notify=None):
+    if window_seconds <= 0:
+        with limit("download"):
+            audio_path = acquire_audio(video_url, use_po_token=use_po_token)
+        try:
+            _notify(notify, "info", "Audio downloaded successfully!")
+            _notify(notify, "warning", "Starting transcription...it might take a while...")
+            segments = transcribe_audio(audio_path, _transcribe_limited)
+        finally:
+            release_audio(audio_path)
+    else:
+        # Windows are transcribed while the rest of the audio is still downloading
+        _notify(notify, "warning", "Downloading and transcribing audio...it might take a while...")
+        windows = WindowedTranscription(
+            _transcribe_limited, workers=stage_limits["whisper"]
+        )
+        try:
+            with limit("download"):
+                audio_path = acquire_audio(
+                    video_url, use_po_token=use_po_token, progress=windows.feed
+                )
+        except Exception:
+            windows.cancel()
+            raise
+        try:
+            _notify(notify, "info", "Audio downloaded successfully!")
+            segments = windows.finish(audio_path)
+        finally:
+            release_audio(audio_path)
+    transcript = Transcript.from_segments(segments)
+    get_transcript_store().put(video_id, transcript, source="whisper")
+    _notify(notify, "info", "Transcription completed successfully!")
+    return transcript
+
+
+def resolve_transcript(
+    video_url,
+    video_id,
+    fallback_to_whisper=True,
+    force_whisper=False,
+    use_po_token=None,
+    notify=None,
+):
+    # Forcing whisper if specified
+    if force_whisper:
+        _notify(notify, "warning", "Forcing whisper...")
+        transcript = get_transcript(video_id, source="whisper")
+        fallback_to_whisper = True
+    else:
+        transcript = get_transcript(video_id)
+        if transcript:
+            _notify(notify, "info", "Transcript fetched successfully!")
+
+    if transcript:
+        return transcript
+
+    log.info("whisper_fallback", video_id=video_id, enabled=fallback_to_whisper)
+    if not fallback_to_whisper:
+        raise Exception(
+            "Unable to fetch transcript (and fallback to whisper is disabled)"
+        )
+    if not force_whisper:
+        _notify(notify, "warning", "Unable to fetch transcript. Trying to download audio...")
+    try:
+        return _flights.do(
+            ("whisper", video_id),
+            lambda: _transcribe_once(video_url, video_id, use_po_token, notify),
+        )
+    except Exception as e:
+        log.error("whisper_failed", video_id=video_id, error=str(e))
+        raise Exception(f"Error downloading audio or transcribing: {e}")
+
+
+def _transcribe_once(video_url, video_id, use_po_token, notify):
+    record = get_transcript_store().get(video_id, "whisper", with_segments=True)
+    if record:
+        return record["segments"]
+    return transcribe_with_whisper(
+        video_url, video_id, use_po_token=use_po_token, notify=notify
+    )
+
+
+def pin_context(client, transcript):
+    # Every operation on a video runs with the num_ctx of the largest one, a
+    # rephrase of the whole transcript, so switching between them does not
+    # make Ollama reload the model and drop the cached transcript prefix
+    text = str(transcript)
+    return client.pinned(client.num_ctx_for(REPHRASE_PROMPT.format(text=text), rewrites=text))
+
+
+def summary_stream(client, transcript, notify=None):
+    # transcript is a Transcript or plain text; long Transcripts are chunked
+    # on segment boundaries
+    # The Ollama stage limit is taken per call, so the chunks summarized in
+    # parallel count against it too
+    text = str(transcript)
+    if fits_in_context(client, SUMMARY_PROMPT.format(text=text)):
+        with limit("ollama"):
+            yield from cached_generate_stream(client, SUMMARY_PROMPT, text)
+        return
+    # Too long for a single prompt: summarize chunks in parallel, then reduce
+    partials = summarize_chunks(
+        client,
+        transcript,
+        on_progress=lambda message: _notify(notify, "warning", message),
+        slot=lambda: limit("ollama"),
+    )
+    with limit("ollama"):
+        yield from cached_generate_stream(client, REDUCE_PROMPT, join_partials(partials))
+
+
+def summarize(client, transcript, notify=None):
+    return "".join(summary_stream(client, transcript, notify=notify))
+
+
+def read_stream(client, transcript):
+    with limit("ollama"):
+        yield from cached_generate_stream(client, READ_PROMPT, str(transcript))
+
+
+def enhance_segments(client, segments):
+    # Yields (index, text) as each segment is enhanced, in completion order
+    yield from fix_segments(client, segments, slot=lambda: limit("ollama"))
+
+
+def enhance(client, transcript):
+    segments = split_for_read(client, transcript)
+    if len(segments) == 1:
+        return "".join(read_stream(client, transcript))
+    fixed = dict(enhance_segments(client, segments))
+    return "\n\n".join(fixed[i] for i in range(len(segments)))
+
+
+# asyncio variants for high fan-out callers such as the batch CLI. Ollama and
+# the YouTube Data API are called with httpx; the caption library, the audio
+# download and Whisper are sync only and run in threads, bounded by the same
+# per-stage limits
+
+
+async def aget_transcript(video_id, source=None):
+    store = get_transcript_store()
+    record = store.get(video_id, source, with_segments=True)
+    cache_result("transcript", record is not None)
+    if record:
+        return record["segments"]
+    if source == "whisper":
+        return None
+
+    async def fetch():
+        async with alimit("transcript"):
+            return await asyncio.to_thread(_fetch_captions, video_id)
+
+    return await _async_flights.do(("captions", video_id), fetch)
+
+
+async def aresolve_transcript(
+    video_url,
+    video_id,
+    fallback_to_whisper=True,
+    force_whisper=False,
+    use_po_token=None,
+    notify=None,
+):
+    if force_whisper:
+        _notify(notify, "warning", "Forcing whisper...")
+        transcript = await aget_transcript(video_id, source="whisper")
+        fallback_to_whisper = True
+    else:
+        transcript = await aget_transcript(video_id)
+        if transcript:
+            _notify(notify, "info", "Transcript fetched successfully!")
+
+    if transcript:
+        return transcript
+
+    log.info("whisper_fallback", video_id=video_id, enabled=fallback_to_whisper)
+    if not fallback_to_whisper:
+        raise Exception(
+            "Unable to fetch transcript (and fallback to whisper is disabled)"
+        )
+    if not force_whisper:
+        _notify(notify, "warning", "Unable to fetch transcript. Trying to download audio...")
+
+    async def transcribe():
+        async with alimit("whisper"):
+            return await asyncio.to_thread(
+                _transcribe_once, video_url, video_id, use_po_token, notify
+            )
+
+    try:
+        return await _async_flights.do(("whisper", video_id), transcribe)
+    except Exception as e:
+        log.error("whisper_failed", video_id=video_id, error=str(e))
+        raise Exception(f"Error downloading audio or transcribing: {e}")
+
+
+async def asummarize(client, transcript, notify=None):
+    await client.acontext_size()
+    text = str(transcript)
+    if fits_in_context(client, SUMMARY_PROMPT.format(text=text)):
+        async with alimit("ollama"):
+            return await acached_generate(client, SUMMARY_PROMPT, text)
+    partials = await asummarize_chunks(
+        client,
+        transcript,
+        on_progress=lambda message: _notify(notify, "warning", message),
+        slot=lambda: alimit("ollama"),
+    )
+    async with alimit("ollama"):
+        return await acached_generate(client, REDUCE_PROMPT, join_partials(partials))
+
+
+async def aenhance(client, transcript):
+    await client.acontext_size()
+    segments = split_for_read(client, transcript)
+    if len(segments) == 1:
+        async with alimit("ollama"):
+            return await acached_generate(client, READ_PROMPT, str(transcript))
+    return "\n\n".join(await afix_segments(client, segments, slot=lambda: alimit("ollama")))
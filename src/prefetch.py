@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+import heapq
+import argparse
+import threading
+from datetime import datetime
+from config import load_env
+from ollama_client import get_client
+from pipeline import get_transcript, resolve_transcript, summarize
+from telemetry import counter, get_logger, serve_metrics, timed
+from transcript_store import get_store as get_transcript_store
+from video_info import expand_url
+from yt_audiophile import get_po_token_setting
+
+load_env()
+
+# Channel and playlist URLs whose newest videos are prefetched, comma separated
+prefetch_sources = [url.strip() for url in os.getenv("PREFETCH_SOURCES", "").split(",") if url.strip()]
+prefetch_videos = int(os.getenv("PREFETCH_VIDEOS_PER_SOURCE", "20"))
+prefetch_interval = float(os.getenv("PREFETCH_INTERVAL_MINUTES", "60")) * 60
+# Local hours, as start-end, during which Whisper and summaries may run;
+# empty for any time
+prefetch_idle_hours = os.getenv("PREFETCH_IDLE_HOURS", "1-7")
+# Tasks started per hour, per task; 0 disables the task
+prefetch_rates = {
+    "captions": float(os.getenv("PREFETCH_CAPTIONS_PER_HOUR", "600")),
+    "whisper": float(os.getenv("PREFETCH_WHISPER_PER_HOUR", "4")),
+    "summary": float(os.getenv("PREFETCH_SUMMARIES_PER_HOUR", "30")),
+}
+
+# Tasks in priority order: captions are cheap and make the most videos
+# instant, Whisper and summaries hold the GPU and only run when idle
+TASKS = ("captions", "whisper", "summary")
+IDLE_ONLY = ("whisper", "summary")
+# Longest sleep between checks of the idle window and the job queue
+POLL_SECONDS = 60
+
+PREFETCH = counter("youlama_prefetch_total", "Prefetch tasks by outcome", ("task", "outcome"))
+log = get_logger("prefetch")
+
+
+def parse_hours(value):
+    # "1-7" -> (1, 7); windows may wrap around midnight, as in "22-6"
+    if not value.strip():
+        return None
+    start, end = value.split("-")
+    return int(start) % 24, int(end) % 24
+
+
+def in_hours(hours, hour):
+    if hours is None:
+        return True
+    start, end = hours
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+class RateLimit:
+    # Spaces task starts evenly, at most per_hour an hour
+    def __init__(self, per_hour):
+        self.interval = 3600 / per_hour if per_hour > 0 else None
+        self.next_at = 0.0
+
+    def wait(self, now):
+        # Seconds until the next start is allowed, None if never
+        if self.interval is None:
+            return None
+        return max(0.0, self.next_at - now)
+
+    def take(self, now):
+        self.next_at = max(self.next_at, now) + self.interval
+
+
+class Prefetcher:
+    # Keeps the transcript store and the LLM cache warm for the newest videos
+    # of watched channels and playlists, so their first viewer does not pay
+    # for captions, Whisper or the summary. One background thread works
+    # through a priority queue per task; interactive jobs always come first
+    def __init__(
+        self,
+        sources=None,
+        videos=None,
+        interval=None,
+        idle_hours=None,
+        rates=None,
+        ollama_url=None,
+        model=None,
+        busy=None,
+    ):
+        self.sources = prefetch_sources if sources is None else sources
+        self.videos = videos or prefetch_videos
+        self.interval = prefetch_interval if interval is None else interval
+        self.idle_hours = parse_hours(prefetch_idle_hours if idle_hours is None else idle_hours)
+        self.limits = {task: RateLimit(rate) for task, rate in {**prefetch_rates, **(rates or {})}.items()}
+        self.ollama_url = ollama_url or os.getenv("OLLAMA_URL")
+        self.model = model or os.getenv("OLLAMA_MODEL")
+        # Returns True while interactive jobs are queued or running
+        self.busy = busy or (lambda: False)
+        self.queues = {task: [] for task in TASKS}
+        self.queued = set()
+        # Videos already handled by this process are not listed again
+        self.handled = set()
+        self.sequence = 0
+        self.refreshed_at = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def enqueue(self, task, video_id, rank):
+        # Lower ranks run first: the order of the sources, then of the
+        # listing, which is newest first for channels
+        if self.limits[task].interval is None or (task, video_id) in self.queued:
+            return
+        self.queued.add((task, video_id))
+        self.sequence += 1
+        heapq.heappush(self.queues[task], (rank, self.sequence, video_id))
+
+    def refresh(self):
+        for i, url in enumerate(self.sources):
+            try:
+                video_ids = expand_url(url, limit=self.videos)
+            except Exception as e:
+                log.warning("prefetch_source_failed", url=url, error=str(e))
+                continue
+            if video_ids is None:
+                log.warning("prefetch_source_ignored", url=url)
+                continue
+            for position, video_id in enumerate(video_ids):
+                if video_id not in self.handled:
+                    self.handled.add(video_id)
+                    self.enqueue("captions", video_id, (i, position))
+        self.refreshed_at = time.monotonic()
+
+    def idle(self):
+        return in_hours(self.idle_hours, datetime.now().hour) and not self.busy()
+
+    def next_task(self):
+        # (task, rank, video_id) of the most urgent runnable task, or the
+        # seconds to wait until one may be runnable
+        now = time.monotonic()
+        wait = POLL_SECONDS
+        idle = None
+        for task in TASKS:
+            if not self.queues[task]:
+                continue
+            if task in IDLE_ONLY:
+                if idle is None:
+                    idle = self.idle()
+                if not idle:
+                    continue
+            delay = self.limits[task].wait(now)
+            if delay is None:
+                continue
+            if delay > 0:
+                wait = min(wait, delay)
+                continue
+            self.limits[task].take(now)
+            rank, _, video_id = heapq.heappop(self.queues[task])
+            self.queued.discard((task, video_id))
+            return task, rank, video_id
+        return wait
+
+    def run_task(self, task, rank, video_id):
+        try:
+            with timed(f"prefetch_{task}", video_id=video_id):
+                getattr(self, f"_{task}")(rank, video_id)
+        except Exception as e:
+            PREFETCH.inc(task=task, outcome="failed")
+            log.warning("prefetch_failed", task=task, video_id=video_id, error=str(e))
+        else:
+            PREFETCH.inc(task=task, outcome="ok")
+
+    def _captions(self, rank, video_id):
+        transcript = get_transcript(video_id)
+        if transcript:
+            self.enqueue("summary", video_id, rank)
+        else:
+            self.enqueue("whisper", video_id, rank)
+
+    def _whisper(self, rank, video_id):
+        resolve_transcript(
+            f"https://www.youtube.com/watch?v={video_id}",
+            video_id,
+            force_whisper=True,
+            use_po_token=get_po_token_setting(),
+        )
+        self.enqueue("summary", video_id, rank)
+
+    def _summary(self, rank, video_id):
+        # Lands in the LLM cache under the same key as an interactive summary
+        # of the default model
+        record = get_transcript_store().get(video_id, with_segments=True)
+        if record is None:
+            raise Exception("Transcript no longer stored")
+        summarize(get_client(self.ollama_url, self.model), record["segments"])
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def step(self):
+        # Runs one task; returns the seconds to sleep when none is runnable
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.interval:
+            self.refresh()
+        task = self.next_task()
+        if isinstance(task, tuple):
+            self.run_task(*task)
+            return 0
+        if self.interval:
+            task = min(task, max(0.0, self.refreshed_at + self.interval - time.monotonic()))
+        return task
+
+    def run(self):
+        log.info("prefetch_started", sources=len(self.sources), model=self.model)
+        while not self.stop_event.is_set():
+            wait = self.step()
+            if wait:
+                self.stop_event.wait(wait)
+
+    def run_once(self):
+        # One listing of every source, worked through until nothing is left
+        # that may run now
+        self.refresh()
+        while True:
+            task = self.next_task()
+            if isinstance(task, tuple):
+                self.run_task(*task)
+                continue
+            idle = self.idle()
+            if not any(self.queues[name] for name in TASKS if idle or name not in IDLE_ONLY):
+                return
+            time.sleep(task)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="prefetch", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def start_prefetch(busy=None):
+    # Starts the background prefetcher once per process, if any source is
+    # configured
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None and prefetch_sources:
+            _prefetcher = Prefetcher(busy=busy).start()
+        return _prefetcher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prefetch transcripts and summaries of the newest videos of channels and playlists"
+    )
+    parser.add_argument("sources", nargs="*", help="Channel or playlist URLs (default PREFETCH_SOURCES)")
+    parser.add_argument("--once", action="store_true", help="List the sources once and exit when done")
+    parser.add_argument("--videos", type=int, help=f"Videos per source (default {prefetch_videos})")
+    parser.add_argument(
+        "--idle-hours",
+        help=f"Hours when Whisper and summaries run, as start-end, '' for any (default {prefetch_idle_hours!r})",
+    )
+    parser.add_argument("--model", default=os.getenv("OLLAMA_MODEL"))
+    parser.add_argument("--ollama-url", default=os.getenv("OLLAMA_URL"))
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve /metrics on this port while running")
+    args = parser.parse_args(argv)
+
+    prefetcher = Prefetcher(
+        sources=args.sources or None,
+        videos=args.videos,
+        idle_hours=args.idle_hours,
+        ollama_url=args.ollama_url,
+        model=args.model,
+    )
+    if not prefetcher.sources:
+        print("No sources given and PREFETCH_SOURCES is empty", file=sys.stderr)
+        return 1
+    serve_metrics(args.metrics_port)
+    if args.once:
+        prefetcher.run_once()
+        print(f"Done, {prefetcher.pending()} tasks left for the idle hours", file=sys.stderr)
+    else:
+        try:
+            prefetcher.run()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+class Prompt:
+    # Bump the version whenever the template text changes so cached results
+    # produced by the old wording are no longer served.
+    # Templates that take a whole transcript put it first: Ollama reuses the
+    # KV cache of a matching prompt prefix, so summarizing, reading and
+    # rephrasing the same video only pay the transcript prefill once.
+    # rewrites marks templates answered with a new version of their text,
+    # about as many tokens long, which the context has to leave room for
+    def __init__(self, name, version, template, rewrites=False):
+        self.name = name
+        self.version = version
+        self.template = template
+        self.rewrites = rewrites
+
+    def format(self, **kwargs):
+        return self.template.format(**kwargs)
+
+
+SUMMARY_PROMPT = Prompt(
+    "summary",
+    2,
+    "YouTube video transcript:\n\n```{text}```\n\nSummarize the transcript above in a concise yet detailed manner. Summary with introduction and conclusion formatted in markdown:",
+)
+
+CHUNK_PROMPT = Prompt(
+    "chunk_summary",
+    2,
+    "YouTube video transcript:\n\n```{text}```\n\nThe transcript above is part {index} of {total} of the video. Summarize it, keeping every important fact, name and number. Summary:",
+)
+
+REDUCE_PROMPT = Prompt(
+    "reduce_summary",
+    1,
+    "The following are summaries of consecutive parts of one YouTube video transcript:\n\n{text}\n\nCombine them into a single concise yet detailed summary with introduction and conclusion formatted in markdown:",
+)
+
+READ_PROMPT = Prompt(
+    "read",
+    2,
+    """YouTube video transcript:\n\n```{text}```\n\nFix the grammar and punctuation of the transcript above, maintaining the exact same content and meaning.
+Only correct grammatical errors, add proper punctuation, and fix sentence structure where needed.
+Do not rephrase or change the content. Reply with the corrected text only:""",
+    rewrites=True,
+)
+
+REPHRASE_PROMPT = Prompt(
+    "rephrase",
+    2,
+    "YouTube video transcript:\n\n```{text}```\n\nRephrase the transcript above to make it more readable and well-formatted, keeping the main content intact:",
+    rewrites=True,
+)
+
+QA_PROMPT = Prompt(
+    "qa",
+    1,
+    """Answer the question about a YouTube video using only the following excerpts of its transcript. Each excerpt starts with its timestamp; cite the timestamps you used. If the excerpts do not contain the answer, say so.
+
+{text}
+
+{history}Question: {question}
+
+Answer:""",
+)
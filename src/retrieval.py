@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import numpy as np
+from config import load_env
+from chunking import CHARS_PER_TOKEN, chunk_text
+from llm_cache import cached_generate_stream, text_hash
+from ollama_client import get_client
+from prompts import QA_PROMPT
+from singleflight import SingleFlight
+from telemetry import cache_result, get_logger, timed
+from transcript import format_timestamp
+
+load_env()
+
+index_path = os.getenv("EMBEDDING_INDEX_PATH", "transcript_cache/embeddings.sqlite3")
+index_max_age = float(os.getenv("EMBEDDING_INDEX_MAX_AGE_DAYS", "30")) * 86400
+embed_model = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+# Small chunks keep the answer prompt short; the overlap keeps a sentence cut
+# at a chunk boundary retrievable from either side
+retrieval_chunk_tokens = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "250"))
+retrieval_overlap_tokens = int(os.getenv("RETRIEVAL_OVERLAP_TOKENS", "50"))
+retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Earlier questions and answers sent along with a follow-up question
+qa_history_turns = int(os.getenv("QA_HISTORY_TURNS", "3"))
+
+EVICT_EVERY = 50
+
+log = get_logger("retrieval")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _retrieval_chunks(transcript, max_tokens, overlap_tokens):
+    # (start, end, text) per chunk, on segment boundaries. A segment longer
+    # than a chunk (Whisper windows) is split as text, with times
+    # interpolated over the segment
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = min(overlap_tokens, max_tokens // 2) * CHARS_PER_TOKEN
+    chunks = []
+    for view in transcript.chunks(max_chars, overlap_chars):
+        text = view.text
+        if not text.strip():
+            continue
+        if len(text) <= max_chars:
+            chunks.append((view.start, view.end, text))
+            continue
+        position = 0
+        for piece in chunk_text(text, max_tokens, overlap_tokens=0):
+            found = text.find(piece[:50], position)
+            position = found if found >= 0 else position
+            fraction = position / len(text)
+            span = view.end - view.start
+            chunks.append(
+                (
+                    view.start + span * fraction,
+                    view.start + span * min(1.0, fraction + len(piece) / len(text)),
+                    piece,
+                )
+            )
+    return chunks
+
+
+class VectorIndex:
+    # Unit-length chunk embeddings in one float32 matrix, so scoring every
+    # chunk against a question is a single matrix-vector product
+    def __init__(self, vectors, starts, ends, texts):
+        self.vectors = vectors
+        self.starts = starts
+        self.ends = ends
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def build(cls, embedder, transcript, max_tokens=None, overlap_tokens=None):
+        chunks = _retrieval_chunks(
+            transcript,
+            max_tokens or retrieval_chunk_tokens,
+            retrieval_overlap_tokens if overlap_tokens is None else overlap_tokens,
+        )
+        texts = [text for _, _, text in chunks]
+        vectors = np.asarray(embedder.embed(texts), dtype=np.float32) if texts else None
+        return cls(
+            _normalize(vectors) if vectors is not None else np.zeros((0, 0), dtype=np.float32),
+            np.array([start for start, _, _ in chunks], dtype=np.float64),
+            np.array([end for _, end, _ in chunks], dtype=np.float64),
+            texts,
+        )
+
+    def search(self, query, k):
+        # [(score, chunk index)] of the k chunks most similar to the query
+        # vector, best first
+        if not len(self):
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(i)) for i in top]
+
+    def pack(self):
+        chunks = {"starts": self.starts.tolist(), "ends": self.ends.tolist(), "texts": self.texts}
+        return self.vectors.tobytes(), zlib.compress(json.dumps(chunks).encode("utf-8"), 6)
+
+    @classmethod
+    def unpack(cls, dim, vectors, chunks):
+        chunks = json.loads(zlib.decompress(chunks))
+        return cls(
+            np.frombuffer(vectors, dtype=np.float32).reshape(-1, dim) if dim else np.zeros((0, 0), dtype=np.float32),
+            np.array(chunks["starts"], dtype=np.float64),
+            np.array(chunks["ends"], dtype=np.float64),
+            chunks["texts"],
+        )
+
+
+class IndexStore:
+    # Chunk embeddings per video and embedding model, kept next to the
+    # transcript store; an index is rebuilt when its transcript changed
+    def __init__(self, path=index_path, max_age=index_max_age):
+        self.path = path
+        self.max_age = max_age
+        self.writes = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS indexes (
+                video_id TEXT NOT NULL,
+                model TEXT NOT NULL,
+                transcript TEXT NOT NULL,
+                created REAL NOT NULL,
+                dim INTEGER NOT NULL,
+                vectors BLOB NOT NULL,
+                chunks BLOB NOT NULL,
+                PRIMARY KEY (video_id, model)
+            ) WITHOUT ROWID"""
+        )
+        self.conn.commit()
+
+    def get(self, video_id, model, transcript_hash):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT transcript, created, dim, vectors, chunks FROM indexes WHERE video_id = ? AND model = ?",
+                (video_id, model),
+            ).fetchone()
+        if row is None or row[0] != transcript_hash:
+            return None
+        if self.max_age and time.time() - row[1] > self.max_age:
+            return None
+        return VectorIndex.unpack(row[2], row[3], row[4])
+
+    def put(self, video_id, model, transcript_hash, index):
+        now = time.time()
+        vectors, chunks = index.pack()
+        dim = index.vectors.shape[1] if len(index) else 0
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO indexes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (video_id, model, transcript_hash, now, dim, vectors, chunks),
+            )
+            self.conn.commit()
+            self.writes += 1
+            if self.max_age and self.writes % EVICT_EVERY == 0:
+                self.conn.execute("DELETE FROM indexes WHERE created < ?", (now - self.max_age,))
+                self.conn.commit()
+
+    def delete(self, video_id):
+        with self.lock:
+            deleted = self.conn.execute(
+                "DELETE FROM indexes WHERE video_id = ?", (video_id,)
+            ).rowcount
+            self.conn.commit()
+        return deleted
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_index_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IndexStore()
+        return _store
+
+
+# Questions about a video that is not indexed yet share one build
+_flights = SingleFlight()
+
+
+def get_index(video_id, transcript, ollama_url, model=None, notify=None):
+    # Built with the embeddings endpoint on the first question about a video,
+    # then loaded from the index store
+    model = model or embed_model
+    store = get_index_store()
+    transcript_hash = text_hash(str(transcript))
+    index = store.get(video_id, model, transcript_hash)
+    cache_result("embedding_index", index is not None)
+    if index is not None:
+        return index
+
+    def build():
+        index = store.get(video_id, model, transcript_hash)
+        if index is None:
+            if notify:
+                notify("warning", "Indexing the transcript for questions...")
+            with timed("embedding_index", video_id=video_id, segments=len(transcript)):
+                index = VectorIndex.build(get_client(ollama_url, model), transcript)
+            store.put(video_id, model, transcript_hash, index)
+            log.info("index_built", video_id=video_id, model=model, chunks=len(index))
+        return index
+
+    return _flights.do(("index", video_id, model, transcript_hash), build)
+
+
+def format_excerpts(index, hits):
+    # Excerpts in transcript order read more naturally than by score;
+    # untimed transcripts (end 0) get no timestamp
+    excerpts = []
+    for i in sorted(i for _, i in hits):
+        prefix = f"[{format_timestamp(index.starts[i])}] " if index.ends[i] else ""
+        excerpts.append(prefix + index.texts[i])
+    return "\n\n".join(excerpts)
+
+
+def format_history(history):
+    # history is a list of (question, answer) pairs, oldest first
+    turns = list(history)[-qa_history_turns:] if qa_history_turns else []
+    if not turns:
+        return ""
+    lines = [f"Q: {question}\nA: {answer}" for question, answer in turns]
+    return "Earlier in this conversation:\n" + "\n\n".join(lines) + "\n\n"
+
+
+def answer_stream(client, video_id, transcript, question, history=(), top_k=None, notify=None):
+    # Only the top-k chunks closest to the question go into the prompt, so a
+    # follow-up question costs a short prefill instead of the full transcript
+    index = get_index(video_id, transcript, client.base_url, notify=notify)
+    embedder = get_client(client.base_url, embed_model)
+    with timed("retrieval", video_id=video_id, chunks=len(index)):
+        hits = index.search(embedder.embed([question])[0], top_k or retrieval_top_k)
+    yield from cached_generate_stream(
+        client,
+        QA_PROMPT,
+        format_excerpts(index, hits),
+        question=question,
+        history=format_history(history),
+    )
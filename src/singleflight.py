@@ -0,0 +1,171 @@
+import asyncio
+import weakref
+import threading
+
+
+class _Abandoned(Exception):
+    pass
+
+
+class Flight:
+    # One in-progress computation; followers can wait for its result or
+    # replay its chunks as the leader produces them
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        # Followers still reading, counted under the SingleFlight lock
+        self.followers = 0
+
+    def publish(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.condition:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            while not self.done:
+                self.condition.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def follow(self):
+        index = 0
+        while True:
+            with self.condition:
+                while index == len(self.chunks) and not self.done:
+                    self.condition.wait()
+                chunks = self.chunks[index:]
+                done = self.done
+            yield from chunks
+            index += len(chunks)
+            if done:
+                break
+        if self.error is not None:
+            raise self.error
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one computation instead of
+    # each hitting the backend
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def _join(self, key):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self.flights[key] = Flight()
+            return flight, True
+
+    def _leave(self, key):
+        with self.lock:
+            self.flights.pop(key, None)
+
+    def do(self, key, fn):
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.wait()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._leave(key)
+            flight.finish(error=e)
+            raise
+        self._leave(key)
+        flight.finish(result=result)
+        return result
+
+    def stream(self, key, fn):
+        flight, leader = self._join(key)
+        if not leader:
+            try:
+                yield from flight.follow()
+            finally:
+                with self.lock:
+                    flight.followers -= 1
+            return
+        chunks = fn()
+        try:
+            for chunk in chunks:
+                flight.publish(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The leader's consumer stopped reading. Followers still want the
+            # output, so the rest is read for them in the background; with
+            # none left the call is abandoned
+            with self.lock:
+                handover = flight.followers > 0
+                if not handover:
+                    self.flights.pop(key, None)
+            if handover:
+                threading.Thread(target=self._drain, args=(key, flight, chunks), daemon=True).start()
+            else:
+                flight.finish(error=Exception("Shared request was abandoned"))
+                chunks.close()
+            raise
+        except BaseException as e:
+            self._leave(key)
+            flight.finish(error=e)
+            raise
+        self._leave(key)
+        flight.finish()
+
+    def _drain(self, key, flight, chunks):
+        try:
+            for chunk in chunks:
+                flight.publish(chunk)
+        except BaseException as e:
+            self._leave(key)
+            flight.finish(error=e)
+            return
+        self._leave(key)
+        flight.finish()
+
+
+class AsyncSingleFlight:
+    # asyncio counterpart of SingleFlight; flights are tracked per event loop
+    def __init__(self):
+        self.flights = weakref.WeakKeyDictionary()
+
+    async def do(self, key, fn):
+        loop = asyncio.get_running_loop()
+        flights = self.flights.setdefault(loop, {})
+        while key in flights:
+            try:
+                # Shielded so a cancelled follower does not cancel the leader
+                return await asyncio.shield(flights[key])
+            except _Abandoned:
+                # The leader was cancelled; the first follower to wake up
+                # takes over and runs fn again, the others follow it
+                pass
+        future = flights[key] = loop.create_future()
+        try:
+            result = await fn()
+        except BaseException as e:
+            flights.pop(key, None)
+            # Cancellation is the leader's own; followers are told to retry
+            # rather than being cancelled along with it
+            if isinstance(e, asyncio.CancelledError):
+                future.set_exception(_Abandoned())
+            else:
+                future.set_exception(e)
+            # Mark it retrieved, there may be no follower to do so
+            future.exception()
+            raise
+        flights.pop(key, None)
+        future.set_result(result)
+        return result
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import load_env
+
+load_env()
+
+# 0 disables the /metrics endpoint
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+log_format = os.getenv("LOG_FORMAT", "json")
+
+# Seconds; stages range from cache lookups to hour-long transcriptions
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600,
+)
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (last one is +Inf), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", bound)])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def _register(cls, name, *args, **kwargs):
+    # Streamlit re-executes main.py on every rerun, so registering twice
+    # returns the existing metric
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = cls(name, *args, **kwargs)
+        return _metrics[name]
+
+
+def counter(name, help, labelnames=()):
+    return _register(Counter, name, help, labelnames)
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help, labelnames, buckets)
+
+
+def render():
+    lines = []
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram(
+    "youlama_stage_seconds", "Time spent per pipeline stage", ("stage", "outcome")
+)
+CACHE_REQUESTS = counter(
+    "youlama_cache_requests_total", "Cache lookups by cache and result", ("cache", "result")
+)
+AUDIO_BYTES = counter(
+    "youlama_audio_bytes_total", "Audio bytes downloaded from YouTube and sent to Whisper", ("direction",)
+)
+OLLAMA_LOAD_SECONDS = histogram(
+    "youlama_ollama_load_seconds", "Time Ollama spent loading the model", ("model",)
+)
+OLLAMA_PROMPT_EVAL_SECONDS = histogram(
+    "youlama_ollama_prompt_eval_seconds", "Time Ollama spent evaluating prompts", ("model",)
+)
+OLLAMA_EVAL_SECONDS = histogram(
+    "youlama_ollama_eval_seconds", "Time Ollama spent generating responses", ("model",)
+)
+OLLAMA_PROMPT_TOKENS = counter(
+    "youlama_ollama_prompt_tokens_total", "Prompt tokens evaluated by Ollama", ("model",)
+)
+OLLAMA_GENERATED_TOKENS = counter(
+    "youlama_ollama_generated_tokens_total", "Tokens generated by Ollama", ("model",)
+)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["error"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        return f"{record.levelname} {record.name} {record.getMessage()} {fields}".rstrip()
+
+
+class EventLogger:
+    # Log lines are an event name plus flat fields, never transcripts or
+    # generated text
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def _log(self, level, event, fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+
+_logging_configured = False
+
+
+def get_logger(name):
+    global _logging_configured
+    with _metrics_lock:
+        if not _logging_configured:
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+            root = logging.getLogger("youlama")
+            root.addHandler(handler)
+            root.setLevel(log_level)
+            root.propagate = False
+            _logging_configured = True
+    return EventLogger(f"youlama.{name}")
+
+
+log = get_logger("telemetry")
+
+
+@contextmanager
+def timed(stage, **fields):
+    # Records the duration of a stage; fields only go to the log line, the
+    # metric is labelled by stage and outcome to keep its cardinality low
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage, outcome=outcome)
+        log.info("stage", stage=stage, outcome=outcome, seconds=round(elapsed, 3), **fields)
+
+
+def cache_result(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_ollama(model, stats):
+    # Ollama reports durations in nanoseconds on its final response
+    if "load_duration" in stats:
+        OLLAMA_LOAD_SECONDS.observe(stats["load_duration"] / 1e9, model=model)
+    if "prompt_eval_duration" in stats:
+        OLLAMA_PROMPT_EVAL_SECONDS.observe(stats["prompt_eval_duration"] / 1e9, model=model)
+    if "eval_duration" in stats:
+        OLLAMA_EVAL_SECONDS.observe(stats["eval_duration"] / 1e9, model=model)
+    OLLAMA_PROMPT_TOKENS.inc(stats.get("prompt_eval_count", 0), model=model)
+    OLLAMA_GENERATED_TOKENS.inc(stats.get("eval_count", 0), model=model)
+    eval_seconds = stats.get("eval_duration", 0) / 1e9
+    log.info(
+        "ollama",
+        model=model,
+        prompt_tokens=stats.get("prompt_eval_count"),
+        prompt_eval_seconds=round(stats.get("prompt_eval_duration", 0) / 1e9, 3),
+        tokens=stats.get("eval_count"),
+        eval_seconds=round(eval_seconds, 3),
+        tokens_per_second=(
+            round(stats.get("eval_count", 0) / eval_seconds, 1) if eval_seconds else None
+        ),
+    )
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port=None):
+    # Starts the /metrics endpoint once per process
+    global _server
+    port = metrics_port if port is None else port
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+            except OSError as e:
+                # Do not retry on every rerun
+                log.warning("metrics_unavailable", port=port, error=str(e))
+                _server = False
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            log.info("metrics_listening", port=port)
+        return _server or None
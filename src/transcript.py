@@ -0,0 +1,156 @@
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+# Segments are joined with a single space, so the text of a run of segments
+# is one contiguous slice of the buffer
+SEPARATOR = " "
+
+
+class Transcript:
+    # Timed transcript segments kept as one text buffer plus parallel arrays of
+    # start times, durations and character offsets, instead of a dict and a
+    # string object per segment. Segment i is
+    # text[offsets[i]:offsets[i + 1] - 1]. Slicing returns a view that shares
+    # the buffer and the arrays; the text of a view is only copied out when
+    # it is asked for
+    __slots__ = ("buffer", "starts", "durations", "offsets")
+
+    def __init__(self, buffer, starts, durations, offsets):
+        self.buffer = buffer
+        self.starts = memoryview(starts)
+        self.durations = memoryview(durations)
+        self.offsets = memoryview(offsets)
+
+    @classmethod
+    def from_segments(cls, segments):
+        texts = [segment["text"] for segment in segments]
+        starts = array("d", [segment["start"] for segment in segments])
+        durations = array("d", [segment["duration"] for segment in segments])
+        offsets = array("I", accumulate((len(text) + 1 for text in texts), initial=0))
+        return cls(SEPARATOR.join(texts), starts, durations, offsets)
+
+    @classmethod
+    def from_text(cls, text, start=0.0, duration=0.0):
+        # Text without timings, such as Whisper output of a backend that does
+        # not report segments, is a single segment
+        return cls(text, array("d", [start]), array("d", [duration]), array("I", [0, len(text) + 1]))
+
+    def pack(self):
+        # Storage format of the transcript store: the compressed text, and the
+        # compressed start times, durations and character offsets. Offsets
+        # rather than segment lengths, so unpacking copies them in as they are
+        # instead of summing them up again in Python
+        offsets = array("I", (offset - self.offsets[0] for offset in self.offsets))
+        text = zlib.compress(self.text.encode("utf-8"), 6)
+        index = zlib.compress(
+            self.starts.tobytes() + self.durations.tobytes() + offsets.tobytes(), 6
+        )
+        return text, index
+
+    @classmethod
+    def unpack(cls, text, index):
+        # text is the already decompressed transcript text. An index holds
+        # 20 bytes per segment, plus 4 for the final offset; one without
+        # them is in the older format with segment lengths
+        raw = zlib.decompress(index)
+        count = len(raw) // 20
+        starts = array("d")
+        starts.frombytes(raw[: count * 8])
+        durations = array("d")
+        durations.frombytes(raw[count * 8 : count * 16])
+        offsets = array("I")
+        offsets.frombytes(raw[count * 16 :])
+        if len(raw) % 20 == 0:
+            offsets = array("I", accumulate((length + 1 for length in offsets), initial=0))
+        return cls(text, starts, durations, offsets)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __bool__(self):
+        return len(self) > 0 and self.offsets[-1] - 1 > self.offsets[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Transcript slices must be contiguous")
+            stop = max(start, stop)
+            return Transcript(
+                self.buffer,
+                self.starts[start:stop],
+                self.durations[start:stop],
+                self.offsets[start : stop + 1],
+            )
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("Transcript segment index out of range")
+        return {
+            "start": self.starts[key],
+            "duration": self.durations[key],
+            "text": self.buffer[self.offsets[key] : self.offsets[key + 1] - 1],
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"<Transcript {len(self)} segments, {self.start:.1f}s-{self.end:.1f}s>"
+
+    @property
+    def text(self):
+        if not len(self):
+            return ""
+        first, last = self.offsets[0], self.offsets[-1] - 1
+        if first == 0 and last == len(self.buffer):
+            return self.buffer
+        return self.buffer[first:last]
+
+    @property
+    def start(self):
+        return self.starts[0] if len(self) else 0.0
+
+    @property
+    def end(self):
+        return self.starts[-1] + self.durations[-1] if len(self) else 0.0
+
+    def index_at(self, seconds):
+        # Index of the segment playing at the given time, or of the last one
+        # that started before it
+        return max(0, bisect_right(self.starts, seconds) - 1)
+
+    def between(self, start, end):
+        # The segments overlapping [start, end), as a view
+        i = self.index_at(start)
+        if i < len(self) and self.starts[i] + self.durations[i] <= start and self.starts[i] < start:
+            i += 1
+        return self[i : max(i, bisect_left(self.starts, end))]
+
+    def chunks(self, max_chars, overlap_chars=0):
+        # Views of consecutive segments whose text is at most max_chars long,
+        # each repeating up to overlap_chars of the previous one. A segment
+        # longer than max_chars on its own is yielded as a chunk by itself
+        count = len(self)
+        i = 0
+        while i < count:
+            j = bisect_right(self.offsets, self.offsets[i] + max_chars + 1, i + 1, count + 1) - 1
+            j = max(j, i + 1)
+            yield self[i:j]
+            if j >= count:
+                break
+            i = bisect_left(self.offsets, self.offsets[j] - overlap_chars, i + 1, j)
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    if hours:
+        return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+    return f"{rest // 60}:{rest % 60:02d}"
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+import threading
+from config import load_env
+from transcript import Transcript
+
+load_env()
+
+store_path = os.getenv("TRANSCRIPT_STORE_PATH", "transcript_cache/transcripts.sqlite3")
+# 0 disables the corresponding eviction rule
+store_max_age = float(os.getenv("TRANSCRIPT_MAX_AGE_DAYS", "0")) * 86400
+store_max_entries = int(os.getenv("TRANSCRIPT_MAX_ENTRIES", "0"))
+
+# Captions are preferred over Whisper output when both are stored
+SOURCES = ("captions", "whisper")
+
+EVICT_EVERY = 100
+# Access times only need to be good enough for LRU eviction, so skip the
+# write on reads of entries touched recently
+ACCESS_RESOLUTION = 3600
+
+
+class TranscriptStore:
+    def __init__(self, path=store_path, max_age=store_max_age, max_entries=store_max_entries):
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.writes = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS transcripts (
+                video_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                language TEXT,
+                fetched REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL,
+                text BLOB NOT NULL,
+                segments BLOB NOT NULL,
+                PRIMARY KEY (video_id, source)
+            ) WITHOUT ROWID"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS transcripts_accessed ON transcripts (accessed)"
+        )
+        self.conn.commit()
+
+    def get(self, video_id, source=None, with_segments=False):
+        sources = (source,) if source else SOURCES
+        now = time.time()
+        with self.lock:
+            for candidate in sources:
+                row = self.conn.execute(
+                    "SELECT language, fetched, accessed, text, segments FROM transcripts WHERE video_id = ? AND source = ?",
+                    (video_id, candidate),
+                ).fetchone()
+                if row is None or (self.max_age and now - row[1] > self.max_age):
+                    continue
+                if now - row[2] > ACCESS_RESOLUTION:
+                    self.conn.execute(
+                        "UPDATE transcripts SET accessed = ? WHERE video_id = ? AND source = ?",
+                        (now, video_id, candidate),
+                    )
+                    self.conn.commit()
+                break
+            else:
+                return None
+        text = zlib.decompress(row[3]).decode("utf-8")
+        return {
+            "video_id": video_id,
+            "source": candidate,
+            "language": row[0],
+            "fetched": row[1],
+            "text": text,
+            "segments": Transcript.unpack(text, row[4]) if with_segments else None,
+        }
+
+    def put(self, video_id, segments, source="captions", language=None, fetched=None):
+        # segments is a Transcript or a list of segment dicts
+        now = time.time()
+        if not isinstance(segments, Transcript):
+            segments = Transcript.from_segments(segments)
+        text, index = segments.pack()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    video_id,
+                    source,
+                    language,
+                    fetched or now,
+                    now,
+                    len(text) + len(index),
+                    text,
+                    index,
+                ),
+            )
+            self.conn.commit()
+            self.writes += 1
+            if self.writes % EVICT_EVERY == 0:
+                self._evict(now, self.max_age, self.max_entries)
+
+    def delete(self, video_id):
+        with self.lock:
+            deleted = self.conn.execute(
+                "DELETE FROM transcripts WHERE video_id = ?", (video_id,)
+            ).rowcount
+            self.conn.commit()
+        return deleted
+
+    def evict(self, max_age=None, max_entries=None):
+        max_age = self.max_age if max_age is None else max_age
+        max_entries = self.max_entries if max_entries is None else max_entries
+        with self.lock:
+            return self._evict(time.time(), max_age, max_entries)
+
+    def _evict(self, now, max_age, max_entries):
+        evicted = 0
+        if max_age:
+            evicted += self.conn.execute(
+                "DELETE FROM transcripts WHERE fetched < ?", (now - max_age,)
+            ).rowcount
+        if max_entries:
+            # Keep the most recently used entries
+            evicted += self.conn.execute(
+                """DELETE FROM transcripts WHERE (video_id, source) IN (
+                    SELECT video_id, source FROM transcripts ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )""",
+                (max_entries,),
+            ).rowcount
+        self.conn.commit()
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT source, COUNT(*), COALESCE(SUM(size), 0) FROM transcripts GROUP BY source"
+            ).fetchall()
+        return {source: {"entries": count, "bytes": size} for source, count, size in rows}
+
+    def vacuum(self):
+        with self.lock:
+            self.conn.execute("VACUUM")
+
+    def migrate_json_dir(self, directory):
+        # Import the legacy transcript_cache/<video_id>.json files, which only
+        # kept the joined text, as a single untimed segment
+        migrated = 0
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, "r") as f:
+                text = json.load(f)["transcript"]
+            self.put(
+                name[: -len(".json")],
+                Transcript.from_text(text),
+                fetched=os.path.getmtime(path),
+            )
+            migrated += 1
+        return migrated
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TranscriptStore()
+        return _store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the transcript store")
+    parser.add_argument("--path", default=store_path)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show entry counts and sizes per source")
+    show = commands.add_parser("show", help="Print a stored transcript")
+    show.add_argument("video_id")
+    show.add_argument("--source", choices=SOURCES)
+    delete = commands.add_parser("delete", help="Delete every transcript of a video")
+    delete.add_argument("video_id")
+    evict = commands.add_parser("evict", help="Apply TTL and LRU eviction")
+    evict.add_argument("--max-age-days", type=float)
+    evict.add_argument("--max-entries", type=int)
+    migrate = commands.add_parser("migrate", help="Import legacy JSON cache files")
+    migrate.add_argument("directory", nargs="?", default="transcript_cache")
+    commands.add_parser("vacuum", help="Reclaim free space")
+    args = parser.parse_args(argv)
+
+    store = TranscriptStore(args.path)
+    if args.command == "stats":
+        print(json.dumps(store.stats(), indent=2))
+    elif args.command == "show":
+        record = store.get(args.video_id, args.source, with_segments=True)
+        if record is None:
+            print(f"No transcript stored for {args.video_id}")
+            return 1
+        record["segments"] = list(record["segments"])
+        print(json.dumps(record, indent=2, ensure_ascii=False))
+    elif args.command == "delete":
+        print(f"Deleted {store.delete(args.video_id)} transcripts")
+    elif args.command == "evict":
+        max_age = args.max_age_days * 86400 if args.max_age_days is not None else None
+        print(f"Evicted {store.evict(max_age, args.max_entries)} transcripts")
+    elif args.command == "migrate":
+        print(f"Migrated {store.migrate_json_dir(args.directory)} transcripts")
+    elif args.command == "vacuum":
+        store.vacuum()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
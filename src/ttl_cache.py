@@ -0,0 +1,52 @@
+import time
+import threading
+from collections import OrderedDict
+from singleflight import SingleFlight
+
+
+class TTLCache:
+    # Small thread-safe LRU whose entries expire after ttl seconds, or after
+    # their own ttl when one is given
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() > entry[0]:
+                return default
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, ttl=None):
+        # ttl(value), if given, picks the lifetime of each loaded value
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            # Callers missing the same key at once share a single load
+            value = self.flights.do(key, lambda: self._load(key, loader, ttl))
+        return value
+
+    def _load(self, key, loader, ttl):
+        value = loader()
+        self.set(key, value, ttl(value) if ttl else None)
+        return value
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
@@ -1,29 +1,336 @@
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import os
-from dotenv import load_dotenv
+import time
+import asyncio
+import weakref
+import threading
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlsplit
+from config import load_env
+from http_client import get_async_service
+from telemetry import cache_result, get_logger, timed
+from ttl_cache import TTLCache
 
-load_dotenv()
+load_env()
 
-def get_video_info(video_id):
-    youtube = build("youtube", "v3", developerKey=os.getenv("YOUTUBE_API_KEY"))
+youtube_timeout = float(os.getenv("YOUTUBE_TIMEOUT", "15"))
+youtube_retries = int(os.getenv("HTTP_RETRIES", "3"))
+youtube_api_url = os.getenv("YOUTUBE_API_URL", "https://www.googleapis.com/youtube/v3")
+video_info_ttl = float(os.getenv("VIDEO_INFO_TTL", "86400"))
+video_info_cache_size = int(os.getenv("VIDEO_INFO_CACHE_SIZE", "50000"))
+# Lookups arriving within this window share one videos.list call
+batch_window = float(os.getenv("VIDEO_INFO_BATCH_MS", "20")) / 1000
 
-    try:
-        request = youtube.videos().list(
-            part="snippet",
-            id=video_id
+# videos.list and playlistItems.list return at most 50 items per call, and
+# each call costs one quota unit whatever the number of ids
+MAX_IDS = 50
+
+UNKNOWN = {"title": "Unknown", "channel": "Unknown"}
+ERROR = {"title": "Error", "channel": "Error"}
+
+log = get_logger("video_info")
+
+# Titles and channels rarely change; errors are not cached
+_info_cache = TTLCache(video_info_ttl, maxsize=video_info_cache_size)
+
+# Building the client parses the discovery document, so do it once; httplib2
+# connections are not thread-safe, hence one client per thread
+_clients = threading.local()
+
+
+def get_youtube_client():
+    youtube = getattr(_clients, "youtube", None)
+    if youtube is None:
+        import httplib2
+        from googleapiclient.discovery import build
+
+        youtube = build(
+            "youtube",
+            "v3",
+            developerKey=os.getenv("YOUTUBE_API_KEY"),
+            http=httplib2.Http(timeout=youtube_timeout),
+            cache_discovery=False,
         )
-        response = request.execute()
+        _clients.youtube = youtube
+    return youtube
+
+
+def _parse_videos(video_ids, response):
+    infos = {
+        item["id"]: {
+            "title": item["snippet"]["title"],
+            "channel": item["snippet"]["channelTitle"],
+        }
+        for item in response.get("items", [])
+    }
+    return {video_id: infos.get(video_id, UNKNOWN) for video_id in video_ids}
+
 
-        if response["items"]:
-            snippet = response["items"][0]["snippet"]
-            return {
-                "title": snippet["title"],
-                "channel": snippet["channelTitle"]
-            }
-        else:
-            return {"title": "Unknown", "channel": "Unknown"}
+def fetch_videos_info(video_ids):
+    # One videos.list call for up to MAX_IDS videos
+    from googleapiclient.errors import HttpError
 
+    request = get_youtube_client().videos().list(
+        part="snippet", id=",".join(video_ids), maxResults=MAX_IDS
+    )
+    try:
+        with timed("video_info", videos=len(video_ids)):
+            response = request.execute(num_retries=youtube_retries)
     except HttpError as e:
-        print(f"An HTTP error occurred: {e}")
-        return {"title": "Error", "channel": "Error"}
\ No newline at end of file
+        log.warning("video_info_failed", videos=len(video_ids), error=str(e))
+        return {video_id: ERROR for video_id in video_ids}
+    return _parse_videos(video_ids, response)
+
+
+async def afetch_videos_info(video_ids):
+    import httpx
+
+    # The discovery client is sync only, so the async variant calls the REST
+    # endpoint directly
+    try:
+        with timed("video_info", videos=len(video_ids)):
+            response = await get_async_service("youtube").get(
+                f"{youtube_api_url}/videos",
+                params={
+                    "part": "snippet",
+                    "id": ",".join(video_ids),
+                    "maxResults": MAX_IDS,
+                    "key": os.getenv("YOUTUBE_API_KEY"),
+                },
+            )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        log.warning("video_info_failed", videos=len(video_ids), error=str(e))
+        return {video_id: ERROR for video_id in video_ids}
+    return _parse_videos(video_ids, response.json())
+
+
+def _cache(infos):
+    for video_id, info in infos.items():
+        if info is not ERROR:
+            _info_cache.set(video_id, info)
+
+
+class VideoInfoBatcher:
+    # Collects the ids looked up from every thread and fetches them MAX_IDS at
+    # a time, so per-video lookups cost one call per batch instead of one per
+    # video
+    def __init__(self, fetch=fetch_videos_info, window=batch_window):
+        self.fetch = fetch
+        self.window = window
+        self.pending = {}
+        self.queue = []
+        self.flushing = False
+        self.lock = threading.Lock()
+
+    def request(self, video_ids):
+        # {video_id: Future}; lookups already pending are joined
+        futures = {}
+        with self.lock:
+            for video_id in video_ids:
+                future = self.pending.get(video_id)
+                if future is None:
+                    future = self.pending[video_id] = Future()
+                    self.queue.append(video_id)
+                futures[video_id] = future
+            start = bool(self.queue) and not self.flushing
+            if start:
+                self.flushing = True
+        if start:
+            threading.Thread(target=self._flush, daemon=True).start()
+        return futures
+
+    def find(self, video_id):
+        # The Future of a lookup already queued or running, or None
+        with self.lock:
+            return self.pending.get(video_id)
+
+    def _flush(self):
+        while True:
+            with self.lock:
+                waiting = len(self.queue)
+            if waiting < MAX_IDS:
+                # Give concurrent lookups a moment to join the batch
+                time.sleep(self.window)
+            with self.lock:
+                batch = self.queue[:MAX_IDS]
+                del self.queue[:MAX_IDS]
+                if not batch:
+                    self.flushing = False
+                    return
+            try:
+                infos = self.fetch(batch)
+            except Exception as e:
+                log.warning("video_info_failed", videos=len(batch), error=str(e))
+                infos = {video_id: ERROR for video_id in batch}
+            _cache(infos)
+            with self.lock:
+                futures = [self.pending.pop(video_id) for video_id in batch]
+            for video_id, future in zip(batch, futures):
+                future.set_result(infos[video_id])
+
+
+_batcher = VideoInfoBatcher()
+
+
+def request_video_info(video_id):
+    # A Future of the video's info, so the lookup can run while the
+    # transcript is fetched; already done on a cache hit
+    info = _info_cache.get(video_id)
+    cache_result("video_info", info is not None)
+    if info is not None:
+        future = Future()
+        future.set_result(info)
+        return future
+    return _batcher.request([video_id])[video_id]
+
+
+def get_video_info(video_id):
+    return request_video_info(video_id).result()
+
+
+def prefetch_video_info(video_ids):
+    # Queues the lookups of many videos at once, without waiting for them
+    missing = [video_id for video_id in video_ids if _info_cache.get(video_id) is None]
+    if missing:
+        _batcher.request(missing)
+
+
+class AsyncVideoInfoBatcher:
+    # asyncio counterpart of VideoInfoBatcher, one per event loop
+    def __init__(self, window=batch_window):
+        self.window = window
+        self.pending = {}
+        self.queue = []
+        self.task = None
+
+    async def get(self, video_id):
+        future = self.pending.get(video_id)
+        if future is None:
+            future = self.pending[video_id] = asyncio.get_running_loop().create_future()
+            self.queue.append(video_id)
+            if self.task is None:
+                self.task = asyncio.ensure_future(self._flush())
+        # Shielded so a cancelled caller does not fail the others
+        return await asyncio.shield(future)
+
+    async def _flush(self):
+        try:
+            while self.queue:
+                if len(self.queue) < MAX_IDS:
+                    await asyncio.sleep(self.window)
+                batch = self.queue[:MAX_IDS]
+                del self.queue[:MAX_IDS]
+                try:
+                    infos = await afetch_videos_info(batch)
+                except Exception as e:
+                    log.warning("video_info_failed", videos=len(batch), error=str(e))
+                    infos = {video_id: ERROR for video_id in batch}
+                _cache(infos)
+                for video_id in batch:
+                    self.pending.pop(video_id).set_result(infos[video_id])
+        finally:
+            self.task = None
+            # Only left over when the flush was cancelled; nothing else would
+            # resolve them
+            pending, self.pending, self.queue = self.pending, {}, []
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(Exception("Video info lookup was cancelled"))
+
+
+_async_batchers = weakref.WeakKeyDictionary()
+
+
+async def aget_video_info(video_id):
+    info = _info_cache.get(video_id)
+    cache_result("video_info", info is not None)
+    if info is not None:
+        return info
+    # A lookup the thread batcher already has under way, such as one queued
+    # by prefetch_video_info, is joined rather than made again. It caches the
+    # info before dropping the lookup, so the cache is checked once more
+    future = _batcher.find(video_id)
+    if future is not None:
+        return await asyncio.shield(asyncio.wrap_future(future))
+    info = _info_cache.get(video_id)
+    if info is not None:
+        return info
+    loop = asyncio.get_running_loop()
+    if loop not in _async_batchers:
+        _async_batchers[loop] = AsyncVideoInfoBatcher()
+    return await _async_batchers[loop].get(video_id)
+
+
+def parse_collection_url(url):
+    # ("playlist", id), ("channel", id), ("handle", name) or ("user", name)
+    # for playlist and channel URLs, None for anything else. A watch URL that
+    # is part of a playlist is still a single video
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    path = parts.path.rstrip("/")
+    if "list" in query and "v" not in query:
+        return "playlist", query["list"][0]
+    segments = path.split("/")
+    for i, segment in enumerate(segments[:-1]):
+        if segment == "channel":
+            return "channel", segments[i + 1]
+        if segment == "user":
+            return "user", segments[i + 1]
+        if segment == "c":
+            # Legacy custom URLs mostly match the channel's handle today
+            return "handle", segments[i + 1]
+    for segment in segments:
+        if segment.startswith("@"):
+            return "handle", segment[1:]
+    return None
+
+
+def _uploads_playlist(kind, value):
+    if kind == "channel" and value.startswith("UC"):
+        # Every channel's uploads playlist id is its channel id with UU
+        return "UU" + value[2:]
+    field = {"channel": "id", "handle": "forHandle", "user": "forUsername"}[kind]
+    request = get_youtube_client().channels().list(part="contentDetails", **{field: value})
+    with timed("channel_lookup", kind=kind):
+        response = request.execute(num_retries=youtube_retries)
+    if not response.get("items"):
+        raise Exception(f"Channel {value} not found")
+    return response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+
+
+def expand_url(url, limit=None):
+    # Video ids of a playlist or channel URL, newest first for channels, or
+    # None if the URL is not a playlist or channel. The listing already
+    # carries each video's title and channel, which go to the info cache so
+    # the videos need no videos.list call of their own
+    collection = parse_collection_url(url)
+    if collection is None:
+        return None
+    kind, value = collection
+    playlist_id = value if kind == "playlist" else _uploads_playlist(kind, value)
+    video_ids = []
+    page_token = None
+    with timed("playlist_expand", kind=kind):
+        while limit is None or len(video_ids) < limit:
+            request = get_youtube_client().playlistItems().list(
+                part="snippet",
+                playlistId=playlist_id,
+                maxResults=MAX_IDS if limit is None else min(MAX_IDS, limit - len(video_ids)),
+                pageToken=page_token,
+            )
+            response = request.execute(num_retries=youtube_retries)
+            for item in response.get("items", []):
+                snippet = item["snippet"]
+                video_id = snippet["resourceId"]["videoId"]
+                video_ids.append(video_id)
+                # Private and deleted videos have no owner
+                if "videoOwnerChannelTitle" in snippet:
+                    _info_cache.set(
+                        video_id,
+                        {"title": snippet["title"], "channel": snippet["videoOwnerChannelTitle"]},
+                    )
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+    log.info("playlist_expanded", kind=kind, videos=len(video_ids))
+    return video_ids
@@ -1,18 +1,433 @@
-from gradio_client import Client, handle_file
-from yt_audiophile import download_audio
+import os
+import sys
+import math
+import time
+import queue
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from config import load_env
+from pydub import AudioSegment
+from pydub.silence import detect_leading_silence
+from pydub.utils import get_encoder_name, mediainfo
+from telemetry import AUDIO_BYTES, timed
+
+load_env()
+
+whisper_backend = os.getenv("WHISPER_BACKEND", "remote")
+whisper_url = os.getenv("WHISPER_URL", "http://192.168.178.121:8300/")
+whisper_model = os.getenv("WHISPER_MODEL", "Systran/faster-whisper-large-v3")
+whisper_compute_type = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+whisper_cpu_threads = int(os.getenv("WHISPER_CPU_THREADS", "0"))
+whisper_workers = int(os.getenv("WHISPER_WORKERS", "2"))
+window_seconds = int(os.getenv("WHISPER_WINDOW_SECONDS", "300"))
+# Audio handed to Whisper, resampled to 16 kHz mono: opus (smallest upload),
+# flac, wav, or source to send the downloaded file as is. auto sends whole
+# files as downloaded, already a low bitrate stream, and encodes windows as
+# opus, or as wav for the local backend which uploads nothing
+whisper_audio_format = os.getenv("WHISPER_AUDIO_FORMAT", "auto").lower()
+whisper_opus_kbps = int(os.getenv("WHISPER_OPUS_KBPS", "24"))
+# Silence at the start and end of each window is cut before transcription
+whisper_trim_silence = os.getenv("WHISPER_TRIM_SILENCE", "false").lower() == "true"
+whisper_silence_db = float(os.getenv("WHISPER_SILENCE_DB", "-40"))
+# A window is only cut from a partial download once this much audio past its
+# end has arrived, since bitrate is only roughly constant
+WINDOW_MARGIN = 0.05
+# Whisper resamples everything to 16 kHz mono
+SAMPLE_RATE = 16000
+# Kept around trimmed speech so the first and last words are not clipped
+SILENCE_PADDING_MS = 200
+
+# Extension and ffmpeg encoder options per audio format. Opus runs at its
+# lowest complexity: several times faster, and the file is barely larger
+AUDIO_FORMATS = {
+    "opus": ("ogg", ["-c:a", "libopus", "-b:a", f"{whisper_opus_kbps}k", "-compression_level", "0"]),
+    "flac": ("flac", ["-c:a", "flac"]),
+    "wav": ("wav", ["-c:a", "pcm_s16le"]),
+}
+
+
+class RemoteWhisperBackend:
+    # gradio Client construction does a handshake and fetches the API schema,
+    # so clients are kept warm in a pool and reused across requests. The
+    # semaphore bounds the transcriptions in flight; a client dropped after a
+    # failure is replaced by a new one when the next caller needs it
+    def __init__(self, url=whisper_url, model=whisper_model, pool_size=whisper_workers):
+        self.url = url
+        self.model = model
+        self.pool_size = max(1, pool_size)
+        self.clients = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.pool_size)
+
+    def _acquire(self):
+        try:
+            return self.clients.get_nowait()
+        except queue.Empty:
+            pass
+        # gradio_client is only needed by this backend and is slow to import
+        from gradio_client import Client
+
+        return Client(self.url)
+
+    def transcribe(self, file_path):
+        from gradio_client import handle_file
+
+        with self.slots:
+            client = self._acquire()
+            # Not handed back on failure: the connection may be broken
+            result = client.predict(
+                file_path=handle_file(file_path),
+                model=self.model,
+                task="transcribe",
+                temperature=0,
+                stream=False,
+                api_name="/predict",
+            )
+            self.clients.put(client)
+        return result
+
+
+class LocalWhisperBackend:
+    # Runs faster-whisper in process; the model is loaded once and shared by
+    # all requests, num_workers lets that many transcriptions run at once
+    def __init__(
+        self,
+        model=whisper_model,
+        compute_type=whisper_compute_type,
+        workers=whisper_workers,
+        cpu_threads=whisper_cpu_threads,
+        device="cpu",
+    ):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise Exception(
+                "WHISPER_BACKEND=local requires faster-whisper (pip install faster-whisper)"
+            )
+        self.model = WhisperModel(
+            model,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=max(1, workers),
+        )
+
+    def transcribe(self, file_path):
+        return " ".join(segment["text"] for segment in self.transcribe_segments(file_path))
+
+    def transcribe_segments(self, file_path):
+        segments, _ = self.model.transcribe(file_path, task="transcribe", temperature=0)
+        return [
+            {
+                "start": segment.start,
+                "duration": segment.end - segment.start,
+                "text": segment.text.strip(),
+            }
+            for segment in segments
+        ]
+
+
+BACKENDS = {
+    "remote": RemoteWhisperBackend,
+    "local": LocalWhisperBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if whisper_backend not in BACKENDS:
+                raise Exception(
+                    f"Unknown WHISPER_BACKEND {whisper_backend}, expected one of {', '.join(BACKENDS)}"
+                )
+            _backend = BACKENDS[whisper_backend]()
+        return _backend
 
 
 def transcribe(file_path):
-    client = Client("http://192.168.178.121:8300/")
-    result = client.predict(
-        file_path=handle_file(file_path),
-        model="Systran/faster-whisper-large-v3",
-        task="transcribe",
-        temperature=0,
-        stream=False,
-        api_name="/predict",
+    with timed("whisper", backend=whisper_backend, file=os.path.basename(file_path)):
+        return get_backend().transcribe(file_path)
+
+
+def transcribe_segments(file_path):
+    # Timed segments from backends that report them (local); the remote
+    # backend only returns text, which becomes a single untimed segment
+    backend = get_backend()
+    if not hasattr(backend, "transcribe_segments"):
+        return [{"start": 0.0, "duration": 0.0, "text": transcribe(file_path).strip()}]
+    with timed("whisper", backend=whisper_backend, file=os.path.basename(file_path)):
+        return backend.transcribe_segments(file_path)
+
+
+def file_format(audio_format=None):
+    audio_format = audio_format or whisper_audio_format
+    return "source" if audio_format == "auto" else audio_format
+
+
+def window_format(audio_format=None):
+    # Windows are cut out of the download, so they are always re-encoded
+    audio_format = audio_format or whisper_audio_format
+    if audio_format == "auto":
+        return "wav" if whisper_backend == "local" else "opus"
+    return "flac" if audio_format == "source" else audio_format
+
+
+def _encode(input_args, output_base, audio_format, data=None):
+    extension, options = AUDIO_FORMATS[audio_format]
+    output_path = f"{output_base}.{extension}"
+    result = subprocess.run(
+        [
+            get_encoder_name(),
+            "-v", "error",
+            "-y",
+            *input_args,
+            "-vn",
+            "-ac", "1",
+            "-ar", str(SAMPLE_RATE),
+            *options,
+            output_path,
+        ],
+        input=data,
+        capture_output=True,
     )
-    print(result)
-    return result
+    if result.returncode != 0:
+        raise Exception(result.stderr.decode("utf-8", "replace").strip())
+    AUDIO_BYTES.inc(os.path.getsize(output_path), direction="whisper")
+    return output_path
+
+
+def transcode(path, output_base, audio_format):
+    # Decodes and re-encodes in one streaming ffmpeg pass; returns the path of
+    # the 16 kHz mono file
+    return _encode(["-i", path], output_base, audio_format)
+
+
+def encode_pcm(audio, output_base, audio_format):
+    # audio is a 16 kHz mono AudioSegment
+    return _encode(
+        ["-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "-"],
+        output_base,
+        audio_format,
+        data=audio.raw_data,
+    )
+
+
+def trim_silence(audio, threshold=None):
+    # (trimmed audio, seconds cut from the start); only the ends are cut, so
+    # the timestamps inside stay valid once shifted by the lead
+    threshold = whisper_silence_db if threshold is None else threshold
+    lead = detect_leading_silence(audio, silence_threshold=threshold)
+    if lead >= len(audio):
+        return audio[:0], 0.0
+    tail = detect_leading_silence(audio.reverse(), silence_threshold=threshold)
+    lead = max(0, lead - SILENCE_PADDING_MS)
+    tail = max(0, tail - SILENCE_PADDING_MS)
+    return audio[lead : len(audio) - tail], lead / 1000
+
+
+def transcribe_audio(path, transcribe_fn=transcribe_segments, audio_format=None):
+    # Transcribes a whole file, transcoded to 16 kHz mono first unless the
+    # format is source. Silence is only trimmed per window, since cutting the
+    # whole file would need it decoded in memory
+    audio_format = file_format(audio_format)
+    if audio_format == "source":
+        AUDIO_BYTES.inc(os.path.getsize(path), direction="whisper")
+        return transcribe_fn(path)
+    tmpdir = tempfile.mkdtemp(prefix="whisper_")
+    try:
+        with timed("transcode", format=audio_format, file=os.path.basename(path)):
+            encoded = transcode(path, os.path.join(tmpdir, "audio"), audio_format)
+        return transcribe_fn(encoded)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class WindowedTranscription:
+    # Cuts the audio into fixed windows while it is still downloading and
+    # transcribes the windows concurrently; feed() is meant to be used as the
+    # download progress callback and finish() returns the timed segments.
+    # transcribe_fn returns the segments of a window file
+    def __init__(
+        self,
+        transcribe_fn=transcribe_segments,
+        window=window_seconds,
+        workers=2,
+        audio_format=None,
+        trim=None,
+    ):
+        self.transcribe_fn = transcribe_fn
+        self.window = window
+        self.audio_format = window_format(audio_format)
+        self.trim = whisper_trim_silence if trim is None else trim
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.condition = threading.Condition()
+        self.path = None
+        self.fraction = 0.0
+        self.duration = None
+        self.complete = False
+        self.cancelled = False
+        self.futures = []
+        self.tmpdir = tempfile.mkdtemp(prefix="whisper_")
+        self.cutter = threading.Thread(target=self._cut_loop, daemon=True)
+        self.cutter.start()
+
+    def feed(self, path, bytes_done, total_bytes, duration):
+        with self.condition:
+            self.path = path
+            self.fraction = bytes_done / total_bytes if total_bytes else 0.0
+            self.duration = duration
+            self.condition.notify()
+
+    def finish(self, path):
+        duration = self.duration
+        if not duration:
+            try:
+                duration = float(mediainfo(path)["duration"])
+            except Exception:
+                # Stops the cutter and removes the windows cut so far
+                self.cancel()
+                raise
+        with self.condition:
+            self.path = path
+            self.fraction = 1.0
+            self.duration = duration
+            self.complete = True
+            self.condition.notify()
+        self.cutter.join()
+        try:
+            if self.cancelled:
+                raise Exception("Transcription cancelled")
+            return [segment for future in self.futures for segment in future.result()]
+        finally:
+            self._cleanup()
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify()
+        self.cutter.join()
+        self._cleanup()
+
+    def _cleanup(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for name in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, name))
+        os.rmdir(self.tmpdir)
+
+    def _cut_loop(self):
+        index = 0
+        while True:
+            with self.condition:
+                while True:
+                    if self.cancelled:
+                        return
+                    total = (
+                        math.ceil(self.duration / self.window) if self.duration else None
+                    )
+                    if total is not None and index >= total:
+                        return
+                    if self.duration:
+                        available = self.duration * (self.fraction - WINDOW_MARGIN)
+                        if self.complete or available >= (index + 1) * self.window:
+                            break
+                    self.condition.wait()
+                path = self.path
+                duration = self.duration
+                complete = self.complete
+            start = index * self.window
+            length = min(self.window, duration - start)
+            try:
+                window = self._cut(path, index, start, length, complete)
+            except Exception as e:
+                if complete:
+                    self.futures.append(self.executor.submit(_raise, e))
+                    index += 1
+                    continue
+                # The partial file may not be decodable that far yet
+                with self.condition:
+                    if not self.complete and not self.cancelled:
+                        self.condition.wait()
+                continue
+            self.futures.append(self.executor.submit(self._transcribe_window, *window))
+            index += 1
+
+    def _cut(self, path, index, start, length, complete):
+        # (window path, start, length) of the audio to transcribe; the path is
+        # None when the window is silent
+        # Whisper works on 16 kHz mono, so there is no point uploading more
+        result = subprocess.run(
+            [
+                get_encoder_name(),
+                "-v", "error",
+                "-ss", str(start),
+                "-t", str(length),
+                "-i", path,
+                "-ac", "1",
+                "-ar", str(SAMPLE_RATE),
+                "-f", "s16le",
+                "-",
+            ],
+            capture_output=True,
+        )
+        audio = AudioSegment(result.stdout, sample_width=2, frame_rate=SAMPLE_RATE, channels=1)
+        if not complete and audio.duration_seconds < length - 1:
+            raise Exception(f"Window {index} is not fully downloaded yet")
+        if result.returncode != 0 and not audio.duration_seconds:
+            raise Exception(result.stderr.decode("utf-8", "replace").strip())
+        if self.trim:
+            audio, lead = trim_silence(audio)
+            if not len(audio):
+                return None, start, 0.0
+            start += lead
+        window_path = encode_pcm(audio, os.path.join(self.tmpdir, f"{index:05d}"), self.audio_format)
+        return window_path, start, audio.duration_seconds
+
+    def _transcribe_window(self, window_path, start, length):
+        if window_path is None:
+            return []
+        segments = self.transcribe_fn(window_path)
+        if len(segments) == 1 and not segments[0]["duration"]:
+            # Untimed output spans the whole window
+            return [{"start": start, "duration": length, "text": segments[0]["text"]}]
+        return [{**segment, "start": start + segment["start"]} for segment in segments]
+
+
+def _raise(error):
+    raise error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Transcribe audio files and report the real-time factor"
+    )
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=whisper_backend)
+    parser.add_argument(
+        "--audio-format", choices=[*AUDIO_FORMATS, "source", "auto"], default=whisper_audio_format
+    )
+    args = parser.parse_args(argv)
+
+    backend = BACKENDS[args.backend]()
+    total_audio = 0.0
+    total_elapsed = 0.0
+    for path in args.files:
+        duration = float(mediainfo(path)["duration"])
+        started = time.perf_counter()
+        transcribe_audio(path, backend.transcribe, args.audio_format)
+        elapsed = time.perf_counter() - started
+        total_audio += duration
+        total_elapsed += elapsed
+        print(f"{path}: {duration:.1f}s audio in {elapsed:.1f}s, RTF {elapsed / duration:.3f}")
+    print(f"Total: {total_audio:.1f}s audio in {total_elapsed:.1f}s, RTF {total_elapsed / total_audio:.3f}")
+    return 0
 
 
+if __name__ == "__main__":
+    sys.exit(main())
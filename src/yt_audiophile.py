@@ -1,9 +1,31 @@
-from pytubefix import YouTube
-from pytubefix.cli import on_progress
-from dotenv import load_dotenv
+from config import load_env
+from collections import Counter
 import os
+import time
+import uuid
+import threading
+import contextlib
+from telemetry import AUDIO_BYTES, cache_result, get_logger, timed
 
-load_dotenv()
+load_env()
+
+AUDIO_DIR = "downloads"
+audio_cache_max_age = float(os.getenv("AUDIO_CACHE_MAX_AGE_MINUTES", "60")) * 60
+audio_cache_max_bytes = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+# "low" downloads the smallest audio stream of at least AUDIO_MIN_KBPS, which
+# is plenty for speech since Whisper works on 16 kHz mono; "best" the largest
+audio_quality = os.getenv("AUDIO_QUALITY", "low").lower()
+audio_min_kbps = int(os.getenv("AUDIO_MIN_KBPS", "48"))
+
+log = get_logger("audio")
+
+# Audio files are cached as downloads/<video_id>_<itag>.<ext>; jobs asking for
+# the same file wait for a single download, and files still in use by a job
+# are never cleaned up. _path_locks maps a path to its lock and the number of
+# threads holding or waiting for it
+_path_locks = {}
+_in_use = Counter()
+_registry_lock = threading.Lock()
 
 
 def get_po_token_setting():
@@ -11,36 +33,176 @@ def get_po_token_setting():
     return env_setting
 
 
-def download_audio(url, use_po_token=None):
+def _kbps(stream):
+    # abr is a string like "128kbps", None for some streams
+    try:
+        return int(stream.abr.rstrip("kbps"))
+    except (AttributeError, ValueError):
+        return 0
+
+
+def select_audio_stream(streams, quality=None, min_kbps=None):
+    quality = quality or audio_quality
+    min_kbps = audio_min_kbps if min_kbps is None else min_kbps
+    candidates = sorted(streams.filter(only_audio=True), key=_kbps)
+    if not candidates:
+        return None
+    if quality == "best":
+        return candidates[-1]
+    adequate = [stream for stream in candidates if _kbps(stream) >= min_kbps]
+    # Opus is clearer than AAC at the same bitrate, so it wins ties
+    if adequate:
+        lowest = _kbps(adequate[0])
+        return min(
+            (stream for stream in adequate if _kbps(stream) == lowest),
+            key=lambda stream: stream.subtype != "webm",
+        )
+    return candidates[-1]
+
+
+@contextlib.contextmanager
+def _path_lock(path):
+    # The lock is dropped with its last user, so the registry only holds the
+    # paths being downloaded or cleaned up rather than every file ever seen
+    with _registry_lock:
+        entry = _path_locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _registry_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _path_locks[path]
+
+
+def _download(url, use_po_token=None, output_dir=AUDIO_DIR, acquire=False, progress=None):
+    # pytubefix pulls in aiohttp and is only needed when a video has to be
+    # downloaded
+    from pytubefix import YouTube
+    from pytubefix.cli import on_progress
+
     try:
         # If use_po_token is not provided, use the environment variable
         if use_po_token is None:
             use_po_token = get_po_token_setting()
 
+        partial_path = None
+
+        def report_progress(stream, chunk, bytes_remaining):
+            on_progress(stream, chunk, bytes_remaining)
+            if progress and partial_path:
+                progress(
+                    partial_path,
+                    stream.filesize - bytes_remaining,
+                    stream.filesize,
+                    yt.length,
+                )
+
         # Create YouTube object with bot detection bypass
         yt = YouTube(
             url,
-            on_progress_callback=on_progress,
+            on_progress_callback=report_progress,
             use_oauth=True,
             allow_oauth_cache=True,
             use_po_token=use_po_token,  # Now configurable
         )
 
         # Get audio stream
-        audio_stream = yt.streams.filter(only_audio=True).order_by("abr").desc().first()
+        audio_stream = select_audio_stream(yt.streams)
         if not audio_stream:
             raise Exception("No audio stream found")
 
-        # Download audio
-        audio_stream.download("downloads", "output.m4a")
-        return True
+        filename = f"{yt.video_id}_{audio_stream.itag}.{audio_stream.subtype}"
+        path = os.path.join(output_dir, filename)
+        with _path_lock(path):
+            cache_result("audio", os.path.exists(path))
+            if not os.path.exists(path):
+                # Download under a unique name, then move it in place atomically
+                partial = f"{filename}.{uuid.uuid4().hex}.part"
+                partial_path = os.path.join(output_dir, partial)
+                with timed(
+                    "download",
+                    video_id=yt.video_id,
+                    itag=audio_stream.itag,
+                    bytes=audio_stream.filesize,
+                ):
+                    audio_stream.download(output_dir, partial, skip_existing=False)
+                os.replace(os.path.join(output_dir, partial), path)
+                AUDIO_BYTES.inc(os.path.getsize(path), direction="download")
+            else:
+                os.utime(path)
+                if progress:
+                    size = os.path.getsize(path)
+                    progress(path, size, size, yt.length)
+            if acquire:
+                with _registry_lock:
+                    _in_use[path] += 1
+        return path
 
     except Exception as e:
-        print(f"Error in download_audio: {str(e)}")
+        log.error("download_failed", url=url, error=str(e))
         raise Exception(f"Download failed: {str(e)}")
 
 
-def itags(yt: YouTube, resolution="1080p"):
+def download_audio(url, use_po_token=None, output_dir=AUDIO_DIR):
+    # Returns the path of the cached audio file; use acquire_audio() to keep
+    # the file from being cleaned up while it is being read
+    return _download(url, use_po_token=use_po_token, output_dir=output_dir)
+
+
+def acquire_audio(url, use_po_token=None, output_dir=AUDIO_DIR, progress=None):
+    # progress(partial_path, bytes_done, total_bytes, duration_seconds) is
+    # called while the file downloads so it can be processed before it is done
+    return _download(
+        url,
+        use_po_token=use_po_token,
+        output_dir=output_dir,
+        acquire=True,
+        progress=progress,
+    )
+
+
+def release_audio(path):
+    with _registry_lock:
+        _in_use[path] -= 1
+        if _in_use[path] <= 0:
+            del _in_use[path]
+    cleanup_audio_cache(os.path.dirname(path))
+
+
+def cleanup_audio_cache(
+    output_dir=AUDIO_DIR, max_age=audio_cache_max_age, max_bytes=audio_cache_max_bytes
+):
+    now = time.time()
+    files = []
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        if name == "placeholder" or not os.path.isfile(path):
+            continue
+        files.append((os.path.getmtime(path), os.path.getsize(path), path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        expired = now - mtime > max_age
+        if not expired and total <= max_bytes:
+            break
+        if path.endswith(".part") and not expired:
+            # Still being downloaded
+            continue
+        with _path_lock(path):
+            with _registry_lock:
+                if _in_use[path]:
+                    continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+def itags(yt, resolution="1080p"):
     try:
         # Get best audio stream
         audio_stream = yt.streams.filter(only_audio=True).order_by("abr").desc().first()
@@ -52,7 +214,7 @@ def itags(yt: YouTube, resolution="1080p"):
             try:
                 video_stream = yt.streams.filter(res=resolution, fps=fps).first()
                 if video_stream:
-                    print(f"Found {fps} FPS stream")
+                    log.debug("video_stream", fps=fps, resolution=resolution)
                     break
             except IndexError:
                 continue
@@ -63,5 +225,5 @@ def itags(yt: YouTube, resolution="1080p"):
         return audio_value, video_stream.itag
 
     except Exception as e:
-        print(f"Error in itags: {str(e)}")
+        log.error("itags_failed", error=str(e))
         raise Exception(f"Stream selection failed: {str(e)}")